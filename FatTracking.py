@@ -1,133 +1,309 @@
-# ファイルの先頭で、他のインポートの前にこれらを追加
-import matplotlib
-# バックエンドを設定（'TkAgg', 'Qt5Agg', 'Agg' のいずれかを試してください）
-matplotlib.use('Agg')  
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-import pandas as pd
-from datetime import datetime, timedelta
-import json
+# 起動を速くするため、pandas / matplotlib はここでは読み込まない
+# （グラフ描画やインポートなど、必要な処理の中で読み込む）
+from concurrent.futures import Future
+from datetime import datetime
 import numpy as np
-import sys
 import os
+import shutil
+import sys
+import time
 
+from ideal_curve import get_ideal_curve
+from instrumentation import metrics
+from records import RecordColumns, sort_and_dedup
+from rollup import Rollups
+from robust_filter import FILTER_FIELDS, RobustFilter
+from rolling_stats import StatsEngine
+from storage import open_store
 
 
-# 日本語フォントの直接設定
-font_path = '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf'  # システムで検出されたパス
-font_prop = font_manager.FontProperties(fname=font_path)
-plt.rcParams['font.family'] = 'sans-serif'
-plt.rcParams['font.sans-serif'] = ['IPAGothic']
-plt.rcParams['axes.unicode_minus'] = False
-
+# 記録ファイル（追記専用の JSON Lines 形式）と、移行元の旧形式ファイル
+DATA_FILE = 'fitness_data.jsonl'
+LEGACY_DATA_FILE = 'fitness_data.json'
 
 
 class SimpleFitnessTracker:
-    def __init__(self, start_weight=68, start_bf=24, target_weight_loss=10, target_bf_loss=10, duration_days=168):
+    def __init__(self, start_weight=68, start_bf=24, target_weight_loss=10, target_bf_loss=10, duration_days=168,
+                 data_file=DATA_FILE, legacy_data_file=LEGACY_DATA_FILE):
         self.start_weight = start_weight
         self.start_bf = start_bf
         self.target_weight_loss = target_weight_loss
         self.target_bf_loss = target_bf_loss
         self.duration_days = duration_days
-        self.records = []
+        self.records = RecordColumns()
+        self.stats = StatsEngine()
+        # 日・週・月ごとの集計（統計エンジンと同じく記録の追加ごとに更新）
+        self.rollups = Rollups()
+        # 外れ値の判定と平滑トレンド（結果は各記録に保存する）
+        self.filter = RobustFilter()
         # 1kg の脂肪のカロリー価（約7700kcal）
         self.cal_per_kg_fat = 7700
+        self.data_file = data_file
+        self.legacy_data_file = legacy_data_file
+        self.store = None
+        self.renderer = None
+        # 食事記録と組み合わせたエネルギー収支モデル（attach_nutrition で作る）
+        self.nutrition = None
+        self.energy = None
+        # 計画の比較（sweep_scenarios で作り、記録が変わったら作り直す）
+        self.scenarios = None
         self.load_data()
         self.ideal_curve = self.generate_ideal_curve()
+        # 食事記録が保存されていれば TDEE の推定も始める
+        if os.path.exists(self.intake_path()):
+            self.load_nutrition()
 
     def load_data(self):
-        """JSONファイルからデータを読み込む"""
+        """ストアからデータを列形式で読み込む"""
         try:
-            with open('fitness_data.json', 'r') as f:
-                json_records = json.load(f)
-                self.records = []
-                for record in json_records:
-                    # 日付文字列をdatetimeオブジェクトに変換
-                    record['date'] = datetime.strptime(record['date'], '%Y-%m-%d %H:%M:%S')
-                    # 古いデータ形式との互換性を保持
-                    if 'weight_diff_from_ideal' not in record:
-                        record['weight_diff_from_ideal'] = 0
-                        record['bf_diff_from_ideal'] = 0
-                    self.records.append(record)
-                
-                # 最初のレコードがあれば、それを初期値として使用
-                if self.records:
-                    self.start_weight = self.records[0]['weight']
-                    self.start_bf = self.records[0]['body_fat']
-                    
-        except FileNotFoundError:
-            print("新規データファイルを作成します。")
-            self.records = []
-        except json.JSONDecodeError:
-            print("データファイルが破損しています。新規作成します。")
-            self.records = []
+            with metrics.span('load'):
+                if self.store is None:
+                    self.store = open_store(self.data_file, self.legacy_data_file)
+                # 古いデータ形式で差分が無い記録は 0 として読み込まれる
+                self.records = self.store.load_columns()
+            metrics.count('records_loaded', len(self.records))
+            with metrics.span('stats_rebuild'):
+                self.stats = StatsEngine.from_columns(self.records)
+                self.rollups = Rollups.from_columns(self.records)
+                self.filter, start = RobustFilter.from_columns(self.records)
+            if start < len(self.records):
+                # トレンドが保存されていない記録（以前の形式）は一度だけ計算して書き直す
+                self.store.compact(self.records)
+                print(f"{len(self.records) - start} 件の記録に外れ値の判定とトレンドを追加しました。")
+
+            if not self.records:
+                print("新規データファイルを作成します。")
+
+            # 最初のレコードがあれば、それを初期値として使用
+            if self.records:
+                self.start_weight = self.records[0]['weight']
+                self.start_bf = self.records[0]['body_fat']
+
         except Exception as e:
             print(f"データ読み込み中にエラーが発生しました: {str(e)}")
-            self.records = []
+            self.records = RecordColumns()
+            self.stats = StatsEngine()
+            self.rollups = Rollups()
+            self.filter = RobustFilter()
 
     def save_data(self):
-        """データをJSONファイルに保存"""
+        """全記録でデータファイルを書き直す（通常の追加は append_data を使う）"""
+        try:
+            with metrics.span('save'):
+                self.store.compact(self.records)
+        except Exception as e:
+            print(f"データ保存中にエラーが発生しました: {str(e)}")
+
+    def append_data(self, record):
+        """1件の記録をデータファイルに追記"""
         try:
-            with open('fitness_data.json', 'w') as f:
-                json_records = []
-                for record in self.records:
-                    record_copy = record.copy()
-                    record_copy['date'] = record_copy['date'].strftime('%Y-%m-%d %H:%M:%S')
-                    json_records.append(record_copy)
-                json.dump(json_records, f)
+            with metrics.span('append'):
+                self.store.append(record)
         except Exception as e:
             print(f"データ保存中にエラーが発生しました: {str(e)}")
     
     def generate_ideal_curve(self):
-        """理想的な減少曲線を生成"""
+        """理想的な減少曲線を生成（同じパラメータならキャッシュを再利用）"""
         # 開始日を設定（記録がある場合は最初の記録の日付、ない場合は現在の日付）
         start_date = self.records[0]['date'] if self.records else datetime.now()
-        
-        # 開始日から指定日数分の日付を生成
-        dates = [start_date + timedelta(days=x) for x in range(self.duration_days + 1)]
-        
-        # 非線形な減少曲線を生成
-        days = np.array(range(self.duration_days + 1))
-        weight_loss = self.target_weight_loss * (1 - np.exp(-days/120))
-        bf_loss = self.target_bf_loss * (1 - np.exp(-(days-7)/100))
-        
-        ideal_weights = self.start_weight - weight_loss
-        ideal_bf = self.start_bf - bf_loss
-        
-        return pd.DataFrame({
-            'date': dates,
-            'ideal_weight': ideal_weights,
-            'ideal_bf': ideal_bf
-        })
+        with metrics.span('ideal_curve'):
+            return get_ideal_curve(start_date, self.start_weight, self.start_bf,
+                                   self.target_weight_loss, self.target_bf_loss, self.duration_days)
     
-    def add_record(self):
+    def import_columns(self, incoming, replace=False):
+        """列形式の記録をまとめて追加し、追加した件数を返す
+
+        既存の記録と同じ日時のものは除外する（replace=True なら値が違うときは取り込む方で
+        置き換える）。理想値との差分は一括で計算し、ストアへの書き込みは1回で行う。
+        """
+        incoming, _ = sort_and_dedup(incoming)
+        existing = self.records
+        if existing:
+            index = np.minimum(np.searchsorted(existing.dates, incoming.dates), len(existing) - 1)
+            same_date = existing.dates[index] == incoming.dates
+            if replace:
+                same_values = (same_date
+                               & (existing.column('weight')[index] == incoming.column('weight'))
+                               & (existing.column('body_fat')[index] == incoming.column('body_fat')))
+                incoming = incoming.take(np.flatnonzero(~same_values))
+                existing = existing.take(np.flatnonzero(~np.isin(existing.dates, incoming.dates)))
+            else:
+                incoming = incoming.take(np.flatnonzero(~same_date))
+        if not incoming:
+            return 0
+
+        # 理想値との差分と外れ値の判定・トレンドは、取り込む記録のうち最も古いもの以降を計算し直す。
+        # 既存の記録の値も変わるので、それ以降はまとめて書き直す（同じ日時は後の行が有効。
+        # 書き直す分が多ければストアが全体を書き直す）
+        merged = RecordColumns(capacity=len(existing) + len(incoming))
+        merged.extend(existing)
+        merged.extend(incoming)
+        merged, _ = sort_and_dedup(merged)
+        start = int(np.searchsorted(merged.dates, incoming.dates[0]))
+
+        # 最初の記録を開始点にする。取り込む記録の方が古ければ開始点が変わり（このとき start は 0）、
+        # 既存の記録の理想値との差分も新しい曲線で計算し直すことになる
+        first = merged[0]
+        start_weight = first['weight']
+        start_bf = first['body_fat']
+        curve = get_ideal_curve(first['date'], start_weight, start_bf,
+                                self.target_weight_loss, self.target_bf_loss, self.duration_days)
+        weight_diff, bf_diff = curve.diffs(merged.dates[start:], merged.values('weight')[start:],
+                                           merged.values('body_fat')[start:])
+        merged.column('weight_diff_from_ideal')[start:] = weight_diff
+        merged.column('bf_diff_from_ideal')[start:] = bf_diff
+        robust, _ = RobustFilter.from_columns(merged, start)
+        # start 以降の既存の記録は書き直すので、ストアにある古い版は無効になる
+        added = int(np.count_nonzero(~np.isin(incoming.dates, self.records.dates)))
         try:
+            with metrics.span('append'):
+                self.store.rewrite_tail(merged, start, len(merged) - start - added)
+        except Exception as e:
+            print(f"データ保存中にエラーが発生しました: {str(e)}")
+            return 0
+
+        self.records = merged
+        self.filter = robust
+        self.start_weight = start_weight
+        self.start_bf = start_bf
+        self.ideal_curve = curve
+        with metrics.span('stats_rebuild'):
+            self.stats = StatsEngine.from_columns(self.records)
+            self.rollups = Rollups.from_columns(self.records)
+        metrics.count('records_imported', len(incoming))
+        self._reset_scenarios()
+        if self.energy is not None:
+            self.attach_nutrition(self.nutrition)
+        return len(incoming)
+
+    def intake_path(self):
+        """データファイルの隣に置く食事記録のパス"""
+        return os.path.splitext(self.data_file)[0] + '_intake.jsonl'
+
+    def load_nutrition(self):
+        """保存した食事記録（intake_path）を読み込んで attach_nutrition する"""
+        from calculator import NutritionCalculator
+        return self.attach_nutrition(NutritionCalculator.load(self.intake_path()))
+
+    def attach_nutrition(self, calculator):
+        """NutritionCalculator の食事記録と体重の記録から TDEE の推定を始める
+
+        以降は add_measurement と、calculator への食品の追加（add_food / add_foods /
+        log_intake）のたびに1日分ずつ更新する。摂取カロリーは calculator の食事記録だけに持つ。
+        """
+        from energy_balance import EnergyBalanceModel
+        if self.nutrition is not None and self._on_intake in self.nutrition.listeners:
+            self.nutrition.listeners.remove(self._on_intake)
+        self.nutrition = calculator
+        if calculator is not None and self._on_intake not in calculator.listeners:
+            calculator.listeners.append(self._on_intake)
+        self.energy = EnergyBalanceModel.from_sources(self.records, calculator.log if calculator else None,
+                                                      cal_per_kg=self.cal_per_kg_fat)
+        return self.energy
+
+    def _on_intake(self, dates, calories):
+        """食事記録に追加された摂取カロリーをエネルギー収支モデルに反映する"""
+        if self.energy is None:
+            return
+        days, codes = np.unique(np.asarray(dates, dtype='datetime64[D]'), return_inverse=True)
+        if self.energy.day is not None and int(days[0].astype(np.int64)) < self.energy.day:
+            # モデルが進んだ日より前の摂取は逐次には反映できないので、食事記録から作り直す
+            self.attach_nutrition(self.nutrition)
+            return
+        totals = np.bincount(codes, weights=np.asarray(calories, dtype=np.float64), minlength=len(days))
+        for day, total in zip(days, totals.tolist()):
+            self.energy.update(day, intake=total)
+
+    def log_intake(self, calories, date=None):
+        """摂取カロリーを食事記録に加える（モデルには食事記録から反映される）
+
+        食事記録をまだ使っていなければ、保存した食事記録を読み込んでから加える。
+        """
+        if self.nutrition is None:
+            self.load_nutrition()
+        self.nutrition.add_food('摂取カロリー', calories, 0, 0, 0, date=date or datetime.now().date())
+
+    def import_file(self):
+        """CSV / JSON Lines ファイルから記録を一括で取り込む"""
+        from importer import import_file, print_import_result
+        path = input("インポートするファイルのパスを入力してください: ").strip()
+        try:
+            result = import_file(self, path)
+        except FileNotFoundError:
+            print("ファイルが見つかりません。")
+            return
+        except ValueError as e:
+            print(f"インポートできませんでした: {str(e)}")
+            return
+        print_import_result(result)
+
+    def add_measurement(self, weight, body_fat, date=None):
+        """体重と体脂肪率の記録を1件追加し、追加した記録を返す
+
+        date を省略すると現在日時。最新の記録より前の日時を指定した場合は
+        import_columns と同じく並べ直して追加し、同じ日時の記録があれば ValueError、
+        保存に失敗したら OSError。
+        """
+        if date is None:
             date = datetime.now()
+        # 記録は秒単位で保存する
+        date = date.replace(microsecond=0)
+        if self.records and date <= self.records[-1]['date']:
+            index = int(np.searchsorted(self.records.dates, np.datetime64(date, 's')))
+            if self.records.dates[index] == np.datetime64(date, 's'):
+                raise ValueError("同じ日時の記録が既にあります。")
+            if not self.import_columns(RecordColumns.from_records([
+                    {'date': date, 'weight': weight, 'body_fat': body_fat}])):
+                # 保存に失敗した（エラーは import_columns が表示済み、記録は追加されていない）
+                raise OSError("記録を保存できませんでした。")
+            return self.records[index]
+
+        if not self.records:
+            # 最初の記録を開始点にする（読み込み時と同じ扱い）
+            self.start_weight = weight
+            self.start_bf = body_fat
+            self.ideal_curve = get_ideal_curve(date, self.start_weight, self.start_bf, self.target_weight_loss,
+                                               self.target_bf_loss, self.duration_days)
+
+        # 理想値との差分を計算
+        ideal_weight, ideal_bf = self.ideal_curve.at(date)
+        weight_diff = weight - ideal_weight
+        bf_diff = body_fat - ideal_bf
+        
+        record = {
+            'date': date,
+            'weight': weight,
+            'body_fat': body_fat,
+            'weight_diff_from_ideal': weight_diff,
+            'bf_diff_from_ideal': bf_diff
+        }
+        self.records.append(record)
+        # 統計エンジンには保存された値（float32 の最短表記、読み込み時と同じ値）を渡す
+        stored = self.records[-1]
+        stored_weight = stored['weight']
+        stored_bf = stored['body_fat']
+        self.stats.update(date, stored_weight, stored_bf)
+        self.rollups.update(date, stored_weight, stored_bf)
+        # 外れ値の判定とトレンドは記録と一緒に保存する
+        record.update(self.filter.update(date, stored_weight, stored_bf))
+        for name in FILTER_FIELDS:
+            self.records.column(name)[-1] = record[name]
+        if self.energy is not None:
+            self.energy.update(date, weight=stored_weight)
+        self._reset_scenarios()
+        self.append_data(record)
+        return record
+
+    def add_record(self):
+        try:
             weight = float(input("体重(kg)を入力してください: "))
             body_fat = float(input("体脂肪率(%)を入力してください: "))
-            
-            # 理想値との差分を計算
-            ideal_today = self.ideal_curve[self.ideal_curve['date'].dt.date == date.date()]
-            if not ideal_today.empty:
-                weight_diff = weight - ideal_today['ideal_weight'].iloc[0]
-                bf_diff = body_fat - ideal_today['ideal_bf'].iloc[0]
-            else:
-                weight_diff = 0
-                bf_diff = 0
-            
-            record = {
-                'date': date,
-                'weight': weight,
-                'body_fat': body_fat,
-                'weight_diff_from_ideal': weight_diff,
-                'bf_diff_from_ideal': bf_diff
-            }
-            self.records.append(record)
-            self.save_data()
-            print("\n記録を保存しました。")
-            self.show_daily_stats(record)
         except ValueError:
             print("正しい数値を入力してください。")
+            return
+        record = self.add_measurement(weight, body_fat)
+        print("\n記録を保存しました。")
+        self.show_daily_stats(record)
     
     def show_daily_stats(self, record):
         """その日の統計情報を表示"""
@@ -141,47 +317,56 @@ class SimpleFitnessTracker:
             bf_change = record['body_fat'] - prev_record['body_fat']
             print(f"\n前回から体重: {weight_change:+.1f}kg")
             print(f"前回から体脂肪率: {bf_change:+.1f}%")
+
+        if record.get('weight_trend'):
+            print(f"\nトレンド体重: {record['weight_trend']:.2f}kg (±{record['weight_trend_sd']:.2f})")
+            print(f"トレンド体脂肪率: {record['bf_trend']:.2f}% (±{record['bf_trend_sd']:.2f})")
+        if record.get('weight_outlier'):
+            print("※ 体重が直近の記録から大きく外れているため、トレンドの計算では外れ値として扱いました。")
+        if record.get('bf_outlier'):
+            print("※ 体脂肪率が直近の記録から大きく外れているため、トレンドの計算では外れ値として扱いました。")
     
+    def summary(self):
+        """統計情報を dict で返す（StatsEngine.summary に開始値と目標値を加えたもの）"""
+        summary = self.stats.summary()
+        summary['start_weight'] = self.start_weight
+        summary['start_bf'] = self.start_bf
+        summary['target_weight'] = self.start_weight - self.target_weight_loss
+        summary['target_bf'] = self.start_bf - self.target_bf_loss
+        summary['trend'] = self.filter.snapshot()
+        return summary
+
     def show_stats(self):
         if not self.records:
             print("記録がありません。")
             return
-                
-        df = pd.DataFrame(self.records)
 
-        # 除脂肪体重と脂肪量の計算
-        df['lean_body_mass'] = df['weight'] * (100 - df['body_fat']) / 100
-        df['fat_mass'] = df['weight'] * df['body_fat'] / 100
+        # 統計エンジンが記録追加ごとに更新している値をそのまま使う
+        with metrics.span('stats'):
+            summary = self.stats.summary()
+        by_metric = summary['metrics']
+        weight = by_metric['weight']
+        bf = by_metric['body_fat']
+        lean_mass = by_metric['lean_body_mass']
+        fat_mass = by_metric['fat_mass']
 
-        # 5日移動平均の計算
-        df['weight_ma5'] = df['weight'].rolling(window=5).mean()
-        df['bf_ma5'] = df['body_fat'].rolling(window=5).mean()
-        df['lean_body_mass_ma5'] = df['lean_body_mass'].rolling(window=5).mean()
-        df['fat_mass_ma5'] = df['fat_mass'].rolling(window=5).mean()
-        
-        # 5日シフトした移動平均の計算
-        df['weight_ma5_shift'] = df['weight_ma5'].shift(5)
-        df['bf_ma5_shift'] = df['bf_ma5'].shift(5)
-        df['lean_body_mass_ma5_shift'] = df['lean_body_mass_ma5'].shift(5)
-        df['fat_mass_ma5_shift'] = df['fat_mass_ma5'].shift(5)
-        
         print("\n=== 移動平均の統計 ===")
-        if len(df) >= 5:
+        if summary['count'] >= 5:
             # 体重の移動平均統計
-            current_weight_ma = df['weight_ma5'].iloc[-1]
-            prev_weight_ma = df['weight_ma5_shift'].iloc[-1]
+            current_weight_ma = weight['ma5']
+            prev_weight_ma = weight['shifted_ma']
             
             # 体脂肪の移動平均統計
-            current_bf_ma = df['bf_ma5'].iloc[-1]
-            prev_bf_ma = df['bf_ma5_shift'].iloc[-1]
+            current_bf_ma = bf['ma5']
+            prev_bf_ma = bf['shifted_ma']
             
             # 除脂肪体重の移動平均統計
-            current_lean_mass_ma = df['lean_body_mass_ma5'].iloc[-1]
-            prev_lean_mass_ma = df['lean_body_mass_ma5_shift'].iloc[-1]
+            current_lean_mass_ma = lean_mass['ma5']
+            prev_lean_mass_ma = lean_mass['shifted_ma']
             
             # 脂肪量の移動平均統計
-            current_fat_mass_ma = df['fat_mass_ma5'].iloc[-1]
-            prev_fat_mass_ma = df['fat_mass_ma5_shift'].iloc[-1]
+            current_fat_mass_ma = fat_mass['ma5']
+            prev_fat_mass_ma = fat_mass['shifted_ma']
             
             if not np.isnan(prev_weight_ma):
                 weight_ma_change = current_weight_ma - prev_weight_ma
@@ -220,18 +405,26 @@ class SimpleFitnessTracker:
                 print(f"\n5日前の5日平均脂肪量: {prev_fat_mass_ma:.2f}kg")
                 print(f"直近5日平均脂肪量: {current_fat_mass_ma:.2f}kg")
                 print(f"5日前の5日平均との差: {fat_mass_ma_change:+.2f}kg")
+
+        # 外れ値を除いた平滑トレンド（記録ごとに保存済みの値）
+        trend = self.filter.snapshot()
+        print("\n=== トレンド（外れ値を除いた平滑値） ===")
+        print(f"トレンド体重: {trend['weight']['trend']:.2f}kg (±{trend['weight']['sd']:.2f}kg)")
+        print(f"トレンド体脂肪率: {trend['body_fat']['trend']:.2f}% (±{trend['body_fat']['sd']:.2f}%)")
+        print(f"外れ値と判定した記録: 体重 {trend['weight']['outliers']}件、"
+              f"体脂肪率 {trend['body_fat']['outliers']}件")
         
         print("\n=== 全体統計 ===")
         # 経過日数を計算
-        total_days = (df['date'].iloc[-1] - df['date'].iloc[0]).days
+        total_days = summary['elapsed_days']
 
         # 安全な日数計算
         if total_days == 0:
             total_days = 1
         
         # 体重関連の統計
-        start_weight = df['weight'].iloc[0]
-        current_weight = df['weight'].iloc[-1]
+        start_weight = weight['first']
+        current_weight = weight['current']
         weight_change = current_weight - start_weight
         
         # 体重変化率の計算
@@ -248,8 +441,8 @@ class SimpleFitnessTracker:
         print(f"1日あたりの体重変化: {daily_weight_change:+.3f}kg/日")
 
         # 体脂肪率関連の統計
-        start_bf = df['body_fat'].iloc[0]
-        current_bf = df['body_fat'].iloc[-1]
+        start_bf = bf['first']
+        current_bf = bf['current']
         bf_change = current_bf - start_bf
         
         # 体脂肪率変化率の計算
@@ -265,9 +458,9 @@ class SimpleFitnessTracker:
         print(f"1日あたりの体脂肪率変化: {daily_bf_change:+.3f}%/日")
         
         # カロリー収支の計算と表示
-        if len(df) >= 2:
+        if summary['count'] >= 2:
             # 実際の体重変化から総カロリー収支を計算
-            weight_change = df['weight'].iloc[-1] - df['weight'].iloc[0]
+            weight_change = current_weight - start_weight
             actual_calories = weight_change * self.cal_per_kg_fat
             actual_daily_calories = actual_calories / total_days
             
@@ -279,144 +472,136 @@ class SimpleFitnessTracker:
             print(f"目標1日カロリー収支: {target_daily_calories:.0f}kcal")
             print(f"実際の1日平均カロリー収支: {actual_daily_calories:.0f}kcal")
             print(f"目標との差異: {actual_daily_calories - target_daily_calories:+.0f}kcal/日")
+
+            if self.energy is not None and not np.isnan(self.energy.tdee):
+                print(f"推定メンテナンスカロリー（食事記録から）: {self.energy.tdee:.0f}"
+                      f" ± {self.energy.tdee_sd:.0f}kcal/日")
             
-            # 目標達成予測
-            weight_change_rate = (df['weight'].iloc[-1] - df['weight'].iloc[0]) / total_days
-            if weight_change_rate != 0:
-                days_to_target = abs((self.start_weight - self.target_weight_loss - df['weight'].iloc[-1]) / weight_change_rate)
-                print(f"\n現在のペースでの目標達成予想日数: {days_to_target:.0f}日")
-            else:
+            # 目標達成予測（直近の傾向からのシミュレーション）
+            with metrics.span('projection'):
+                projection = self.project_goal()
+            if projection is None:
                 print("\n現在のペースでは目標達成予想を計算できません。")
+            else:
+                self.show_projection(projection)
+
+        self.show_rollup('weekly')
+
+    def show_rollup(self, resolution='weekly', periods=4):
+        """直近 periods 区間の集計（平均・最小〜最大・件数）を表示"""
+        rollup = self.rollups[resolution]
+        if not len(rollup):
+            return
+        title = {'daily': '日ごとの集計', 'weekly': '週ごとの集計', 'monthly': '月ごとの集計'}[resolution]
+        print(f"\n=== {title}（直近{min(periods, len(rollup))}件） ===")
+        starts = rollup.starts[-periods:]
+        counts = rollup.counts[-periods:]
+        weight = rollup.mean('weight')[-periods:]
+        weight_min = rollup.min('weight')[-periods:]
+        weight_max = rollup.max('weight')[-periods:]
+        bf = rollup.mean('body_fat')[-periods:]
+        for i in range(len(starts)):
+            print(f"{starts[i]}〜: 体重 {weight[i]:.2f}kg ({weight_min[i]:.1f}〜{weight_max[i]:.1f}), "
+                  f"体脂肪率 {bf[i]:.2f}% ({counts[i]}件)")
     
-    def plot_progress(self):
+    def _reset_scenarios(self):
+        """記録が変わったので計画の比較を作り直す（ワーカープロセスがあれば止める）"""
+        if self.scenarios is not None:
+            self.scenarios.close()
+            self.scenarios = None
+
+    def sweep_scenarios(self, **grid):
+        """理想曲線のパラメータの候補の全組み合わせを記録と比べる（scenarios.ScenarioEngine.sweep を参照）
+
+        同じ記録に対して繰り返し呼ぶと、計算済みの組の結果を使い回す。
+        """
+        if not self.records:
+            return None
+        if self.scenarios is None:
+            from scenarios import ScenarioEngine
+            self.scenarios = ScenarioEngine.from_tracker(self)
+        with metrics.span('scenarios'):
+            return self.scenarios.sweep(**grid)
+
+    def project_goal(self, paths=10000, horizon_days=365, seed=0):
+        """目標体重に届く日の分布を予測する（projection.project_goal を参照）"""
+        from projection import project_goal
+        # 外れ値と判定した体重は予測に使わない
+        keep = self.records.column('weight_outlier') == 0
+        return project_goal(self.records.dates[keep], self.records.column('weight')[keep],
+                            self.start_weight - self.target_weight_loss,
+                            paths=paths, horizon_days=horizon_days, seed=seed, gain=self.target_weight_loss < 0)
+
+    def show_projection(self, projection):
+        model = '指数曲線' if projection['model'] == 'exp' else '直線'
+        print(f"\n=== 目標達成予測（{model}、{projection['paths']}通りのシミュレーション） ===")
+        print(f"現在のトレンド体重: {projection['current_trend']:.2f}kg")
+        horizon = projection['horizon_days']
+        print(f"{horizon}日以内に目標に届く確率: {projection['reached_fraction'] * 100:.0f}%")
+        for q, value in projection['percentiles'].items():
+            if value is None:
+                print(f"{q}%点: {horizon}日以内には届かない見込み")
+            else:
+                print(f"{q}%点: {value['days']}日後（{value['date']:%Y-%m-%d}）")
+
+    def plot_progress(self, output_path='fitness_progress.png', wait=False):
+        """グラフをバックグラウンドで描画して output_path に保存する
+
+        記録と理想曲線が前回と同じならキャッシュ済みの画像をそのまま使う。
+        wait=True なら保存が終わるまで待つ。保存先に書き終えたら output_path を結果に持つ
+        Future を返す（描画や保存に失敗したらその例外を持つ）。
+        """
         if not self.records:
             print("グラフを表示するための記録がありません。")
-            return
-                
+            return None
+
+        started = time.perf_counter()
+        done = Future()
+
+        def saved(future):
+            try:
+                shutil.copyfile(future.result(), output_path)
+                metrics.observe('render', time.perf_counter() - started)
+                print(f"グラフを '{output_path}' として保存しました。")
+                done.set_result(output_path)
+            except Exception as e:
+                metrics.error('render', e)
+                print(f"グラフの生成中にエラーが発生しました: {str(e)}")
+                done.set_exception(e)
+
         try:
-            # データフレームの準備
-            df = pd.DataFrame(self.records)
-            df['date'] = pd.to_datetime(df['date'])
-            
-            # 除脂肪体重と脂肪量の計算
-            df['lean_body_mass'] = df['weight'] * (100 - df['body_fat']) / 100
-            df['fat_mass'] = df['weight'] * df['body_fat'] / 100
-            
-            # 5日と14日の移動平均の計算
-            df['weight_ma5'] = df['weight'].rolling(window=5).mean()
-            df['weight_ma14'] = df['weight'].rolling(window=14).mean()
-            df['bf_ma5'] = df['body_fat'].rolling(window=5).mean()
-            df['bf_ma14'] = df['body_fat'].rolling(window=14).mean()
-            df['lean_body_mass_ma5'] = df['lean_body_mass'].rolling(window=5).mean()
-            df['lean_body_mass_ma14'] = df['lean_body_mass'].rolling(window=14).mean()
-            df['fat_mass_ma5'] = df['fat_mass'].rolling(window=5).mean()
-            df['fat_mass_ma14'] = df['fat_mass'].rolling(window=14).mean()
-            
-            # シグマ（標準偏差）の計算
-            sigma_weight = df['weight'].std()
-            sigma_bf = df['body_fat'].std()
-            sigma_lean_mass = df['lean_body_mass'].std()
-            sigma_fat_mass = df['fat_mass'].std()
-            
-            # グラフの作成
-            plt.figure(figsize=(15, 12))
-            
-            # 体重のプロット
-            plt.subplot(2, 2, 1)
-            plt.fill_between(self.ideal_curve['date'], 
-                            self.ideal_curve['ideal_weight'] - 2*sigma_weight,
-                            self.ideal_curve['ideal_weight'] + 2*sigma_weight,
-                            color='gray', alpha=0.1, label='±2σ')
-            plt.fill_between(self.ideal_curve['date'], 
-                            self.ideal_curve['ideal_weight'] - sigma_weight,
-                            self.ideal_curve['ideal_weight'] + sigma_weight,
-                            color='gray', alpha=0.2, label='±1σ')
-            plt.plot(self.ideal_curve['date'], self.ideal_curve['ideal_weight'], 
-                    '--', color='gray', label='理想曲線')
-            plt.plot(df['date'], df['weight'], 'o-', color='blue', label='実績', alpha=0.5)
-            plt.plot(df['date'], df['weight_ma5'], '-', color='red', label='5日移動平均')
-            plt.plot(df['date'], df['weight_ma14'], '-', color='darkred', label='14日移動平均', linewidth=2)
-            plt.title('体重推移', fontproperties=font_prop, fontsize=12)
-            plt.xlabel('日付', fontproperties=font_prop, fontsize=10)
-            plt.ylabel('体重 (kg)', fontproperties=font_prop, fontsize=10)
-            plt.grid(True)
-            plt.legend(prop=font_prop)
-            
-            # 体脂肪率のプロット
-            plt.subplot(2, 2, 2)
-            plt.fill_between(self.ideal_curve['date'], 
-                            self.ideal_curve['ideal_bf'] - 2*sigma_bf,
-                            self.ideal_curve['ideal_bf'] + 2*sigma_bf,
-                            color='gray', alpha=0.1, label='±2σ')
-            plt.fill_between(self.ideal_curve['date'], 
-                            self.ideal_curve['ideal_bf'] - sigma_bf,
-                            self.ideal_curve['ideal_bf'] + sigma_bf,
-                            color='gray', alpha=0.2, label='±1σ')
-            plt.plot(self.ideal_curve['date'], self.ideal_curve['ideal_bf'], 
-                    '--', color='gray', label='理想曲線')
-            plt.plot(df['date'], df['body_fat'], 'o-', color='orange', label='実績', alpha=0.5)
-            plt.plot(df['date'], df['bf_ma5'], '-', color='red', label='5日移動平均')
-            plt.plot(df['date'], df['bf_ma14'], '-', color='darkred', label='14日移動平均', linewidth=2)
-            plt.title('体脂肪率推移', fontproperties=font_prop, fontsize=12)
-            plt.xlabel('日付', fontproperties=font_prop, fontsize=10)
-            plt.ylabel('体脂肪率 (%)', fontproperties=font_prop, fontsize=10)
-            plt.grid(True)
-            plt.legend(prop=font_prop)
-            
-            # 除脂肪体重と脂肪量のグラフのY軸範囲を計算
-            lean_min = df['lean_body_mass'].min()
-            lean_max = df['lean_body_mass'].max()
-            fat_min = df['fat_mass'].min()
-            fat_max = df['fat_mass'].max()
-
-            # それぞれの変動幅を計算
-            lean_range = lean_max - lean_min
-            fat_range = fat_max - fat_min
-
-            # より大きい方の変動幅を基準にする
-            max_range = max(lean_range, fat_range)
-            padding = max_range * 0.1
-
-            # それぞれのデータの中心点を計算
-            lean_center = (lean_max + lean_min) / 2
-            fat_center = (fat_max + fat_min) / 2
-
-            # 除脂肪体重のプロット
-            plt.subplot(2, 2, 3)
-            plt.plot(df['date'], df['lean_body_mass'], 'o-', color='green', label='除脂肪体重', alpha=0.5)
-            plt.plot(df['date'], df['lean_body_mass_ma5'], '-', color='forestgreen', label='5日移動平均')
-            plt.plot(df['date'], df['lean_body_mass_ma14'], '-', color='darkgreen', label='14日移動平均', linewidth=2)
-            plt.title('除脂肪体重推移', fontproperties=font_prop, fontsize=12)
-            plt.xlabel('日付', fontproperties=font_prop, fontsize=10)
-            plt.ylabel('除脂肪体重 (kg)', fontproperties=font_prop, fontsize=10)
-            plt.grid(True)
-            plt.legend(prop=font_prop)
-            plt.ylim(lean_center - (max_range/2 + padding), lean_center + (max_range/2 + padding))
-
-            # 脂肪量のプロット
-            plt.subplot(2, 2, 4)
-            plt.plot(df['date'], df['fat_mass'], 'o-', color='purple', label='脂肪量', alpha=0.5)
-            plt.plot(df['date'], df['fat_mass_ma5'], '-', color='darkmagenta', label='5日移動平均')
-            plt.plot(df['date'], df['fat_mass_ma14'], '-', color='indigo', label='14日移動平均', linewidth=2)
-            plt.title('脂肪量推移', fontproperties=font_prop, fontsize=12)
-            plt.xlabel('日付', fontproperties=font_prop, fontsize=10)
-            plt.ylabel('脂肪量 (kg)', fontproperties=font_prop, fontsize=10)
-            plt.grid(True)
-            plt.legend(prop=font_prop)
-            plt.ylim(fat_center - (max_range/2 + padding), fat_center + (max_range/2 + padding))
-            
-            plt.tight_layout()
-            plt.savefig('fitness_progress.png', dpi=100, bbox_inches='tight')
-            plt.close()
-            
-            print("グラフを 'fitness_progress.png' として保存しました。")
-            
+            from render import ChartRenderer
+            if self.renderer is None:
+                self.renderer = ChartRenderer()
+            future = self.renderer.submit(self.records, self.ideal_curve, self.stats, self.rollups)
         except Exception as e:
+            metrics.error('render', e)
             print(f"グラフの生成中にエラーが発生しました: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            done.set_exception(e)
+            return done
+
+        if wait or future.done():
+            saved(future)
+        else:
+            print("グラフをバックグラウンドで作成しています...")
+            future.add_done_callback(saved)
+        return done
+
+    def close(self):
+        """描画中のグラフを待ってからストアを閉じる"""
+        if self.scenarios is not None:
+            self.scenarios.close()
+        if self.renderer is not None:
+            self.renderer.shutdown(wait=True)
+            self.renderer = None
+        if self.store is not None:
+            self.store.close()
 
 def main():
+    if len(sys.argv) > 1:
+        # 引数があれば非対話モード（cli.py と同じ）
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
     try:
         tracker = SimpleFitnessTracker()
         
@@ -426,9 +611,10 @@ def main():
             print("2: 統計情報を表示")
             print("3: グラフを表示")
             print("4: 本日の状況を表示")
-            print("5: 終了")
+            print("5: データを一括インポート")
+            print("6: 終了")
             
-            choice = input("選択してください (1-5): ")
+            choice = input("選択してください (1-6): ")
             
             if choice == '1':
                 tracker.add_record()
@@ -442,6 +628,9 @@ def main():
                 else:
                     print("記録がありません。")
             elif choice == '5':
+                tracker.import_file()
+            elif choice == '6':
+                tracker.close()
                 break
             else:
                 print("正しい選択肢を入力してください。")
@@ -0,0 +1,321 @@
+"""フィットネストラッカーのベンチマーク
+
+使い方:
+    python benchmark.py startup --runs 10
+    python benchmark.py generate --records 1000000 --users 4 --data-dir bench_data
+    python benchmark.py run --records 100 10000 1000000 --users 2 --output results.json
+    python benchmark.py run --records 10000 --compare results.json
+
+generate / run の記録は理想曲線のまわりに乱数（シード固定）で揺らぎを加えた合成データ。
+同じ条件のデータファイルがあれば作り直さずに使う。ネットワークは使わない。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# メニュー表示までにかかる処理（インポートとトラッカーの作成）を子プロセスで計測する
+STARTUP_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, {package_dir!r})
+start = time.perf_counter()
+if {eager!r}:
+    # 以前の FatTracking.py と同じく重いライブラリを先に読み込む
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import pandas
+import FatTracking
+tracker = FatTracking.SimpleFitnessTracker(data_file={data_file!r}, legacy_data_file=None)
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('pandas', 'matplotlib') if m in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'heavy_modules': heavy}}))
+"""
+
+
+def _run_startup(data_file, eager):
+    script = STARTUP_SCRIPT.format(package_dir=PACKAGE_DIR, eager=eager, data_file=data_file)
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(data_file)).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_startup(runs=10):
+    """起動からメニュー表示までの時間を、遅延読み込み版と従来の一括読み込みで比較する"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'fitness_data.jsonl')
+        for mode, eager in (('lazy', False), ('eager', True)):
+            samples = [_run_startup(data_file, eager) for _ in range(runs)]
+            seconds = [s['seconds'] for s in samples]
+            results[mode] = {
+                'median_ms': statistics.median(seconds) * 1000,
+                'min_ms': min(seconds) * 1000,
+                'heavy_modules': samples[-1]['heavy_modules'],
+            }
+
+    print("\n=== 起動時間（メニュー表示まで） ===")
+    for mode, r in results.items():
+        modules = ', '.join(r['heavy_modules']) or 'なし'
+        print(f"{mode:>5}: 中央値 {r['median_ms']:.0f}ms / 最小 {r['min_ms']:.0f}ms（読み込まれた重いライブラリ: {modules}）")
+    speedup = results['eager']['median_ms'] / results['lazy']['median_ms']
+    print(f"短縮率: {speedup:.1f}倍")
+    return results
+
+
+def generate_history(n_records, seed=0, start=datetime(2025, 1, 1, 7), span_days=None,
+                     weight_noise=0.5, bf_noise=0.8):
+    """理想曲線に沿った合成記録（RecordColumns）を作る
+
+    記録は span_days 日（省略時は記録数と10年の短い方）に等間隔で並べ、
+    体重・体脂肪率には正規分布の揺らぎを加える（0.1刻みに丸める）。
+    """
+    from ideal_curve import get_ideal_curve
+    from records import RecordColumns
+    from robust_filter import RobustFilter
+
+    rng = np.random.default_rng(seed)
+    if span_days is None:
+        span_days = min(n_records, 3650)
+    interval = max(1, span_days * 86400 // max(n_records, 1))
+    dates = np.datetime64(start, 's') + np.arange(n_records, dtype=np.int64) * np.timedelta64(interval, 's')
+
+    curve = get_ideal_curve(start, 68, 24, 10, 10, 168)
+    ideal_weight, ideal_bf = curve.evaluate(dates)
+    weight = np.round(ideal_weight + rng.normal(0, weight_noise, n_records), 1)
+    body_fat = np.round(ideal_bf + rng.normal(0, bf_noise, n_records), 1)
+
+    records = RecordColumns(capacity=max(n_records, 64))
+    records.extend_arrays(dates, {
+        'weight': weight,
+        'body_fat': body_fat,
+        'weight_diff_from_ideal': weight - ideal_weight,
+        'bf_diff_from_ideal': body_fat - ideal_bf,
+    })
+    # 外れ値の判定とトレンドも保存済みの状態にしておく（読み込み時の計算し直しを計測しないため）
+    RobustFilter.from_columns(records, 0)
+    return records
+
+
+def write_history(path, records, chunk_size=100000):
+    """記録をストアの形式で書き出す（拡張子でバックエンドが決まる）"""
+    from storage import open_store
+    store = open_store(path)
+    try:
+        for start in range(0, len(records), chunk_size):
+            store.append_many(list(records.take(np.arange(start, min(start + chunk_size, len(records))))))
+    finally:
+        store.close()
+
+
+def history_files(n_records, users=1, data_dir='bench_data', seed=0, ext='jsonl'):
+    """ユーザーごとの合成データファイルを用意してパスのリストを返す（既にあれば使い回す）"""
+    os.makedirs(data_dir, exist_ok=True)
+    paths = []
+    for user in range(users):
+        path = os.path.join(data_dir, f'history_{n_records}_seed{seed + user}.{ext}')
+        if not os.path.exists(path):
+            tmp_path = f'{path}.tmp.{ext}'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            write_history(tmp_path, generate_history(n_records, seed=seed + user))
+            os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def _summarize(name, n_records, seconds, ops_per_sample, peak_bytes):
+    seconds = np.asarray(seconds)
+    return {
+        'name': name,
+        'records': n_records,
+        'samples': len(seconds),
+        'p50_ms': float(np.percentile(seconds, 50) * 1000),
+        'p99_ms': float(np.percentile(seconds, 99) * 1000),
+        'mean_ms': float(seconds.mean() * 1000),
+        'ops_per_sec': float(ops_per_sample / seconds.mean()) if seconds.mean() > 0 else float('inf'),
+        'peak_mb': peak_bytes / 1e6,
+    }
+
+
+def _measure(func, runs, setup=None):
+    """func を runs 回計測し、(秒のリスト, 最後の1回を tracemalloc 下で実行したときのピークバイト数)"""
+    seconds = []
+    for _ in range(runs):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state)
+        seconds.append(time.perf_counter() - start)
+    # メモリ計測は遅くなるので、時間計測とは別に1回だけ行う
+    state = setup() if setup else None
+    tracemalloc.start()
+    try:
+        func(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_sizes(sizes, users=1, runs=5, data_dir='bench_data', plot_max=100000, foods=100000):
+    """load_data / save_data / add_measurement / show_stats / plot_progress / calculate_total を計測する
+
+    ピークメモリは tracemalloc で測るこのプロセス内の値（グラフ描画のワーカープロセスは含まない）。
+    """
+    sys.path.insert(0, PACKAGE_DIR)
+    from FatTracking import SimpleFitnessTracker
+    from calculator import NutritionCalculator
+    from render import ChartRenderer
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_records in sizes:
+            paths = history_files(n_records, users, data_dir)
+            print(f"\n--- {n_records}件 x {users}人 ---")
+
+            def quiet(func):
+                def run(state):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        func(state)
+                return run
+
+            # 読み込み（ユーザーを順に切り替える）
+            cycle = iter(range(10 ** 9))
+            load = quiet(lambda _: SimpleFitnessTracker(data_file=paths[next(cycle) % users],
+                                                        legacy_data_file=None).close())
+            seconds, peak = _measure(load, runs)
+            results.append(_summarize('load_data', n_records, seconds, n_records, peak))
+
+            # 以降は作業用コピーを使う（保存・追加でファイルが変わるため）
+            work_path = os.path.join(tmp, f'work_{n_records}.jsonl')
+            with open(paths[0], 'rb') as src, open(work_path, 'wb') as dst:
+                dst.write(src.read())
+            with contextlib.redirect_stdout(io.StringIO()):
+                tracker = SimpleFitnessTracker(data_file=work_path, legacy_data_file=None)
+
+            seconds, peak = _measure(quiet(lambda _: tracker.save_data()), runs)
+            results.append(_summarize('save_data', n_records, seconds, n_records, peak))
+
+            # add_record は入力待ちがあるので、その本体の add_measurement を計測する
+            adds_per_sample = 100
+            last = tracker.records.dates[-1]
+
+            def add(_):
+                nonlocal last
+                for _ in range(adds_per_sample):
+                    last = last + np.timedelta64(1, 'h')
+                    tracker.add_measurement(65.0, 22.0, last.item())
+            seconds, peak = _measure(quiet(add), runs)
+            results.append(_summarize('add_measurement', n_records, np.asarray(seconds) / adds_per_sample,
+                                      1, peak))
+
+            seconds, peak = _measure(quiet(lambda _: tracker.show_stats()), runs)
+            results.append(_summarize('show_stats', n_records, seconds, 1, peak))
+
+            if n_records <= plot_max:
+                # 1回目はキャッシュなしで描き、2回目以降はキャッシュの効果を見る
+                tracker.renderer = ChartRenderer(cache_dir=os.path.join(tmp, f'charts_{n_records}'), workers=1)
+                output = os.path.join(tmp, 'chart.png')
+                seconds, peak = _measure(quiet(lambda _: tracker.plot_progress(output, wait=True)), 1)
+                results.append(_summarize('plot_progress_cold', n_records, seconds, 1, peak))
+                seconds, peak = _measure(quiet(lambda _: tracker.plot_progress(output, wait=True)), runs)
+                results.append(_summarize('plot_progress_cached', n_records, seconds, 1, peak))
+            tracker.close()
+
+        # 食事記録の合計（食品数ごと）
+        rng = np.random.default_rng(0)
+        calculator = NutritionCalculator()
+        values = rng.uniform(0, 500, size=(foods, 4))
+        dates = np.datetime64('2025-01-01') + rng.integers(0, 365, foods).astype('timedelta64[D]')
+        calculator.add_foods(['food'] * foods, values, dates)
+        calls = 1000
+
+        def totals(_):
+            for _ in range(calls):
+                calculator.calculate_total()
+        seconds, peak = _measure(totals, runs)
+        results.append(_summarize('calculate_total', foods, np.asarray(seconds) / calls, 1, peak))
+        seconds, peak = _measure(lambda _: calculator.daily_summary(), runs)
+        results.append(_summarize('daily_summary', foods, seconds, foods, peak))
+    return results
+
+
+def print_results(results, baseline=None):
+    """結果を表で表示（baseline があれば p50 の比を並べる）"""
+    previous = {(r['name'], r['records']): r for r in (baseline or [])}
+    print(f"\n{'処理':<22}{'件数':>10}{'p50(ms)':>12}{'p99(ms)':>12}{'件/秒':>14}{'ピーク(MB)':>12}"
+          + ('  前回比' if baseline else ''))
+    for r in results:
+        line = (f"{r['name']:<22}{r['records']:>10}{r['p50_ms']:>12.3f}{r['p99_ms']:>12.3f}"
+                f"{r['ops_per_sec']:>14.0f}{r['peak_mb']:>12.1f}")
+        old = previous.get((r['name'], r['records']))
+        if old and old['p50_ms'] > 0:
+            line += f"  x{r['p50_ms'] / old['p50_ms']:.2f}"
+        print(line)
+
+
+def save_results(path, results, args):
+    data = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'args': args,
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を '{path}' に保存しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='フィットネストラッカーのベンチマーク')
+    sub = parser.add_subparsers(dest='command', required=True)
+    startup = sub.add_parser('startup', help='起動時間を計測')
+    startup.add_argument('--runs', type=int, default=10)
+    generate = sub.add_parser('generate', help='合成データを作成')
+    generate.add_argument('--records', type=int, nargs='+', default=[10000])
+    generate.add_argument('--users', type=int, default=1)
+    generate.add_argument('--data-dir', default='bench_data')
+    run = sub.add_parser('run', help='主な処理の時間とメモリを計測')
+    run.add_argument('--records', type=int, nargs='+', default=[100, 10000, 100000])
+    run.add_argument('--users', type=int, default=1)
+    run.add_argument('--runs', type=int, default=5)
+    run.add_argument('--data-dir', default='bench_data')
+    run.add_argument('--plot-max', type=int, default=100000, help='この件数を超えるとグラフの計測を省く')
+    run.add_argument('--foods', type=int, default=100000)
+    run.add_argument('--output', default='benchmark_results.json')
+    run.add_argument('--compare', help='比較する前回の結果ファイル')
+    args = parser.parse_args()
+
+    if args.command == 'startup':
+        bench_startup(args.runs)
+    elif args.command == 'generate':
+        for n_records in args.records:
+            for path in history_files(n_records, args.users, args.data_dir):
+                print(path)
+    elif args.command == 'run':
+        baseline = None
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+        results = bench_sizes(args.records, args.users, args.runs, args.data_dir, args.plot_max, args.foods)
+        print_results(results, baseline)
+        save_results(args.output, results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,18 @@
+import json
+import os
+from datetime import date as date_type
+
+import numpy as np
+
+# 栄養素の列の並び（FoodLog の配列と合計値はこの順）
+NUTRIENTS = ('calories', 'protein', 'fat', 'carbs')
+# PFC 1gあたりのカロリー（タンパク質 4kcal、脂質 9kcal、炭水化物 4kcal）
+PFC_CALORIES = np.array([4.0, 9.0, 4.0])
+
+
 class Food:
+    __slots__ = ('name', 'calories', 'protein', 'fat', 'carbs')
+
     def __init__(self, name, calories, protein, fat, carbs):
         self.name = name
         self.calories = calories  # kcal
@@ -6,29 +20,202 @@ class Food:
         self.fat = fat           # g
         self.carbs = carbs       # g
 
+
+class FoodLog:
+    """食事記録を列ごとの配列で保持する
+
+    values は (件数, 4) の配列で、列は NUTRIENTS の順。日付と食事の区分も列で持つ。
+    """
+
+    def __init__(self, capacity=64):
+        self._size = 0
+        self._values = np.zeros((capacity, len(NUTRIENTS)))
+        self._dates = np.empty(capacity, dtype='datetime64[D]')
+        self.names = []
+        self.meals = []
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._values)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = max(capacity * 2, 64)
+        values = np.zeros((capacity, len(NUTRIENTS)))
+        values[:self._size] = self._values[:self._size]
+        dates = np.empty(capacity, dtype='datetime64[D]')
+        dates[:self._size] = self._dates[:self._size]
+        self._values, self._dates = values, dates
+
+    @property
+    def values(self):
+        return self._values[:self._size]
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    def append(self, name, nutrients, date, meal=None):
+        self._reserve(1)
+        self._values[self._size] = nutrients
+        self._dates[self._size] = date
+        self.names.append(name)
+        self.meals.append(meal)
+        self._size += 1
+
+    def extend(self, names, values, dates, meals=None):
+        """まとめて追加（values は (件数, 4) の配列）"""
+        n = len(names)
+        self._reserve(n)
+        self._values[self._size:self._size + n] = values
+        self._dates[self._size:self._size + n] = dates
+        self.names.extend(names)
+        self.meals.extend(meals if meals is not None else [None] * n)
+        self._size += n
+
+    def group_totals(self, by='date'):
+        """日付（by='date'）または食事区分（by='meal'）ごとの合計
+
+        (区分の配列, (区分数, 4) の合計配列) を返す。
+        """
+        if by == 'date':
+            keys = self.dates
+        else:
+            keys = np.array(['' if m is None else m for m in self.meals])
+        labels, codes = np.unique(keys, return_inverse=True)
+        return labels, batch_totals(codes, self.values, len(labels))
+
+
+def batch_totals(codes, values, n_groups=None):
+    """区分番号 codes ごとに values（(件数, 4)）を合計する"""
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=np.float64)
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+    return np.column_stack([np.bincount(codes, weights=values[:, i], minlength=n_groups)
+                            for i in range(values.shape[1])])
+
+
+def batch_pfc_ratio(totals):
+    """(区分数, 4) の合計からそれぞれの PFC バランス（%）を計算する
+
+    PFC の合計カロリーが 0 の区分は 0 になる。
+    """
+    totals = np.atleast_2d(np.asarray(totals, dtype=np.float64))
+    pfc_cal = totals[:, 1:4] * PFC_CALORIES
+    total_cal = pfc_cal.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(total_cal > 0, pfc_cal / total_cal * 100, 0.0)
+    return np.round(ratio, 1)
+
+
 class NutritionCalculator:
-    def __init__(self):
-        self.foods = []
-    
-    def add_food(self, name, calories, protein, fat, carbs):
-        food = Food(name, calories, protein, fat, carbs)
-        self.foods.append(food)
-    
+    def __init__(self, food_db=None, path=None):
+        self.log = FoodLog()
+        # 食事記録の保存先（JSON Lines、None なら保存しない）。追加した食品は1行ずつ追記する
+        self.path = path
+        # 食品データベース（未指定なら初めて使うときに同梱の foods.csv を読み込む）
+        self.food_db = food_db
+        # add_food のたびに更新する合計（NUTRIENTS の順）
+        self._totals = [0, 0, 0, 0]
+        # 追加した食品の (日付の配列, カロリーの配列) を受け取る関数（エネルギー収支モデルなど）
+        self.listeners = []
+
+    @classmethod
+    def load(cls, path, food_db=None):
+        """保存した食事記録を読み込み、以降の追加を同じファイルに追記する計算機を返す
+
+        1行1食品の JSON Lines（{"date", "name", "meal", 栄養素...}）で、壊れた行は読み飛ばす。
+        """
+        calculator = cls(food_db)
+        names, values, dates, meals = [], [], [], []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        data = json.loads(line)
+                        row = [float(data[name]) for name in NUTRIENTS]
+                        day = np.datetime64(data['date'], 'D')
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    names.append(data.get('name', ''))
+                    values.append(row)
+                    dates.append(day)
+                    meals.append(data.get('meal'))
+        except FileNotFoundError:
+            pass
+        if names:
+            calculator.add_foods(names, np.array(values), np.array(dates, dtype='datetime64[D]'), meals)
+        calculator.path = path
+        return calculator
+
+    def _save(self, start):
+        """食事記録の start 件目以降をファイルに追記する"""
+        if self.path is None or start >= len(self.log):
+            return
+        lines = []
+        for i in range(start, len(self.log)):
+            row = {'date': str(self.log.dates[i]), 'name': self.log.names[i], 'meal': self.log.meals[i]}
+            row.update(zip(NUTRIENTS, self.log.values[i].tolist()))
+            lines.append(json.dumps(row, ensure_ascii=False) + '\n')
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def foods(self):
+        """記録した食品を Food のリストで返す"""
+        return [Food(name, *values) for name, values in zip(self.log.names, self.log.values.tolist())]
+
+    def add_food(self, name, calories=None, protein=None, fat=None, carbs=None, date=None, meal=None, grams=None):
+        """食品を追加する
+
+        grams を指定した場合、name は食品データベースの id または名前として扱い、
+        100gあたりの栄養素を grams に合わせて換算する。
+        """
+        if grams is not None:
+            if self.food_db is None:
+                from food_db import load_default_database
+                self.food_db = load_default_database()
+            food = self.food_db.get(name)
+            name = food.name
+            calories, protein, fat, carbs = food.scaled(grams)
+        nutrients = (calories, protein, fat, carbs)
+        self.log.append(name, nutrients, date or date_type.today(), meal)
+        self._save(len(self.log) - 1)
+        self._totals = [total + value for total, value in zip(self._totals, nutrients)]
+        self._notify(self.log.dates[-1:], self.log.values[-1:, 0])
+
+    def add_foods(self, names, values, dates, meals=None):
+        """複数の食品をまとめて追加（values は (件数, 4) の配列、列は NUTRIENTS の順）"""
+        values = np.asarray(values, dtype=np.float64)
+        self.log.extend(names, values, dates, meals)
+        self._save(len(self.log) - len(names))
+        self._totals = [total + value for total, value in zip(self._totals, values.sum(axis=0).tolist())]
+        if len(names):
+            self._notify(self.log.dates[-len(names):], self.log.values[-len(names):, 0])
+
+    def _notify(self, dates, calories):
+        for listener in self.listeners:
+            listener(dates, calories)
+
     def calculate_total(self):
-        total_calories = sum(food.calories for food in self.foods)
-        total_protein = sum(food.protein for food in self.foods)
-        total_fat = sum(food.fat for food in self.foods)
-        total_carbs = sum(food.carbs for food in self.foods)
-        
+        total_calories, total_protein, total_fat, total_carbs = self._totals
+
         return {
             'calories': total_calories,
             'protein': total_protein,
             'fat': total_fat,
             'carbs': total_carbs
         }
-    
-    def calculate_pfc_ratio(self):
-        totals = self.calculate_total()
+
+    def calculate_pfc_ratio(self, totals=None):
+        if totals is None:
+            totals = self.calculate_total()
         
         # PFCバランスの計算（カロリーベース）
         protein_cal = totals['protein'] * 4  # タンパク質は1gあたり4kcal
@@ -44,11 +231,19 @@ class NutritionCalculator:
             'fat': round(fat_cal / total_cal * 100, 1),
             'carbs': round(carbs_cal / total_cal * 100, 1)
         }
-    
+
+    def daily_summary(self):
+        """日ごとの合計と PFC バランスをまとめて計算
+
+        (日付の配列, (日数, 4) の合計配列, (日数, 3) の PFC バランス配列) を返す。
+        """
+        days, totals = self.log.group_totals('date')
+        return days, totals, batch_pfc_ratio(totals)
+
     def print_summary(self):
         totals = self.calculate_total()
-        pfc_ratio = self.calculate_pfc_ratio()
-        
+        pfc_ratio = self.calculate_pfc_ratio(totals)
+
         print("\n=== 栄養摂取サマリー ===")
         print(f"総カロリー: {totals['calories']}kcal")
         print(f"\n各栄養素:")
@@ -61,4 +256,4 @@ class NutritionCalculator:
         print(f"炭水化物: {pfc_ratio['carbs']}%")
 
 # 使用例
-calculator = NutritionCalculator()
\ No newline at end of file
+calculator = NutritionCalculator()
@@ -0,0 +1,458 @@
+"""対話なしで使うコマンドライン（JSON / CSV で出力）
+
+使い方:
+    python cli.py add 67.2 22.5 --date "2024-01-01 07:00:00"
+    python cli.py --data a.jsonl --data b.jsonl stats --format csv
+    python cli.py --users-dir users --all-users stats --projection > report.json
+    python cli.py --users-dir users --user alice plot --output-dir charts
+    python cli.py intake 2100 --date 2024-01-01
+    python cli.py --data a.jsonl import new.csv
+    python cli.py --data a.jsonl import-localstorage phone.json laptop.json --prefer import
+    python cli.py --data a.jsonl activity --format csv
+    python cli.py --users-dir users --all-users export --format csv > all.csv
+    python cli.py --data a.jsonl rollup --resolution monthly --format csv
+    python cli.py --data a.jsonl scenarios --weight-loss 4:16:0.5 --weight-tau 60:240:10 --top 20
+    python cli.py --users-dir users --all-users dashboard --output-dir dashboard --bundle-format binary
+    python cli.py --users-dir users batch < ops.jsonl
+
+対象は --data（データファイル）か --users-dir と --user / --all-users（server.py と同じ
+users/<id>/fitness_data.jsonl の配置）で複数指定できる。省略時は fitness_data.jsonl。
+batch は1行1操作の JSON（{"user": "alice", "op": "add", "weight": 67.2, "body_fat": 22.5}）
+を標準入力から読み、読み込んだトラッカーを操作の間で使い回す。
+
+結果は標準出力に、トラッカーのメッセージやエラーは標準エラー出力に出す。
+"""
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import sys
+from datetime import datetime
+
+from storage import DATE_FORMAT, to_jsonable
+
+FORMATS = ('json', 'jsonl', 'csv')
+DATE_INPUT_FORMATS = (DATE_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_date(text):
+    for fmt in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"日付の形式が正しくありません: {text}")
+
+
+class TrackerPool:
+    """対象ごとに読み込んだトラッカーを保持し、同じ対象は読み直さない"""
+
+    def __init__(self, users_dir=None):
+        self.users_dir = users_dir
+        self.trackers = {}
+        self.renderer = None
+
+    def path_for(self, target):
+        from FatTracking import DATA_FILE
+        if self.users_dir is not None:
+            from server import USER_ID_PATTERN
+            if not USER_ID_PATTERN.match(target):
+                raise ValueError(f"ユーザーIDが正しくありません: {target}")
+            return os.path.join(self.users_dir, target, DATA_FILE)
+        return target
+
+    def get(self, target):
+        tracker = self.trackers.get(target)
+        if tracker is None:
+            from FatTracking import DATA_FILE, LEGACY_DATA_FILE, SimpleFitnessTracker
+            path = self.path_for(target)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # 既定のファイルだけは対話モードと同じく旧形式からの移行を行う
+            legacy = LEGACY_DATA_FILE if path == DATA_FILE else None
+            tracker = SimpleFitnessTracker(data_file=path, legacy_data_file=legacy)
+            self.trackers[target] = tracker
+        return tracker
+
+    def chart_renderer(self):
+        """全対象で共有する ChartRenderer（描画はプロセスプールで並列に行う）"""
+        if self.renderer is None:
+            from render import ChartRenderer
+            self.renderer = ChartRenderer()
+        return self.renderer
+
+    def close(self):
+        for tracker in self.trackers.values():
+            tracker.renderer = None
+            tracker.close()
+        if self.renderer is not None:
+            self.renderer.shutdown(wait=True)
+
+
+def list_users(users_dir):
+    if not os.path.isdir(users_dir):
+        return []
+    return sorted(name for name in os.listdir(users_dir)
+                  if not name.startswith('.') and os.path.isdir(os.path.join(users_dir, name)))
+
+
+# --- 各操作（1対象分の結果を dict か dict のリストで返す） ---
+
+def op_add(tracker, weight, body_fat, date=None):
+    return tracker.add_measurement(float(weight), float(body_fat), parse_date(date) if date else None)
+
+
+def op_stats(tracker, projection=False):
+    result = tracker.summary()
+    if projection and tracker.records:
+        result['projection'] = tracker.project_goal()
+    if tracker.energy is not None:
+        result['tdee'] = tracker.energy.tdee
+        result['tdee_sd'] = tracker.energy.tdee_sd
+    return result
+
+
+def op_intake(tracker, calories, date=None):
+    """摂取カロリーを食事記録（データファイルの隣の *_intake.jsonl）に加え、推定 TDEE を返す"""
+    day = parse_date(date).date() if date else datetime.now().date()
+    tracker.log_intake(float(calories), day)
+    return {'date': day, 'calories': float(calories),
+            'tdee': tracker.energy.tdee, 'tdee_sd': tracker.energy.tdee_sd}
+
+
+def op_today(tracker):
+    if not tracker.records:
+        return {'record': None}
+    record = tracker.records[-1]
+    result = {'record': record}
+    if len(tracker.records) > 1:
+        previous = tracker.records[-2]
+        result['weight_change'] = record['weight'] - previous['weight']
+        result['body_fat_change'] = record['body_fat'] - previous['body_fat']
+    return result
+
+
+def op_import(tracker, paths):
+    from importer import import_file
+    results = []
+    for path in paths:
+        results.append(import_file(tracker, path))
+    return results
+
+
+def op_import_localstorage(tracker, paths, prefer='existing'):
+    from localstorage_import import import_localstorage
+    return import_localstorage(tracker, paths, prefer)
+
+
+def op_activity(tracker):
+    from localstorage_import import ActivityLog, activity_path
+    return ActivityLog(activity_path(tracker)).daily_rows()
+
+
+# scenarios サブコマンドの引数名と ScenarioEngine.sweep のパラメータ名
+SCENARIO_OPTIONS = {'weight_loss': 'target_weight_loss', 'bf_loss': 'target_bf_loss',
+                    'duration': 'duration_days', 'weight_tau': 'weight_tau', 'bf_tau': 'bf_tau',
+                    'bf_delay': 'bf_delay'}
+
+
+def parse_values(text):
+    """'4:16:0.5'（開始:終了:刻み、終了を含む）か '90,120,150' を数値のリストにする"""
+    if ':' in text:
+        start, stop, step = (float(v) for v in text.split(':'))
+        if step <= 0:
+            raise argparse.ArgumentTypeError(f"刻みは正の数にしてください: {text}")
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [start + i * step for i in range(max(count, 0))]
+    return [float(v) for v in text.split(',') if v.strip()]
+
+
+def op_scenarios(tracker, grid, top=10, by='fit', max_deficit=None):
+    from scenarios import best_plans
+    result = tracker.sweep_scenarios(**grid)
+    if result is None:
+        return []
+    return best_plans(result, top, by, max_deficit)
+
+
+def op_export(tracker):
+    return list(tracker.records)
+
+
+def op_rollup(tracker, resolution='weekly'):
+    table = tracker.rollups[resolution].table()
+    columns = list(table)
+    return [dict(zip(columns, row)) for row in zip(*(table[c].tolist() for c in columns))]
+
+
+def op_dashboard(tracker, output_dir, bundle_format='json'):
+    from dashboard_export import export_dashboard
+    result = export_dashboard(tracker, output_dir, bundle_format)
+    return {'dir': output_dir, 'written': result['written'], 'unchanged': result['unchanged']}
+
+
+def flatten(row, prefix=''):
+    """入れ子の dict を 'metrics.weight.current' のような列名の1行にする（CSV 用）"""
+    flat = {}
+    for key, value in row.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def write_rows(rows, fmt, out):
+    rows = [to_jsonable(row) for row in rows]
+    if fmt == 'json':
+        json.dump(rows, out, ensure_ascii=False, indent=2)
+        out.write('\n')
+    elif fmt == 'jsonl':
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + '\n')
+    else:
+        rows = [flatten(row) for row in rows]
+        fields = []
+        for row in rows:
+            fields.extend(key for key in row if key not in fields)
+        writer = csv.DictWriter(out, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_command(pool, targets, args):
+    """1つのサブコマンドを全対象に実行し、出力する行のリストを返す"""
+    rows = []
+    if args.command == 'plot':
+        # 全対象の描画を先に投入してから待つ（プロセスプールで並列に描く）
+        os.makedirs(args.output_dir, exist_ok=True)
+        jobs = []
+        for target in targets:
+            output = os.path.join(args.output_dir, f'{_safe_name(target)}.png')
+            try:
+                tracker = pool.get(target)
+                tracker.renderer = pool.chart_renderer()
+                jobs.append((target, output, tracker.plot_progress(output)))
+            except Exception as e:
+                jobs.append((target, output, e))
+        for target, output, future in jobs:
+            rows.append({'target': target, **_plot_result(output, future)})
+        # 保存完了のメッセージ（コールバック）を待ってから返す
+        pool.chart_renderer().shutdown(wait=True)
+        return rows
+
+    for target in targets:
+        try:
+            tracker = pool.get(target)
+            if args.command == 'add':
+                result = op_add(tracker, args.weight, args.body_fat, args.date)
+            elif args.command == 'stats':
+                result = op_stats(tracker, args.projection)
+            elif args.command == 'today':
+                result = op_today(tracker)
+            elif args.command == 'intake':
+                result = op_intake(tracker, args.calories, args.date)
+            elif args.command == 'import':
+                result = op_import(tracker, args.files)
+            elif args.command == 'import-localstorage':
+                result = op_import_localstorage(tracker, args.files, args.prefer)
+            elif args.command == 'activity':
+                result = op_activity(tracker)
+            elif args.command == 'rollup':
+                result = op_rollup(tracker, args.resolution)
+            elif args.command == 'scenarios':
+                grid = {name: getattr(args, option) for option, name in SCENARIO_OPTIONS.items()
+                        if getattr(args, option) is not None}
+                result = op_scenarios(tracker, grid, args.top, args.by, args.max_deficit)
+            elif args.command == 'dashboard':
+                result = op_dashboard(tracker, os.path.join(args.output_dir, _safe_name(target)),
+                                      args.bundle_format)
+            else:
+                result = op_export(tracker)
+        except Exception as e:
+            rows.append({'target': target, 'error': str(e)})
+            continue
+        if isinstance(result, list):
+            rows.extend({'target': target, **row} for row in result)
+        else:
+            rows.append({'target': target, **result})
+    return rows
+
+
+def run_batch(pool, lines, default_targets):
+    """1行1操作の JSON を順に実行する（対象のトラッカーは使い回す）
+
+    plot は描画を投入して次の操作に進み、全操作の後にまとめて待つ（プロセスプールで並列に描く）。
+    """
+    rows = []
+    plots = []
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+            target = op.get('user') or op.get('data') or default_targets[0]
+            tracker = pool.get(target)
+            name = op['op']
+            if name == 'add':
+                result = op_add(tracker, op['weight'], op['body_fat'], op.get('date'))
+            elif name == 'stats':
+                result = op_stats(tracker, op.get('projection', False))
+            elif name == 'today':
+                result = op_today(tracker)
+            elif name == 'intake':
+                result = op_intake(tracker, op['calories'], op.get('date'))
+            elif name == 'import':
+                result = {'imports': op_import(tracker, op['files'])}
+            elif name == 'export':
+                result = {'records': op_export(tracker)}
+            elif name == 'import-localstorage':
+                result = op_import_localstorage(tracker, op['files'], op.get('prefer', 'existing'))
+            elif name == 'activity':
+                result = {'days': op_activity(tracker)}
+            elif name == 'rollup':
+                result = {'rows': op_rollup(tracker, op.get('resolution', 'weekly'))}
+            elif name == 'scenarios':
+                grid = {param: op[param] for param in SCENARIO_OPTIONS.values() if param in op}
+                result = {'plans': op_scenarios(tracker, grid, op.get('top', 10), op.get('by', 'fit'),
+                                                op.get('max_deficit'))}
+            elif name == 'dashboard':
+                result = op_dashboard(tracker, op.get('output_dir', os.path.join('dashboard', _safe_name(target))),
+                                      op.get('bundle_format', 'json'))
+            elif name == 'plot':
+                output_dir = op.get('output_dir', 'charts')
+                os.makedirs(output_dir, exist_ok=True)
+                tracker.renderer = pool.chart_renderer()
+                output = os.path.join(output_dir, f'{_safe_name(target)}.png')
+                plots.append((len(rows), output, tracker.plot_progress(output)))
+                result = {'path': output, 'error': None}
+            else:
+                raise ValueError(f"不明な操作です: {name}")
+        except Exception as e:
+            rows.append({'line': line_number, 'error': str(e)})
+            continue
+        rows.append({'line': line_number, 'target': target, 'op': name, **result})
+
+    for index, output, future in plots:
+        rows[index].update(_plot_result(output, future))
+    if plots:
+        # 保存完了のメッセージ（コールバック）を待ってから返す
+        pool.chart_renderer().shutdown(wait=True)
+    return rows
+
+
+def _plot_result(output, future):
+    """plot_progress の結果（Future、None、または投入時の例外）を出力する行の項目にする"""
+    error = None
+    if future is None:
+        error = 'no records'
+    elif isinstance(future, Exception):
+        error = str(future)
+    else:
+        try:
+            future.result()
+        except Exception as e:
+            error = str(e)
+    return {'path': None if error else output, 'error': error}
+
+
+def _safe_name(target):
+    """出力ファイル名に使う対象の名前
+
+    ユーザーIDはそのまま、データファイルは拡張子を除いたパスの各部分を '__' でつなぐ（'..' は 'up'）
+    （別のディレクトリにある同じ名前のファイルが同じ出力先にならないようにする）。
+    """
+    if os.sep not in target and '.' not in target:
+        return target
+    path = os.path.normpath(os.path.splitext(target)[0])
+    return '__'.join('up' if part == '..' else part for part in path.split(os.sep) if part)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='フィットネストラッカー（非対話モード）')
+    parser.add_argument('--data', action='append', default=[], help='データファイル（複数指定可）')
+    parser.add_argument('--users-dir', help='ユーザーごとのデータのディレクトリ（server.py と同じ配置）')
+    parser.add_argument('--user', action='append', default=[], help='--users-dir 内のユーザーID（複数指定可）')
+    parser.add_argument('--all-users', action='store_true', help='--users-dir 内の全ユーザー')
+    parser.add_argument('--format', choices=FORMATS, default='json')
+    parser.add_argument('--output', help='出力先ファイル（省略時は標準出力）')
+    # 出力形式はサブコマンドの後ろにも書けるようにする
+    output_options = argparse.ArgumentParser(add_help=False)
+    output_options.add_argument('--format', choices=FORMATS, default=argparse.SUPPRESS)
+    output_options.add_argument('--output', default=argparse.SUPPRESS)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help='記録を追加', parents=[output_options])
+    add.add_argument('weight', type=float)
+    add.add_argument('body_fat', type=float)
+    add.add_argument('--date', help='日時（省略時は現在）')
+    stats = sub.add_parser('stats', help='統計情報', parents=[output_options])
+    stats.add_argument('--projection', action='store_true', help='目標達成予測を含める')
+    plot = sub.add_parser('plot', help='グラフを保存', parents=[output_options])
+    plot.add_argument('--output-dir', default='charts')
+    sub.add_parser('today', help='最新の記録と前回との差', parents=[output_options])
+    intake = sub.add_parser('intake', help='摂取カロリーを記録（TDEE の推定に使う）', parents=[output_options])
+    intake.add_argument('calories', type=float)
+    intake.add_argument('--date', help='日付（省略時は今日）')
+    imp = sub.add_parser('import', help='CSV / JSON Lines から一括インポート', parents=[output_options])
+    imp.add_argument('files', nargs='+')
+    local = sub.add_parser('import-localstorage', help='index.html の localStorage のダンプを取り込む',
+                           parents=[output_options])
+    local.add_argument('files', nargs='+')
+    local.add_argument('--prefer', choices=('existing', 'import'), default='existing',
+                       help='既存の記録と同じ日時の体重の扱い（既定は既存の記録を残す）')
+    sub.add_parser('activity', help='日ごとの活動量（バイク・ワークアウト）', parents=[output_options])
+    sub.add_parser('export', help='全記録を出力', parents=[output_options])
+    rollup = sub.add_parser('rollup', help='日・週・月ごとの集計', parents=[output_options])
+    rollup.add_argument('--resolution', choices=('daily', 'weekly', 'monthly'), default='weekly')
+    dashboard = sub.add_parser('dashboard', help='ダッシュボード用の事前計算データを書き出す',
+                               parents=[output_options])
+    dashboard.add_argument('--output-dir', default='dashboard')
+    dashboard.add_argument('--bundle-format', choices=('json', 'binary'), default='json')
+    scenarios = sub.add_parser('scenarios', help='理想曲線のパラメータの組み合わせを比較',
+                               parents=[output_options])
+    for option, name in SCENARIO_OPTIONS.items():
+        scenarios.add_argument(f"--{option.replace('_', '-')}", type=parse_values,
+                               help=f'{name} の候補（開始:終了:刻み か カンマ区切り）')
+    scenarios.add_argument('--top', type=int, default=10)
+    scenarios.add_argument('--by', choices=('fit', 'deficit'), default='fit')
+    scenarios.add_argument('--max-deficit', type=float, help='必要な1日のカロリー不足の上限（kcal）')
+    sub.add_parser('batch', help='標準入力の操作（JSON Lines）を順に実行', parents=[output_options])
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    pool = TrackerPool(args.users_dir)
+    if args.users_dir is not None:
+        targets = list_users(args.users_dir) if args.all_users else args.user
+    else:
+        from FatTracking import DATA_FILE
+        targets = args.data or [DATA_FILE]
+    if not targets and args.command != 'batch':
+        print("対象のユーザーがいません。", file=sys.stderr)
+        return 1
+
+    # トラッカーが print するメッセージ（描画完了の通知を含む）は標準エラー出力へ回す
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if args.command == 'batch':
+                rows = run_batch(pool, sys.stdin, targets or [None])
+            else:
+                rows = run_command(pool, targets, args)
+        finally:
+            pool.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as out:
+            write_rows(rows, args.format, out)
+    else:
+        write_rows(rows, args.format, stdout)
+    return 1 if any(row.get('error') for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""ダッシュボード（index.html / WeightSimulation.jss）向けの事前計算済みデータの書き出し
+
+理想曲線・移動平均・トレンド・日/週/月の集計・統計を Python 側で計算し、
+ブラウザは読み込んで描くだけにする（JS 側で同じ計算を持たないので食い違わない）。
+読み込むのは index.html の loadBundle（体重タブのグラフ。ブラウザで記録した最新の体重が
+まだ含まれていなければ従来どおり localStorage から描く）と WeightSimulation.jss の
+loadIdealCurve（理想曲線）。どちらも既定では dashboard/fitness_data/（cli.py dashboard の
+既定の出力先）の manifest.json を読む。
+
+出力ディレクトリの構成:
+    manifest.json                 各ファイルの名前・内容のハッシュ・配列の配置
+    ideal.<hash>.json.gz          理想曲線
+    series.<hash>.json.gz         グラフ用の点・5日/14日移動平均・トレンド（MAX_POINTS 点以内）
+    rollup_daily.<hash>.json.gz   日ごとの集計（weekly / monthly も同様）
+    summary.<hash>.json.gz        統計と目標達成予測
+
+fmt='binary' なら配列のファイル（summary 以外）は .bin になる。配列をリトルエンディアンで
+8バイト境界にそろえて並べ、manifest の arrays に {dtype, offset, length} を書くので、
+ブラウザでは new Float32Array(buffer, offset, length) のように読める。
+日付はどちらの形式でも 1970-01-01 からのミリ秒（JS の Date に渡せる値）。
+
+ファイル名にハッシュを含めるので長期間キャッシュしてよい。入力（記録・理想曲線・設定）が
+前回と同じファイルは作り直さない。
+"""
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from instrumentation import metrics
+from rollup import RESOLUTIONS
+from storage import to_jsonable
+
+# 出力の形式を変えたら上げる
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.json'
+FORMATS = ('json', 'binary')
+# JSON に書く値の小数点以下の桁数
+JSON_DECIMALS = 4
+
+
+def _epoch_ms(dates):
+    return np.asarray(dates).astype('datetime64[ms]').astype(np.int64)
+
+
+def _typed(array):
+    """配列を書き出す型に変換（日付はミリ秒の float64、整数は int32、それ以外は float32）"""
+    array = np.asarray(array)
+    if np.issubdtype(array.dtype, np.datetime64):
+        return _epoch_ms(array).astype('<f8')
+    if np.issubdtype(array.dtype, np.integer):
+        return array.astype('<i4')
+    return array.astype('<f4')
+
+
+def encode_json(arrays, meta):
+    """{'meta': ..., 'arrays': {名前: リスト}} の gzip 圧縮した JSON"""
+    data = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if np.issubdtype(array.dtype, np.datetime64):
+            data[name] = _epoch_ms(array).tolist()
+        elif np.issubdtype(array.dtype, np.integer):
+            data[name] = array.tolist()
+        else:
+            data[name] = to_jsonable(np.round(array.astype(np.float64), JSON_DECIMALS).tolist())
+    text = json.dumps({'meta': to_jsonable(meta), 'arrays': data}, ensure_ascii=False, separators=(',', ':'))
+    # mtime を固定して、同じ内容なら同じバイト列にする
+    return gzip.compress(text.encode('utf-8'), mtime=0), {}
+
+
+def encode_binary(arrays, meta):
+    """配列を8バイト境界にそろえて連結したバイト列と、manifest に書く配置"""
+    chunks = []
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        typed = _typed(array)
+        layout[name] = {'dtype': typed.dtype.name, 'offset': offset, 'length': len(typed)}
+        raw = typed.tobytes()
+        padding = -len(raw) % 8
+        chunks.append(raw + b'\0' * padding)
+        offset += len(raw) + padding
+    return b''.join(chunks), {'arrays': layout, 'meta': to_jsonable(meta)}
+
+
+# --- 各ファイルの中身（(配列の dict, メタ情報) を返す） ---
+
+def ideal_arrays(curve):
+    from render import curve_params
+    names = ('start_date', 'start_weight', 'start_bf', 'target_weight_loss', 'target_bf_loss',
+             'duration_days', 'weight_tau', 'bf_tau', 'bf_delay')
+    arrays = {'dates': curve.dates, 'weight': np.asarray(curve.weights), 'body_fat': np.asarray(curve.body_fat)}
+    return arrays, dict(zip(names, curve_params(curve)))
+
+
+def series_arrays(payload):
+    """chart_payload の点と線を 'weight.ma5.dates' のような名前の平らな dict にする"""
+    arrays = {}
+    for name, series in payload['series'].items():
+        arrays[f'{name}.dates'] = series['dates']
+        arrays[f'{name}.values'] = series['values']
+        for window in ('ma5', 'ma14'):
+            arrays[f'{name}.{window}.dates'], arrays[f'{name}.{window}.values'] = series[window]
+    for name, trend in payload['trend'].items():
+        for key, array in trend.items():
+            arrays[f'{name}.trend.{key}'] = array
+    meta = {'max_points': payload['max_points'], 'sigma': payload['sigma'], 'ranges': payload['ranges']}
+    return arrays, meta
+
+
+def rollup_arrays(rollup):
+    return rollup.table(), {'resolution': rollup.resolution}
+
+
+def summary_data(tracker):
+    summary = tracker.summary()
+    if tracker.records:
+        summary['projection'] = tracker.project_goal()
+    if tracker.energy is not None:
+        summary['tdee'] = tracker.energy.tdee
+    return summary
+
+
+def _source_key(*parts):
+    return hashlib.sha1(repr((BUNDLE_VERSION,) + parts).encode('utf-8')).hexdigest()
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if manifest.get('version') == BUNDLE_VERSION else None
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def export_dashboard(tracker, out_dir='dashboard', fmt='json', max_points=None):
+    """tracker のデータを out_dir に書き出し、{'written': [...], 'unchanged': [...], 'manifest': ...} を返す
+
+    入力が前回と同じファイルは読み書きせずそのまま残し、置き換えたファイルの古い版は消す。
+    """
+    from render import MAX_POINTS, chart_payload, curve_params, data_version
+    if fmt not in FORMATS:
+        raise ValueError(f"形式は {' / '.join(FORMATS)} のいずれかです: {fmt}")
+    max_points = max_points or MAX_POINTS
+    os.makedirs(out_dir, exist_ok=True)
+    previous = (read_manifest(out_dir) or {}).get('files', {})
+
+    records = tracker.records
+    version = data_version(records)
+    curve = curve_params(tracker.ideal_curve)
+    targets = (tracker.target_weight_loss, tracker.target_bf_loss, tracker.duration_days)
+    # 名前: (入力のキー, 配列ファイルか, 中身を作る関数)
+    entries = {'ideal': (_source_key(fmt, curve), True, lambda: ideal_arrays(tracker.ideal_curve))}
+    if records:
+        entries['series'] = (_source_key(fmt, version, curve, max_points), True,
+                             lambda: series_arrays(chart_payload(records, tracker.ideal_curve, tracker.stats,
+                                                                 tracker.rollups, max_points)))
+        for resolution in RESOLUTIONS:
+            entries[f'rollup_{resolution}'] = (_source_key(fmt, version), True,
+                                               lambda r=resolution: rollup_arrays(tracker.rollups[r]))
+    tdee = tracker.energy.tdee if tracker.energy is not None else None
+    entries['summary'] = (_source_key(version, curve, targets, tdee), False, lambda: summary_data(tracker))
+
+    files = {}
+    written = []
+    unchanged = []
+    with metrics.span('dashboard_export'):
+        for name, (source, is_arrays, build) in entries.items():
+            old = previous.get(name)
+            if old and old['source'] == source and os.path.exists(os.path.join(out_dir, old['file'])):
+                files[name] = old
+                unchanged.append(name)
+                continue
+            if is_arrays:
+                encode = encode_binary if fmt == 'binary' else encode_json
+                data, layout = encode(*build())
+                ext = 'bin' if fmt == 'binary' else 'json.gz'
+                entry_format = fmt
+            else:
+                data, layout = encode_json({}, build())
+                ext, entry_format = 'json.gz', 'json'
+            digest = hashlib.sha1(data).hexdigest()
+            filename = f'{name}.{digest[:12]}.{ext}'
+            path = os.path.join(out_dir, filename)
+            if not os.path.exists(path):
+                _write_atomic(path, data)
+            files[name] = {'file': filename, 'hash': digest, 'source': source, 'format': entry_format,
+                           'bytes': len(data), **layout}
+            written.append(name)
+
+        manifest = {'version': BUNDLE_VERSION, 'data_version': version, 'records': len(records), 'files': files}
+        if written or set(previous) != set(files):
+            _write_atomic(os.path.join(out_dir, MANIFEST),
+                          json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        # 置き換えた古い版（と記録が無くなった項目）のファイルを消す
+        current = {entry['file'] for entry in files.values()}
+        for entry in previous.values():
+            if entry['file'] not in current:
+                try:
+                    os.remove(os.path.join(out_dir, entry['file']))
+                except FileNotFoundError:
+                    pass
+    metrics.count('dashboard_files_written', len(written))
+    return {'written': written, 'unchanged': unchanged, 'manifest': manifest}
+
+
+def read_bundle(out_dir, name, manifest=None):
+    """書き出したファイルを読み戻して (配列の dict, メタ情報) を返す（確認用）"""
+    manifest = manifest or read_manifest(out_dir)
+    entry = manifest['files'][name]
+    with open(os.path.join(out_dir, entry['file']), 'rb') as f:
+        data = f.read()
+    if entry['format'] == 'binary':
+        arrays = {key: np.frombuffer(data, dtype=np.dtype(spec['dtype']).newbyteorder('<'),
+                                     count=spec['length'], offset=spec['offset'])
+                  for key, spec in entry['arrays'].items()}
+        return arrays, entry['meta']
+    content = json.loads(gzip.decompress(data))
+    return content['arrays'], content['meta']
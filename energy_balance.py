@@ -0,0 +1,173 @@
+"""摂取カロリーと体重記録を日単位でつなぎ、メンテナンスカロリー（TDEE）を推定するモデル
+
+状態は (その日の真の体重 w, TDEE t) の2つ。1日進むごとに
+    w ← w + (摂取カロリー - t) / cal_per_kg
+    t ← t（ゆっくり変化する）
+と予測し、体重の記録があればカルマンフィルタで補正する。1日あたりの計算は O(1)。
+"""
+import math
+
+import numpy as np
+
+
+class EnergyBalanceModel:
+    """日ごとの体重・摂取カロリーから TDEE を逐次推定する"""
+
+    def __init__(self, cal_per_kg=7700, initial_tdee=None, initial_tdee_sd=500,
+                 weight_sd=0.6, intake_error_sd=200, unknown_intake_sd=600, tdee_drift_sd=15):
+        self.cal_per_kg = cal_per_kg
+        self.initial_tdee = initial_tdee
+        self.initial_tdee_sd = initial_tdee_sd
+        # 体重計の値の日々のぶれ（水分など）
+        self.weight_var = weight_sd ** 2
+        # 摂取カロリーが記録されている日・いない日の体重変化のぶれ（kg）
+        self.known_var = (intake_error_sd / cal_per_kg) ** 2
+        self.unknown_var = (unknown_intake_sd / cal_per_kg) ** 2
+        # TDEE の1日あたりの変化
+        self.tdee_var = tdee_drift_sd ** 2
+
+        self.day = None
+        self.w = math.nan
+        self.t = math.nan
+        self.p00 = self.p01 = self.p11 = math.nan
+        self._intake = None
+        # 日ごとの推定値（日付は 1970-01-01 からの日数）
+        self._days = []
+        self._weights = []
+        self._tdee = []
+        self._tdee_sd = []
+        self._intakes = []
+        self._observed = []
+
+    @staticmethod
+    def _day_number(date):
+        return int(np.datetime64(date, 'D').astype(np.int64))
+
+    def _predict(self):
+        """1日進める（その日の摂取カロリーが分かっていれば体重の変化に反映する）"""
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        if self._intake is None:
+            self.p00 = p00 + self.unknown_var
+        else:
+            a = -1 / self.cal_per_kg
+            self.w = self.w + a * self.t + self._intake / self.cal_per_kg
+            self.p00 = p00 + 2 * a * p01 + a * a * p11 + self.known_var
+            self.p01 = p01 + a * p11
+        self.p11 = self.p11 + self.tdee_var
+        self.day += 1
+        self._intake = None
+        self._record(math.nan)
+
+    def _observe(self, weight, count=1):
+        # count 回の計測の平均は、1回ずつ補正するのと同じく分散 weight_var / count の観測として扱う
+        variance = self.weight_var / count
+        if math.isnan(self.w):
+            # 最初の体重で初期化
+            self.w = weight
+            self.t = self.initial_tdee if self.initial_tdee is not None else 30 * weight
+            self.p00 = variance
+            self.p01 = 0.0
+            self.p11 = self.initial_tdee_sd ** 2
+            return
+        s = self.p00 + variance
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        residual = weight - self.w
+        self.w += k0 * residual
+        self.t += k1 * residual
+        self.p11 -= k1 * self.p01
+        self.p01 *= (1 - k0)
+        self.p00 *= (1 - k0)
+
+    def _record(self, observed):
+        """その日の推定値を記録（同じ日なら上書き）"""
+        values = (self.day, self.w, self.t, math.sqrt(self.p11),
+                  math.nan if self._intake is None else self._intake, observed)
+        series = (self._days, self._weights, self._tdee, self._tdee_sd, self._intakes, self._observed)
+        if self._days and self._days[-1] == self.day:
+            for column, value in zip(series, values):
+                column[-1] = value
+        else:
+            for column, value in zip(series, values):
+                column.append(value)
+
+    def update(self, date, weight=None, intake=None, count=1):
+        """date の体重や摂取カロリーを反映する
+
+        日付は古い順に渡す。前回より前の日付は無視する。
+        weight が count 回の計測の平均なら count も渡す。
+        """
+        day = self._day_number(date)
+        if self.day is None:
+            if weight is None:
+                # 体重の記録が始まるまでは推定できない
+                return
+            self.day = day
+        if day < self.day:
+            return
+        while self.day < day:
+            self._predict()
+        if intake is not None:
+            self._intake = (self._intake or 0) + intake
+        observed = self._observed[-1] if self._days and self._days[-1] == self.day else math.nan
+        if weight is not None:
+            self._observe(weight, count)
+            observed = weight
+        self._record(observed)
+
+    @property
+    def tdee(self):
+        """最新の TDEE の推定値"""
+        return self.t
+
+    @property
+    def tdee_sd(self):
+        return math.sqrt(self.p11)
+
+    def series(self):
+        """日ごとの推定値を配列で返す"""
+        return {
+            'date': np.array(self._days, dtype='datetime64[D]'),
+            'weight_trend': np.array(self._weights),
+            'tdee': np.array(self._tdee),
+            'tdee_sd': np.array(self._tdee_sd),
+            'intake': np.array(self._intakes),
+            'observed_weight': np.array(self._observed),
+        }
+
+    def tdee_at(self, date):
+        """指定日の TDEE の推定値（範囲外なら NaN）"""
+        if not self._days:
+            return math.nan
+        index = self._day_number(date) - self._days[0]
+        if 0 <= index < len(self._days):
+            return self._tdee[index]
+        return math.nan
+
+    @classmethod
+    def from_sources(cls, records, food_log=None, **kwargs):
+        """体重の記録（RecordColumns）と食事記録（FoodLog）から作る
+
+        体重は日ごとに平均し、摂取カロリーは日ごとに合計して同じ日付でそろえる。
+        """
+        model = cls(**kwargs)
+        if not records:
+            return model
+        days = records.dates.astype('datetime64[D]')
+        weight_days, codes = np.unique(days, return_inverse=True)
+        counts = np.bincount(codes)
+        daily_weight = np.bincount(codes, weights=records.values('weight')) / counts
+        weights = dict(zip(weight_days.astype(np.int64).tolist(), zip(daily_weight.tolist(), counts.tolist())))
+
+        intakes = {}
+        if food_log is not None and len(food_log):
+            intake_days, totals = food_log.group_totals('date')
+            intakes = dict(zip(intake_days.astype(np.int64).tolist(), totals[:, 0].tolist()))
+
+        first = int(weight_days[0].astype(np.int64))
+        last = max(int(weight_days[-1].astype(np.int64)), max(intakes, default=first))
+        for day in range(first, last + 1):
+            if day in weights or day in intakes:
+                weight, count = weights.get(day, (None, 1))
+                model.update(np.datetime64(day, 'D'), weight, intakes.get(day), count)
+        return model
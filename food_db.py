@@ -0,0 +1,152 @@
+"""食品成分データベース（名前の前方一致・あいまい検索）
+
+同梱の foods.csv は主な食品の可食部100gあたりの値を抜き出した小さなサンプル。
+同じ列（id, name, calories, protein, fat, carbs）を持つ CSV なら、
+食品成分表の書き出しなど大きなファイルもそのまま読み込める。
+"""
+import csv
+import os
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+
+DEFAULT_FOODS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'foods.csv')
+
+
+def normalize_name(name):
+    """検索用に表記を揃える（全角半角・大文字小文字を統一し、カタカナはひらがなに）"""
+    text = unicodedata.normalize('NFKC', name).lower()
+    return ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+
+
+def _bigrams(text):
+    text = text.replace(' ', '')
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FoodItem:
+    """食品1件（栄養素は100gあたり）"""
+    __slots__ = ('id', 'name', 'calories', 'protein', 'fat', 'carbs')
+
+    def __init__(self, id, name, calories, protein, fat, carbs):
+        self.id = id
+        self.name = name
+        self.calories = calories
+        self.protein = protein
+        self.fat = fat
+        self.carbs = carbs
+
+    def scaled(self, grams):
+        """grams グラムあたりの (calories, protein, fat, carbs)"""
+        factor = grams / 100
+        return tuple(round(value * factor, 1) for value in (self.calories, self.protein, self.fat, self.carbs))
+
+
+class FoodDatabase:
+    """食品の一覧と検索用インデックス
+
+    前方一致は名前と名前中の各語の整列済みリストを二分探索し、
+    あいまい検索は2文字組（bigram）の転置インデックスで候補を絞って Dice 係数で並べる。
+    検索結果はクエリごとにキャッシュする。
+    """
+
+    def __init__(self, items=(), cache_size=1024):
+        self.items = {}
+        self._by_name = {}
+        self._prefix_keys = []
+        self._bigram_index = defaultdict(list)
+        self._bigram_counts = {}
+        for item in items:
+            self._add(item)
+        self._prefix_keys.sort()
+        self.search_prefix = lru_cache(maxsize=cache_size)(self._search_prefix)
+        self.search_fuzzy = lru_cache(maxsize=cache_size)(self._search_fuzzy)
+
+    def _add(self, item):
+        self.items[item.id] = item
+        normalized = normalize_name(item.name)
+        self._by_name.setdefault(normalized.replace(' ', ''), item.id)
+        keys = {normalized.replace(' ', '')} | set(normalized.split())
+        for key in keys:
+            self._prefix_keys.append((key, item.id))
+        bigrams = _bigrams(normalized)
+        for bigram in bigrams:
+            self._bigram_index[bigram].append(item.id)
+        self._bigram_counts[item.id] = len(bigrams)
+
+    @classmethod
+    def load_csv(cls, path=DEFAULT_FOODS_CSV):
+        items = []
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    items.append(FoodItem(row['id'].strip(), row['name'].strip(), float(row['calories']),
+                                          float(row['protein']), float(row['fat']), float(row['carbs'])))
+                except (KeyError, ValueError):
+                    continue
+        return cls(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        """id または正確な名前で食品を取得（見つからなければ KeyError）"""
+        key = str(key)
+        if key in self.items:
+            return self.items[key]
+        food_id = self._by_name.get(normalize_name(key).replace(' ', ''))
+        if food_id is not None:
+            return self.items[food_id]
+        raise KeyError(f"食品が見つかりません: {key}")
+
+    def _search_prefix(self, query, limit=10):
+        """名前、または名前中の語が query で始まる食品"""
+        prefix = normalize_name(query).replace(' ', '')
+        if not prefix:
+            return ()
+        results = []
+        seen = set()
+        i = bisect_left(self._prefix_keys, (prefix, ''))
+        while i < len(self._prefix_keys) and len(results) < limit:
+            key, food_id = self._prefix_keys[i]
+            if not key.startswith(prefix):
+                break
+            if food_id not in seen:
+                seen.add(food_id)
+                results.append(self.items[food_id])
+            i += 1
+        return tuple(results)
+
+    def _search_fuzzy(self, query, limit=10, min_score=0.3):
+        """表記ゆれや打ち間違いを許して似た名前の食品を探す"""
+        query_bigrams = _bigrams(normalize_name(query))
+        if not query_bigrams:
+            return ()
+        shared = defaultdict(int)
+        for bigram in query_bigrams:
+            for food_id in self._bigram_index.get(bigram, ()):
+                shared[food_id] += 1
+        scored = []
+        for food_id, count in shared.items():
+            score = 2 * count / (len(query_bigrams) + self._bigram_counts[food_id])
+            if score >= min_score:
+                scored.append((-score, food_id))
+        scored.sort()
+        return tuple(self.items[food_id] for _, food_id in scored[:limit])
+
+    def search(self, query, limit=10):
+        """前方一致の結果を優先し、足りなければあいまい検索の結果で補う"""
+        results = list(self.search_prefix(query, limit))
+        if len(results) < limit:
+            ids = {item.id for item in results}
+            results.extend(item for item in self.search_fuzzy(query, limit) if item.id not in ids)
+        return results[:limit]
+
+
+@lru_cache(maxsize=None)
+def load_default_database():
+    """同梱の foods.csv を読み込んだデータベース（プロセス内で共有）"""
+    return FoodDatabase.load_csv(DEFAULT_FOODS_CSV)
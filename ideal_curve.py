@@ -0,0 +1,79 @@
+"""理想的な減少曲線のモデル"""
+from functools import lru_cache
+
+import numpy as np
+
+
+class IdealCurve:
+    """開始値・目標・時定数から決まる理想曲線
+
+    体重:     start_weight - target_weight_loss * (1 - exp(-d / weight_tau))
+    体脂肪率: start_bf - target_bf_loss * (1 - exp(-(d - bf_delay) / bf_tau))
+
+    d は開始日からの経過日数（暦日）。0〜duration_days の値は事前計算してあり、
+    日付からの参照はインデックス計算だけで済む。範囲外の日は同じ式で計算する。
+    """
+
+    def __init__(self, start_date, start_weight, start_bf, target_weight_loss, target_bf_loss,
+                 duration_days, weight_tau=120, bf_tau=100, bf_delay=7):
+        self.start_date = start_date
+        self.start_weight = start_weight
+        self.start_bf = start_bf
+        self.target_weight_loss = target_weight_loss
+        self.target_bf_loss = target_bf_loss
+        self.duration_days = duration_days
+        self.weight_tau = weight_tau
+        self.bf_tau = bf_tau
+        self.bf_delay = bf_delay
+        self.start_day = np.datetime64(start_date, 'D')
+
+        days = np.arange(duration_days + 1)
+        self.weights = self.weight_at_days(days)
+        self.body_fat = self.bf_at_days(days)
+        # 読み取り専用にしてキャッシュ共有中の書き換えを防ぐ
+        self.weights.flags.writeable = False
+        self.body_fat.flags.writeable = False
+
+    def weight_at_days(self, days):
+        days = np.asarray(days, dtype=np.float64)
+        return self.start_weight - self.target_weight_loss * (1 - np.exp(-days / self.weight_tau))
+
+    def bf_at_days(self, days):
+        days = np.asarray(days, dtype=np.float64)
+        return self.start_bf - self.target_bf_loss * (1 - np.exp(-(days - self.bf_delay) / self.bf_tau))
+
+    @property
+    def dates(self):
+        """事前計算した各日の日時（datetime64[s]）"""
+        start = np.datetime64(self.start_date, 's')
+        return start + np.arange(self.duration_days + 1) * np.timedelta64(1, 'D')
+
+    def day_offset(self, date):
+        """開始日からの経過日数（暦日、開始日より前は 0）"""
+        return max((date.date() - self.start_date.date()).days, 0)
+
+    def at(self, date):
+        """指定日の (理想体重, 理想体脂肪率)"""
+        day = self.day_offset(date)
+        if day <= self.duration_days:
+            return float(self.weights[day]), float(self.body_fat[day])
+        return float(self.weight_at_days(day)), float(self.bf_at_days(day))
+
+    def evaluate(self, dates):
+        """日付の配列に対する (理想体重の配列, 理想体脂肪率の配列)"""
+        days = np.asarray(dates, dtype='datetime64[s]').astype('datetime64[D]') - self.start_day
+        days = np.maximum(days.astype(np.int64), 0)
+        return self.weight_at_days(days), self.bf_at_days(days)
+
+    def diffs(self, dates, weights, body_fat):
+        """実測値と理想値の差分 (体重の差, 体脂肪率の差) をまとめて計算"""
+        ideal_weights, ideal_bf = self.evaluate(dates)
+        return np.asarray(weights) - ideal_weights, np.asarray(body_fat) - ideal_bf
+
+
+@lru_cache(maxsize=64)
+def get_ideal_curve(start_date, start_weight, start_bf, target_weight_loss, target_bf_loss,
+                    duration_days, weight_tau=120, bf_tau=100, bf_delay=7):
+    """パラメータごとにメモ化した IdealCurve を返す"""
+    return IdealCurve(start_date, start_weight, start_bf, target_weight_loss, target_bf_loss,
+                      duration_days, weight_tau, bf_tau, bf_delay)
@@ -0,0 +1,163 @@
+"""過去の体重データ（CSV / JSON Lines / 体組成計のエクスポート）の一括取り込み"""
+import csv
+import json
+import math
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from records import RecordColumns, parse_dates
+from storage import DATE_FORMAT
+
+# 体組成計アプリなどのエクスポートで使われる列名の別名（小文字・空白除去で比較）
+DATE_KEYS = ('date', 'datetime', 'timestamp', 'time', '日付', '日時', '測定日時')
+WEIGHT_KEYS = ('weight', 'weight(kg)', 'weightkg', 'weight_kg', '体重', '体重(kg)')
+BF_KEYS = ('body_fat', 'bodyfat', 'bf', 'bodyfat(%)', 'fat', 'fat(%)', 'fat_percent',
+           'body_fat_percent', '体脂肪率', '体脂肪率(%)')
+
+# 取り込む値の妥当な範囲
+WEIGHT_RANGE = (20.0, 300.0)
+BF_RANGE = (1.0, 75.0)
+
+# 年-月-日[ 時:分[:秒[.小数]]][タイムゾーン]（月日・時分秒は1桁も可）
+_DATE_PATTERN = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})'
+                           r'(?:[ T](\d{1,2}):(\d{1,2})(?::(\d{1,2})(?:\.\d+)?)?)?'
+                           r'\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def _normalize_key(key):
+    return key.strip().lower().replace(' ', '')
+
+
+def _find_key(keys, candidates):
+    normalized = {_normalize_key(k): k for k in keys}
+    for candidate in candidates:
+        if candidate in normalized:
+            return normalized[candidate]
+    return None
+
+
+def normalize_date(value):
+    """日付を 'YYYY-MM-DD HH:MM:SS' の文字列に揃える
+
+    '/' 区切りを '-' に、1桁の月日・時刻を2桁にし、UNIX 時刻（秒・ミリ秒）と
+    タイムゾーン付きの日時はこの環境のローカル時刻に変換する（記録はローカル時刻で持つ）。
+    読めない文字列はそのまま返す（parse_dates で NaT になる）。
+    """
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.strip().isdigit()):
+        seconds = float(value)
+        if seconds > 1e11:
+            seconds /= 1000
+        return datetime.fromtimestamp(int(seconds)).strftime(DATE_FORMAT)
+    text = str(value).strip().replace('/', '-')
+    match = _DATE_PATTERN.match(text)
+    if match is None:
+        return text
+    *parts, tz = match.groups()
+    try:
+        date = datetime(*(int(part or 0) for part in parts))
+    except ValueError:
+        return text
+    if tz:
+        offset = 0 if tz == 'Z' else int(tz[1:3]) * 60 + int(tz[-2:])
+        zone = timezone(timedelta(minutes=-offset if tz[0] == '-' else offset))
+        date = date.replace(tzinfo=zone).astimezone().replace(tzinfo=None)
+    return date.strftime(DATE_FORMAT)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def iter_rows(path):
+    """CSV または JSON Lines を1行ずつ dict で返す"""
+    if path.endswith(('.jsonl', '.ndjson')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {}
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+
+
+def iter_chunks(path, chunk_size=50000):
+    """chunk_size 行ずつ (日付の配列, 体重の配列, 体脂肪率の配列) を返す"""
+    keys = None
+    dates, weights, body_fat = [], [], []
+
+    def build():
+        return (parse_dates(dates),
+                np.array(weights, dtype=np.float64),
+                np.array(body_fat, dtype=np.float64))
+
+    for row in iter_rows(path):
+        if keys is None and row:
+            keys = (_find_key(row, DATE_KEYS), _find_key(row, WEIGHT_KEYS), _find_key(row, BF_KEYS))
+            if None in keys:
+                raise ValueError(f"日付・体重・体脂肪率の列が見つかりません: {list(row)}")
+        date_key, weight_key, bf_key = keys or (None, None, None)
+        date = row.get(date_key) if row else None
+        dates.append(normalize_date(date) if date not in (None, '') else 'NaT')
+        weights.append(_to_float(row.get(weight_key)) if row else math.nan)
+        body_fat.append(_to_float(row.get(bf_key)) if row else math.nan)
+        if len(dates) >= chunk_size:
+            yield build()
+            dates, weights, body_fat = [], [], []
+    if dates:
+        yield build()
+
+
+def valid_mask(dates, weights, body_fat):
+    """日付が読めて、体重・体脂肪率が妥当な範囲にある行"""
+    return (~np.isnat(dates)
+            & (weights >= WEIGHT_RANGE[0]) & (weights <= WEIGHT_RANGE[1])
+            & (body_fat >= BF_RANGE[0]) & (body_fat <= BF_RANGE[1]))
+
+
+def import_file(tracker, path, chunk_size=50000):
+    """ファイルを読み込み、検証・重複除去してトラッカーに一括で追加する
+
+    取り込み結果（件数・所要時間・1秒あたりの件数）を dict で返す。
+    """
+    start = time.perf_counter()
+    incoming = RecordColumns()
+    total = 0
+    invalid = 0
+    for dates, weights, body_fat in iter_chunks(path, chunk_size):
+        total += len(dates)
+        mask = valid_mask(dates, weights, body_fat)
+        invalid += int((~mask).sum())
+        incoming.extend_arrays(dates[mask], {'weight': weights[mask], 'body_fat': body_fat[mask]})
+
+    imported = tracker.import_columns(incoming)
+    seconds = time.perf_counter() - start
+    return {
+        'path': path,
+        'read': total,
+        'invalid': invalid,
+        'duplicates': len(incoming) - imported,
+        'imported': imported,
+        'seconds': seconds,
+        'records_per_sec': total / seconds if seconds > 0 else math.inf,
+    }
+
+
+def print_import_result(result):
+    print("\n=== インポート結果 ===")
+    print(f"ファイル: {result['path']}")
+    print(f"読み込み行数: {result['read']}")
+    print(f"取り込み件数: {result['imported']}")
+    print(f"不正な行: {result['invalid']}")
+    print(f"重複により除外: {result['duplicates']}")
+    print(f"処理時間: {result['seconds']:.2f}秒 ({result['records_per_sec']:.0f}件/秒)")
@@ -0,0 +1,239 @@
+"""処理時間と件数の計測（既定では無効）
+
+環境変数で有効にする:
+    FITNESS_METRICS=metrics.json   終了時に計測結果を書き出す（.prom なら Prometheus 形式）
+    FITNESS_PROFILE=cpu,memory     cProfile / tracemalloc でプロファイルを取る
+    FITNESS_PROFILE_DIR=profiles   プロファイルの保存先（既定はカレントディレクトリ）
+
+無効なときの span() は何もしない共有オブジェクトを返すだけなので、
+計測箇所を通るコストは属性の参照1回程度で済む。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+# 処理時間のヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+
+class _NullSpan:
+    """無効なときに使う何もしない span"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class SpanStats:
+    """1種類の処理の回数・合計時間・最大時間・エラー数"""
+    __slots__ = ('count', 'total', 'max', 'errors', 'buckets', 'last_error')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.last_error = None
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'max_seconds': self.max,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc is not None:
+            self.metrics.error(self.name, exc)
+        return False
+
+
+class Metrics:
+    """span（処理時間）とカウンタを集計する"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._tracing_memory = False
+
+    def span(self, name):
+        """with metrics.span('load'): ... で処理時間を記録する（例外はエラーとして数える）"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.observe(seconds)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def error(self, name, exc):
+        """握りつぶしたエラーも含めて span ごとに数える"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.errors += 1
+            stats.last_error = f'{type(exc).__name__}: {exc}'
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'spans': {name: stats.to_dict() for name, stats in self.spans.items()},
+                'counters': dict(self.counters),
+            }
+
+    def to_prometheus(self, prefix='fitness'):
+        """Prometheus のテキスト形式"""
+        lines = [f'# TYPE {prefix}_span_seconds histogram']
+        with self._lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+            for name, stats in spans:
+                cumulative = 0
+                for bound, n in zip(BUCKETS, stats.buckets):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {stats.total!r}')
+                lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {stats.count}')
+            lines.append(f'# TYPE {prefix}_errors_total counter')
+            for name, stats in spans:
+                lines.append(f'{prefix}_errors_total{{span="{name}"}} {stats.errors}')
+            for name, value in counters:
+                lines.append(f'# TYPE {prefix}_{name}_total counter')
+                lines.append(f'{prefix}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """path に書き出す（拡張子が .prom なら Prometheus 形式、それ以外は JSON）"""
+        if path.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return path
+
+    def start_profiling(self, cpu=True, memory=False):
+        """cProfile / tracemalloc での記録を始める（計測も有効にする）"""
+        self.enabled = True
+        if cpu and self._profiler is None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if memory and not self._tracing_memory:
+            import tracemalloc
+            tracemalloc.start()
+            self._tracing_memory = True
+
+    def stop_profiling(self, directory='.'):
+        """プロファイルを directory に保存し、保存したパスのリストを返す
+
+        CPU は fitness.prof（pstats / snakeviz で読める）、メモリは
+        確保量の多い箇所の一覧を fitness_memory.txt に書く。
+        """
+        paths = []
+        os.makedirs(directory, exist_ok=True)
+        if self._profiler is not None:
+            self._profiler.disable()
+            path = os.path.join(directory, 'fitness.prof')
+            self._profiler.dump_stats(path)
+            self._profiler = None
+            paths.append(path)
+        if self._tracing_memory:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._tracing_memory = False
+            path = os.path.join(directory, 'fitness_memory.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'peak: {peak / 1e6:.1f} MB\n')
+                for stat in snapshot.statistics('lineno')[:30]:
+                    f.write(f'{stat}\n')
+            paths.append(path)
+        return paths
+
+
+metrics = Metrics(enabled=bool(os.environ.get('FITNESS_METRICS') or os.environ.get('FITNESS_PROFILE')))
+
+
+def _configure_from_env():
+    profile = {mode.strip() for mode in os.environ.get('FITNESS_PROFILE', '').split(',') if mode.strip()}
+    if profile:
+        metrics.start_profiling(cpu='cpu' in profile, memory='memory' in profile)
+    export_path = os.environ.get('FITNESS_METRICS')
+    if not (profile or export_path):
+        return
+
+    def finish():
+        try:
+            if profile:
+                for path in metrics.stop_profiling(os.environ.get('FITNESS_PROFILE_DIR', '.')):
+                    print(f"プロファイルを '{path}' に保存しました。")
+            if export_path:
+                metrics.export(export_path)
+        except Exception as e:
+            print(f"計測結果の保存中にエラーが発生しました: {str(e)}")
+
+    atexit.register(finish)
+
+
+_configure_from_env()
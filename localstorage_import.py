@@ -0,0 +1,283 @@
+"""index.html の localStorage のエクスポート（ft_weight / ft_bike / ft_workout）の取り込み
+
+ブラウザの開発者ツールなどで書き出した localStorage の JSON を読み込み、
+    - ft_weight（saveWeight の体重・体脂肪率）はトラッカーの記録に、
+    - ft_bike（saveBikeSession）と ft_workout（saveWorkoutLog）は活動記録に
+まとめる。入力は1ファイルに1つのダンプ（{"ft_weight": "[...]", ...}、値は JSON 文字列でも
+配列でもよい）か、ダンプのリスト、または1行1ダンプの JSON Lines。複数の端末のダンプを
+並べて渡せば、ファイルごと・ダンプごとに読んでは捨てる1パスで統合する。
+
+重複と食い違いの扱い:
+    体重      日時（秒単位、端末のローカル時刻に変換）が同じなら同じ記録。ダンプ同士で
+              値が違えば後に渡した方を使い、既存の記録とは prefer で決める。
+    バイク    開始日時（ミリ秒）が同じなら同じ記録。後に渡した方を使う。
+    ワークアウト  日付が同じなら同じ記録（index.html も日付ごとに上書きする）。後に渡した方を使う。
+"""
+import json
+import math
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from importer import valid_mask
+from records import RecordColumns, parse_dates
+from storage import DATE_FORMAT
+
+LOCALSTORAGE_KEYS = {'weight': 'ft_weight', 'bike': 'ft_bike', 'workout': 'ft_workout'}
+# 日ごとの活動量の列
+ACTIVITY_FIELDS = ('bike_sessions', 'bike_seconds', 'bike_km', 'bike_kcal', 'workout_sets', 'workout_reps')
+PREFER = ('existing', 'import')
+
+
+def iter_dumps(path):
+    """ファイル内の localStorage のダンプ（dict）を1つずつ返す"""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    if isinstance(data, list):
+        yield from data
+    else:
+        yield data
+
+
+def entries(dump, kind):
+    """ダンプから ft_weight などの配列を取り出す（値が JSON 文字列なら読み込む）"""
+    value = dump.get(LOCALSTORAGE_KEYS[kind])
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+def local_time(text, tz=None):
+    """toISOString() の UTC 日時を tz（省略時はこの環境のタイムゾーン）の時刻に変換"""
+    moment = datetime.fromisoformat(str(text).replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(tz).replace(tzinfo=None)
+    return moment
+
+
+def _number(value, default=0.0):
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return default
+    return result if math.isfinite(result) else default
+
+
+def bike_volume(entry):
+    """バイク1回分の (日時のミリ秒, 日付, 活動量の dict)"""
+    moment = local_time(entry['date'])
+    key = int(np.datetime64(moment, 'ms').astype(np.int64))
+    return key, moment.date().isoformat(), {
+        'bike_sessions': 1,
+        'bike_seconds': _number(entry.get('duration')),
+        'bike_km': _number(entry.get('distance')),
+        'bike_kcal': _number(entry.get('calories')),
+    }
+
+
+def workout_volume(entry):
+    """ワークアウト1日分の (日付, 日付, 活動量の dict)。完了したセットだけ数える"""
+    day = str(entry['date'])[:10]
+    sets = 0
+    reps = 0.0
+    for exercise in entry.get('exercises') or []:
+        for s in exercise.get('sets') or []:
+            if 'repsR' in s or 'repsL' in s:
+                # 左右別の種目は左右それぞれを1セットとして数える
+                for side in ('R', 'L'):
+                    if s.get(f'done{side}'):
+                        sets += 1
+                        reps += _number(s.get(f'reps{side}'))
+            elif s.get('done'):
+                sets += 1
+                reps += _number(s.get('reps'))
+    return day, day, {'workout_sets': sets, 'workout_reps': reps}
+
+
+class ActivityLog:
+    """バイク・ワークアウトの記録を重複なく保持し、日ごとの活動量を集計する
+
+    1行1記録の JSON Lines（{"kind", "key", "day", 活動量...}）に追記し、同じ
+    (kind, key) は後の行を有効とする（JsonLinesStore と同じ考え方）。
+    保持するのは記録ごとの活動量だけで、元のセット内容などは持たない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._pending = []
+        self._garbage = 0
+        self.load()
+
+    def load(self):
+        self.entries.clear()
+        self._garbage = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        data = json.loads(line)
+                        key = (data.pop('kind'), data.pop('key'))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        self._garbage += 1
+                        continue
+                    if key in self.entries:
+                        self._garbage += 1
+                    self.entries[key] = data
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, kind, key, day, volume):
+        """記録を加え、'new' / 'updated'（内容が変わった） / 'duplicate' を返す"""
+        data = {'day': day, **volume}
+        old = self.entries.get((kind, key))
+        if old == data:
+            return 'duplicate'
+        self.entries[(kind, key)] = data
+        self._pending.append({'kind': kind, 'key': key, **data})
+        if old is None:
+            return 'new'
+        # ファイル上の古い行は無効になる
+        self._garbage += 1
+        return 'updated'
+
+    def flush(self):
+        """追加・更新した記録をファイルに追記し、重複がたまっていれば書き直す"""
+        if not self._pending:
+            return 0
+        payload = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in self._pending)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        written = len(self._pending)
+        self._pending = []
+        if self._garbage >= 1000 and self._garbage >= len(self.entries):
+            self.compact()
+        return written
+
+    def compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for (kind, key), data in self.entries.items():
+                f.write(json.dumps({'kind': kind, 'key': key, **data}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._garbage = 0
+
+    def daily(self):
+        """日ごとの活動量 (日付の配列（datetime64[D]）, {列名: 配列}) を返す"""
+        if not self.entries:
+            return np.array([], dtype='datetime64[D]'), {name: np.zeros(0) for name in ACTIVITY_FIELDS}
+        rows = list(self.entries.values())
+        days, codes = np.unique(np.array([row['day'] for row in rows], dtype='datetime64[D]'), return_inverse=True)
+        totals = {}
+        for name in ACTIVITY_FIELDS:
+            values = np.array([row.get(name, 0) for row in rows], dtype=np.float64)
+            totals[name] = np.bincount(codes, weights=values, minlength=len(days))
+        return days, totals
+
+    def daily_rows(self):
+        days, totals = self.daily()
+        return [{'date': str(day), **{name: float(totals[name][i]) for name in ACTIVITY_FIELDS}}
+                for i, day in enumerate(days)]
+
+
+def activity_path(tracker):
+    """トラッカーのデータファイルの隣に置く活動記録のパス"""
+    return os.path.splitext(tracker.data_file)[0] + '_activity.jsonl'
+
+
+def import_localstorage(tracker, paths, prefer='existing', activity_file=None):
+    """localStorage のダンプを順に読み込んでトラッカーと活動記録に統合し、結果の dict を返す
+
+    prefer='existing' なら既存の記録と同じ日時の体重は取り込まず、'import' なら
+    値が違えば取り込む方で置き換える。活動記録は activity_file（省略時は activity_path）。
+    """
+    if prefer not in PREFER:
+        raise ValueError(f"prefer は {' / '.join(PREFER)} のいずれかです: {prefer}")
+    start = time.perf_counter()
+    activity = ActivityLog(activity_file or activity_path(tracker))
+    incoming = RecordColumns()
+    result = {'paths': list(paths), 'dumps': 0, 'weights_read': 0, 'weights_invalid': 0,
+              'weights_conflicts': 0, 'bike': {'new': 0, 'updated': 0, 'duplicate': 0, 'invalid': 0},
+              'workout': {'new': 0, 'updated': 0, 'duplicate': 0, 'invalid': 0}}
+
+    for path in paths:
+        for dump in iter_dumps(path):
+            if not isinstance(dump, dict):
+                continue
+            result['dumps'] += 1
+            # 体重はダンプごとに配列にまとめて列形式で追加する
+            dates, weights, body_fat = [], [], []
+            for entry in entries(dump, 'weight'):
+                try:
+                    dates.append(local_time(entry['date']).strftime(DATE_FORMAT))
+                except (KeyError, TypeError, ValueError):
+                    dates.append('NaT')
+                weights.append(_number(entry.get('weight'), math.nan) if isinstance(entry, dict) else math.nan)
+                body_fat.append(_number(entry.get('bf'), math.nan) if isinstance(entry, dict) else math.nan)
+            if dates:
+                parsed = parse_dates(dates)
+                weights = np.array(weights)
+                body_fat = np.array(body_fat)
+                mask = valid_mask(parsed, weights, body_fat)
+                result['weights_read'] += len(dates)
+                result['weights_invalid'] += int((~mask).sum())
+                incoming.extend_arrays(parsed[mask], {'weight': weights[mask], 'body_fat': body_fat[mask]})
+
+            for kind, volume in (('bike', bike_volume), ('workout', workout_volume)):
+                for entry in entries(dump, kind):
+                    try:
+                        key, day, values = volume(entry)
+                    except (KeyError, TypeError, ValueError, AttributeError):
+                        result[kind]['invalid'] += 1
+                        continue
+                    result[kind][activity.put(kind, key, day, values)] += 1
+            # 端末ごとのダンプが大きくても、活動記録は読んだ分から書き出す
+            activity.flush()
+
+    # ダンプ同士で同じ日時・違う値の体重（後に渡した方を使う）
+    ordered = np.argsort(incoming.dates, kind='stable')
+    dates = incoming.dates[ordered]
+    same = dates[1:] == dates[:-1]
+    differs = ((incoming.column('weight')[ordered][1:] != incoming.column('weight')[ordered][:-1])
+               | (incoming.column('body_fat')[ordered][1:] != incoming.column('body_fat')[ordered][:-1]))
+    result['weights_conflicts'] = int((same & differs).sum())
+    unique = len(incoming) - int(same.sum())
+    imported = tracker.import_columns(incoming, replace=(prefer == 'import'))
+    result['weights_imported'] = imported
+    result['weights_duplicates'] = unique - imported
+    result['activity_file'] = activity.path
+    result['activity_days'] = len(activity.daily()[0])
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def print_localstorage_result(result):
+    print("\n=== localStorage の取り込み結果 ===")
+    print(f"ファイル: {len(result['paths'])}件（ダンプ {result['dumps']}件）")
+    print(f"体重: 読み込み {result['weights_read']}件、取り込み {result['weights_imported']}件、"
+          f"重複 {result['weights_duplicates']}件、不正 {result['weights_invalid']}件、"
+          f"食い違い {result['weights_conflicts']}件")
+    for kind, label in (('bike', 'バイク'), ('workout', 'ワークアウト')):
+        counts = result[kind]
+        print(f"{label}: 新規 {counts['new']}件、更新 {counts['updated']}件、"
+              f"重複 {counts['duplicate']}件、不正 {counts['invalid']}件")
+    print(f"活動記録: {result['activity_days']}日分（{result['activity_file']}）")
+    print(f"所要時間: {result['seconds']:.2f}秒")
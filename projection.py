@@ -0,0 +1,167 @@
+"""目標達成日の予測（モンテカルロ法）
+
+直近の記録（日ごとの平均体重）に理想曲線と同じ指数の形と直線を当てはめ、
+当てはまりの良い方を使う。残差をブロック単位で復元抽出して当てはめ直すことを
+何千回も繰り返し（NumPy でまとめて計算）、目標体重に届く日の分布を求める。
+増量の目標は体重の符号を反転して、減量と同じ計算で求める。
+"""
+import math
+
+import numpy as np
+
+# 指数モデルの時定数の候補（日）
+TAU_GRID = np.geomspace(10, 1000, 48)
+
+
+def daily_means(dates, values):
+    """記録を日ごとに平均して (日数の配列, 平均値の配列) を返す（日数は 1970-01-01 から）"""
+    days = np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+    unique_days, codes = np.unique(days, return_inverse=True)
+    means = np.bincount(codes, weights=np.asarray(values, dtype=np.float64)) / np.bincount(codes)
+    return unique_days, means
+
+
+def _design(model, x, tau):
+    if model == 'linear':
+        return np.column_stack([np.ones_like(x), x])
+    return np.column_stack([np.ones_like(x), np.exp(-x / tau)])
+
+
+def _tau_profile(x, y):
+    """TAU_GRID の各 tau について最小二乗法で解いた (c の配列, b の配列, 残差平方和の配列)"""
+    e = np.exp(-x[None, :] / TAU_GRID[:, None])
+    n = len(x)
+    se, see = e.sum(axis=1), (e * e).sum(axis=1)
+    sy, sey = y.sum(), (e * y).sum(axis=1)
+    det = n * see - se * se
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b = (n * sey - se * sy) / det
+        c = (sy - b * se) / n
+        sse = ((y[None, :] - c[:, None] - b[:, None] * e) ** 2).sum(axis=1)
+    return c, b, np.where(np.isfinite(sse), sse, np.inf)
+
+
+def fit_exponential(x, y):
+    """y = c + b * exp(-x / tau) を当てはめ、(c, b, tau, 残差平方和) を返す
+
+    tau は TAU_GRID から選び、c, b は tau ごとの最小二乗法でまとめて解く。
+    """
+    c, b, sse = _tau_profile(x, y)
+    best = int(np.argmin(sse))
+    return float(c[best]), float(b[best]), float(TAU_GRID[best]), float(sse[best])
+
+
+def fit_linear(x, y):
+    """y = a + s * x を当てはめ、(a, s, 残差平方和) を返す"""
+    s, a = np.polyfit(x, y, 1)
+    return float(a), float(s), float(((y - a - s * x) ** 2).sum())
+
+
+def _bic(sse, n, k):
+    return n * math.log(max(sse, 1e-12) / n) + k * math.log(n)
+
+
+def _block_indices(rng, n, paths, block):
+    """長さ block のブロックを復元抽出して並べた (paths, n) のインデックス"""
+    block = max(1, min(block, n))
+    starts = rng.integers(0, n - block + 1, size=(paths, -(-n // block)))
+    return (starts[:, :, None] + np.arange(block)).reshape(paths, -1)[:, :n]
+
+
+def _crossing_days(model, params, tau, target, start):
+    """各パスのトレンドが target 以下になる x（start より後）。届かなければ inf"""
+    if model == 'linear':
+        a, s = params[:, 0], params[:, 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.where(s < 0, (target - a) / s, np.inf)
+    else:
+        c, b = params[:, 0], params[:, 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = (target - c) / b
+            x = np.where((b > 0) & (ratio > 0), -tau * np.log(ratio), np.inf)
+    return np.where(np.isnan(x), np.inf, np.maximum(x, start))
+
+
+def project_goal(dates, weights, target_weight, paths=10000, horizon_days=365, window_days=120,
+                 model='auto', block=7, percentiles=(10, 25, 50, 75, 90), seed=None, gain=False):
+    """目標体重に届く日を予測する
+
+    gain=True なら目標は増量（体重が target_weight 以上になる日を求める）。
+    直近 window_days 日の日平均体重に model（'exp' / 'linear' / 'auto'）を当てはめ、
+    残差のブロックブートストラップ（block 日ずつ）で paths 本のトレンドを作る。
+    指数モデルでは時定数もパスごとに尤度に応じて選び直す。
+    最終記録日から horizon_days 日以内に届いたパスの割合と、届く日の
+    パーセンタイル（最終記録日からの日数と日付）を辞書で返す。日平均が3日分未満なら None。
+    """
+    # 増量は符号を反転して「target 以下になる日」として解き、結果の体重と係数は元に戻す
+    sign = -1.0 if gain else 1.0
+    days, means = daily_means(dates, weights)
+    means = sign * means
+    target_weight = sign * target_weight
+    if len(days) and days[-1] - days[0] >= window_days:
+        keep = days > days[-1] - window_days
+        days, means = days[keep], means[keep]
+    n = len(days)
+    if n < 3:
+        return None
+
+    x = (days - days[0]).astype(np.float64)
+    last_x = x[-1]
+    c, b, tau, exp_sse = fit_exponential(x, means)
+    a, s, lin_sse = fit_linear(x, means)
+    if model == 'auto':
+        model = 'exp' if _bic(exp_sse, n, 3) < _bic(lin_sse, n, 2) else 'linear'
+    params = np.array([c, b] if model == 'exp' else [a, s])
+
+    fitted = _design(model, x, tau) @ params
+    residuals = means - fitted
+    current_trend = float(fitted[-1])
+
+    # 合成した履歴を当てはめ直す: 係数は (当てはめ値 + 残差) の一次式なので、
+    # 擬似逆行列を掛けるだけで全パス分まとめて求まる
+    rng = np.random.default_rng(seed)
+    indices = _block_indices(rng, n, paths, block)
+    if current_trend <= target_weight:
+        reach = np.zeros(paths)
+    elif model == 'linear':
+        design = _design(model, x, tau)
+        boot_params = params + residuals[indices] @ np.linalg.pinv(design).T
+        reach = _crossing_days(model, boot_params, tau, target_weight, last_x) - last_x
+    else:
+        # 時定数も不確かなので、パスごとに tau を当てはまりの良さ（尤度）に応じて選ぶ
+        cs, bs, sses = _tau_profile(x, means)
+        log_likelihood = -n / 2 * np.log(np.maximum(sses, 1e-12))
+        probs = np.exp(log_likelihood - log_likelihood.max())
+        tau_index = rng.choice(len(TAU_GRID), size=paths, p=probs / probs.sum())
+        reach = np.empty(paths)
+        for i in np.unique(tau_index):
+            rows = tau_index == i
+            design = _design(model, x, TAU_GRID[i])
+            base = np.array([cs[i], bs[i]])
+            boot_params = base + (means - design @ base)[indices[rows]] @ np.linalg.pinv(design).T
+            reach[rows] = _crossing_days(model, boot_params, TAU_GRID[i], target_weight, last_x) - last_x
+    reach = np.where(reach <= horizon_days, reach, np.inf)
+    reached = np.isfinite(reach)
+
+    last_day = np.datetime64(int(days[-1]), 'D')
+    result = {
+        'model': model,
+        'params': ({'c': sign * c, 'b': sign * b, 'tau': tau} if model == 'exp'
+                   else {'a': sign * a, 'slope': sign * s}),
+        'current_trend': sign * current_trend,
+        'residual_std': float(residuals.std(ddof=1)) if n > 1 else math.nan,
+        'paths': paths,
+        'horizon_days': horizon_days,
+        'reached_fraction': float(reached.mean()),
+        'percentiles': {},
+    }
+    # 届かなかったパスは inf として扱い、届いた割合が足りないパーセンタイルは None
+    ordered = np.sort(reach)
+    for q in percentiles:
+        value = ordered[min(paths - 1, max(0, int(math.ceil(q / 100 * paths)) - 1))]
+        if np.isfinite(value):
+            day = int(math.ceil(value))
+            result['percentiles'][q] = {'days': day, 'date': (last_day + day).item()}
+        else:
+            result['percentiles'][q] = None
+    return result
@@ -0,0 +1,170 @@
+"""記録を列ごとの NumPy 配列で保持するコンテナ"""
+import numpy as np
+
+# float32 で保持する数値列
+FLOAT_FIELDS = ('weight', 'body_fat', 'weight_diff_from_ideal', 'bf_diff_from_ideal',
+                # 外れ値を除いた平滑トレンドと外れ値の判定（robust_filter.py）
+                'weight_trend', 'weight_trend_sd', 'weight_outlier',
+                'bf_trend', 'bf_trend_sd', 'bf_outlier')
+
+
+class RecordColumns:
+    """日付（datetime64）と各数値列（float32）を列ごとに保持する記録のリスト
+
+    リストと同じように len() / インデックス / 反復で1件ずつ dict として取り出せる。
+    配列は容量を倍々で確保するので、append は償却 O(1)。
+    """
+
+    def __init__(self, capacity=64, fields=FLOAT_FIELDS):
+        self.fields = tuple(fields)
+        self._size = 0
+        self._dates = np.empty(capacity, dtype='datetime64[s]')
+        self._columns = {name: np.zeros(capacity, dtype=np.float32) for name in self.fields}
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def _reserve(self, extra):
+        """extra 件を追加できるよう配列を拡張"""
+        needed = self._size + extra
+        capacity = len(self._dates)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = max(capacity * 2, 64)
+        dates = np.empty(capacity, dtype='datetime64[s]')
+        dates[:self._size] = self._dates[:self._size]
+        self._dates = dates
+        for name, column in self._columns.items():
+            grown = np.zeros(capacity, dtype=np.float32)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    @property
+    def dates(self):
+        """日付の配列（datetime64[s]）"""
+        return self._dates[:self._size]
+
+    def column(self, name):
+        """数値列の配列（float32、コピーではなくビュー）"""
+        return self._columns[name][:self._size]
+
+    def append(self, record):
+        self._reserve(1)
+        i = self._size
+        self._dates[i] = np.datetime64(record['date'], 's')
+        for name in self.fields:
+            self._columns[name][i] = record.get(name, 0)
+        self._size += 1
+
+    def extend_arrays(self, dates, columns):
+        """配列のまとまりを末尾に追加（columns に無い列は 0）"""
+        n = len(dates)
+        self._reserve(n)
+        start, end = self._size, self._size + n
+        self._dates[start:end] = dates
+        for name in self.fields:
+            if name in columns:
+                self._columns[name][start:end] = columns[name]
+            else:
+                self._columns[name][start:end] = 0
+        self._size = end
+
+    def extend(self, other):
+        """別の RecordColumns の記録を末尾に追加"""
+        self.extend_arrays(other.dates, {name: other.column(name) for name in other.fields})
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('record index out of range')
+        record = {'date': self._dates[index].item()}
+        for name in self.fields:
+            # float32 の最短表記を経由して 67.19999694... ではなく 67.2 を返す
+            record[name] = float(str(self._columns[name][index]))
+        return record
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def values(self, name):
+        """数値列を float64 で返す（__getitem__ と同じく float32 の最短表記の値）"""
+        return shortest_float64(self.column(name))
+
+    def take(self, indices):
+        """indices の順に並べ替えた新しい RecordColumns を返す"""
+        result = RecordColumns(capacity=max(len(indices), 64), fields=self.fields)
+        result.extend_arrays(self.dates[indices],
+                             {name: self.column(name)[indices] for name in self.fields})
+        return result
+
+    @classmethod
+    def from_records(cls, records):
+        columns = cls(capacity=max(len(records), 64))
+        for record in records:
+            columns.append(record)
+        return columns
+
+
+def shortest_float64(values):
+    """float32 の配列を、各要素の最短表記（str）を読んだ float64 の値にする
+
+    float(str(v)) と同じ値を一括で求める。小数点以下 k 桁（0〜8）に丸めて
+    float32 に戻すと元の値になる最小の k を要素ごとに探す（float32 × 10**k は
+    float64 で誤差なく計算でき、整数 / 10**k は小数表記を読んだ値と一致する）。
+    """
+    values = np.asarray(values, dtype=np.float32)
+    wide = values.astype(np.float64)
+    result = wide.copy()
+    todo = np.flatnonzero(np.isfinite(wide))
+    for k in range(9):
+        if not len(todo):
+            break
+        scale = 10.0 ** k
+        candidate = np.rint(wide[todo] * scale) / scale
+        ok = candidate.astype(np.float32) == values[todo]
+        result[todo[ok]] = candidate[ok]
+        todo = todo[~ok]
+    # 絶対値が非常に小さい値など、残りは1件ずつ変換する
+    for i in todo.tolist():
+        result[i] = float(str(values[i]))
+    return result
+
+
+def parse_dates(date_strings):
+    """'%Y-%m-%d %H:%M:%S' 形式の文字列リストをまとめて datetime64[s] に変換
+
+    変換できない要素は NaT になる。
+    """
+    iso = [s.replace(' ', 'T', 1) for s in date_strings]
+    try:
+        return np.array(iso, dtype='datetime64[s]')
+    except ValueError:
+        result = np.empty(len(iso), dtype='datetime64[s]')
+        for i, s in enumerate(iso):
+            try:
+                result[i] = np.datetime64(s, 's')
+            except ValueError:
+                result[i] = np.datetime64('NaT')
+        return result
+
+
+def sort_and_dedup(columns):
+    """日付順に並べ、同じ日時の記録は後に追加された方を残す
+
+    (整列済みの RecordColumns, 取り除いた件数) を返す。
+    """
+    dates = columns.dates
+    if len(dates) < 2:
+        return columns, 0
+    if np.all(dates[1:] > dates[:-1]):
+        return columns, 0
+    order = np.argsort(dates, kind='stable')
+    sorted_dates = dates[order]
+    keep = np.append(sorted_dates[1:] != sorted_dates[:-1], True)
+    return columns.take(order[keep]), int(len(dates) - keep.sum())
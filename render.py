@@ -0,0 +1,370 @@
+"""進捗グラフの描画（ディスクキャッシュ付き、プロセスプールで並列描画）
+
+グラフは (記録データのハッシュ, 理想曲線のパラメータ, サイズ・形式) をキーに
+キャッシュし、記録が変わっていなければ描き直さない。
+"""
+import hashlib
+import os
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from instrumentation import metrics
+
+# 描画内容を変えたら上げる（古いキャッシュを使わないようにする）
+RENDER_VERSION = 3
+DEFAULT_SIZE = (15, 12)
+DEFAULT_DPI = 100
+# 1つのグラフに描く点の上限（これより多い記録は間引く）
+MAX_POINTS = 1000
+FONT_PATH = '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf'
+# FONT_PATH が無い環境で順に探す日本語フォント
+FALLBACK_FONT_FAMILIES = ('IPAGothic', 'IPAexGothic', 'Noto Sans CJK JP', 'Noto Sans JP', 'TakaoGothic',
+                          'VL Gothic', 'Hiragino Sans', 'Hiragino Kaku Gothic ProN', 'Yu Gothic', 'MS Gothic')
+
+# プロセスごとに使い回す Figure（サイズごと）
+_figures = {}
+
+
+@lru_cache(maxsize=None)
+def _setup_matplotlib():
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['font.family'] = 'sans-serif'
+    matplotlib.rcParams['font.sans-serif'] = list(FALLBACK_FONT_FAMILIES) + ['DejaVu Sans']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+@lru_cache(maxsize=None)
+def get_font_prop():
+    """日本語フォントの FontProperties（プロセス内で1回だけ探す）
+
+    環境変数 FITNESS_FONT、FONT_PATH、インストール済みの日本語フォントの順に探し、
+    見つからなければ matplotlib の既定フォントを使う（日本語は表示できない）。
+    """
+    _setup_matplotlib()
+    from matplotlib import font_manager
+    for path in (os.environ.get('FITNESS_FONT'), FONT_PATH):
+        if path and os.path.exists(path):
+            return font_manager.FontProperties(fname=path)
+    for family in FALLBACK_FONT_FAMILIES:
+        try:
+            path = font_manager.findfont(font_manager.FontProperties(family=family), fallback_to_default=False)
+        except ValueError:
+            continue
+        return font_manager.FontProperties(fname=path)
+    print("日本語フォントが見つからないため、既定のフォントで描画します。")
+    # 文字ごとに出る「グリフが無い」警告は上のメッセージで足りるので抑える
+    warnings.filterwarnings('ignore', message='Glyph .* missing from font')
+    return font_manager.FontProperties()
+
+
+def _get_figure(size):
+    _setup_matplotlib()
+    fig = _figures.get(size)
+    if fig is None:
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=size)
+        _figures[size] = fig
+    else:
+        fig.clf()
+    return fig
+
+
+def moving_average(values, window):
+    """先頭 window-1 件が NaN の移動平均（pandas の rolling().mean() 相当）"""
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = np.convolve(values, np.ones(window) / window, mode='valid')
+    return result
+
+
+def _series(dates, values, ma_dates, ma_values, max_points):
+    """1つの指標の (点の日付, 点の値, 5日移動平均, 14日移動平均) を max_points 点以内にまとめる"""
+    from rollup import downsample, lttb
+    x = dates.astype(np.int64).astype(np.float64)
+    index = lttb(x, values, max_points)
+    ma_x = ma_dates.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    lines = []
+    for window in (5, 14):
+        ma = moving_average(ma_values, window)
+        keep = downsample(ma_x, ma, max_points)
+        lines.append((ma_dates[keep].astype('datetime64[s]'), ma[keep]))
+    return {'dates': dates[index], 'values': values[index], 'ma5': lines[0], 'ma14': lines[1]}
+
+
+def _trend(records, field, prefix, max_points):
+    """保存済みのトレンドとばらつき（max_points 点に間引く）と外れ値の点"""
+    from rollup import lttb
+    dates = records.dates
+    trend = records.column(f'{prefix}_trend').astype(np.float64)
+    sd = records.column(f'{prefix}_trend_sd').astype(np.float64)
+    index = lttb(dates.astype(np.int64).astype(np.float64), trend, max_points)
+    outliers = np.flatnonzero(records.column(f'{prefix}_outlier'))[-max_points:]
+    return {'dates': dates[index], 'trend': trend[index], 'sd': sd[index],
+            'outlier_dates': dates[outliers], 'outlier_values': records.column(field)[outliers].astype(np.float64)}
+
+
+def data_version(records):
+    """記録の内容のハッシュ（描画やエクスポートの再生成の判定に使う）"""
+    from robust_filter import FILTER_FIELDS
+    digest = hashlib.sha1()
+    digest.update(records.dates.tobytes())
+    digest.update(records.column('weight').tobytes())
+    digest.update(records.column('body_fat').tobytes())
+    for name in FILTER_FIELDS:
+        digest.update(records.column(name).tobytes())
+    return digest.hexdigest()
+
+
+def curve_params(ideal_curve):
+    """理想曲線を決めるパラメータのタプル"""
+    return (str(ideal_curve.start_date), ideal_curve.start_weight, ideal_curve.start_bf,
+            ideal_curve.target_weight_loss, ideal_curve.target_bf_loss,
+            ideal_curve.duration_days, ideal_curve.weight_tau, ideal_curve.bf_tau,
+            ideal_curve.bf_delay)
+
+
+def chart_payload(records, ideal_curve, stats, rollups=None, max_points=MAX_POINTS):
+    """描画に必要な配列と統計をまとめる（ワーカープロセスへ渡せる形）
+
+    記録が max_points 件以内なら全件を描き、移動平均も記録ごとに取る。
+    それより多い場合、移動平均は日ごとの平均（rollups の日次集計）から取り、
+    点と線は LTTB で max_points 点に間引く。
+    """
+    from robust_filter import FILTERED
+    from rolling_stats import METRICS, derived_metrics
+    weight = records.values('weight')
+    body_fat = records.values('body_fat')
+    values = dict(zip(METRICS, (weight, body_fat) + derived_metrics(weight, body_fat)))
+    dates = records.dates.copy()
+    metrics = stats.metrics
+
+    if len(records) <= max_points:
+        series = {name: _series(dates, v, dates, v, max_points) for name, v in values.items()}
+    else:
+        if rollups is None:
+            from rollup import Rollups
+            rollups = Rollups.from_columns(records)
+        daily = rollups['daily']
+        series = {name: _series(dates, v, daily.starts, daily.mean(name), max_points)
+                  for name, v in values.items()}
+    return {
+        'data_version': data_version(records),
+        'curve_params': curve_params(ideal_curve),
+        'max_points': max_points,
+        'series': series,
+        'trend': {field: _trend(records, field, prefix, max_points) for field, prefix, _ in FILTERED},
+        'ideal_dates': ideal_curve.dates,
+        'ideal_weight': np.asarray(ideal_curve.weights),
+        'ideal_bf': np.asarray(ideal_curve.body_fat),
+        # 理想曲線の帯は全期間の標準偏差ではなく、最新のトレンドのばらつきで描く
+        'sigma': {field: float(records.column(f'{prefix}_trend_sd')[-1]) for field, prefix, _ in FILTERED},
+        'ranges': {name: (m.min, m.max) for name, m in metrics.items()},
+    }
+
+
+def cache_key(version, curve, max_points=MAX_POINTS, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png'):
+    """data_version() と curve_params() の結果から、描画済みグラフのキーを作る"""
+    text = repr((RENDER_VERSION, version, curve, max_points, tuple(size), dpi, fmt))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def chart_key(records, ideal_curve, max_points=MAX_POINTS, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png'):
+    """記録と理想曲線からグラフのキーを作る（chart_payload() を作らずに済む）"""
+    return cache_key(data_version(records), curve_params(ideal_curve), max_points, size, dpi, fmt)
+
+
+def _draw_panel(ax, font_prop, series, color, label, ma_colors, title, ylabel):
+    """実績・5日/14日移動平均の線を1つのグラフに描く"""
+    ax.plot(series['dates'], series['values'], 'o-', color=color, label=label, alpha=0.5)
+    ax.plot(*series['ma5'], '-', color=ma_colors[0], label='5日移動平均')
+    ax.plot(*series['ma14'], '-', color=ma_colors[1], label='14日移動平均', linewidth=2)
+    ax.set_title(title, fontproperties=font_prop, fontsize=12)
+    ax.set_xlabel('日付', fontproperties=font_prop, fontsize=10)
+    ax.set_ylabel(ylabel, fontproperties=font_prop, fontsize=10)
+    ax.grid(True)
+
+
+def _draw_trend(ax, trend, color):
+    """外れ値を除いたトレンドと ±1σ（直近のばらつき）の帯、外れ値の点"""
+    ax.fill_between(trend['dates'], trend['trend'] - trend['sd'], trend['trend'] + trend['sd'],
+                    color=color, alpha=0.15)
+    ax.plot(trend['dates'], trend['trend'], '-', color=color, label='トレンド', linewidth=2)
+    if len(trend['outlier_dates']):
+        ax.plot(trend['outlier_dates'], trend['outlier_values'], 'x', color='black', label='外れ値', markersize=8)
+
+
+def _draw_ideal_band(ax, dates, ideal, sigma):
+    """理想曲線と ±1σ / ±2σ の帯"""
+    ax.fill_between(dates, ideal - 2*sigma, ideal + 2*sigma, color='gray', alpha=0.1, label='±2σ')
+    ax.fill_between(dates, ideal - sigma, ideal + sigma, color='gray', alpha=0.2, label='±1σ')
+    ax.plot(dates, ideal, '--', color='gray', label='理想曲線')
+
+
+def draw_progress(fig, payload):
+    """体重・体脂肪率・除脂肪体重・脂肪量の4つのグラフを描く"""
+    font_prop = get_font_prop()
+    series = payload['series']
+    sigma = payload['sigma']
+
+    # 体重のプロット
+    ax = fig.add_subplot(2, 2, 1)
+    _draw_ideal_band(ax, payload['ideal_dates'], payload['ideal_weight'], sigma['weight'])
+    _draw_panel(ax, font_prop, series['weight'], 'blue', '実績', ('red', 'darkred'), '体重推移', '体重 (kg)')
+    _draw_trend(ax, payload['trend']['weight'], 'navy')
+    ax.legend(prop=font_prop)
+
+    # 体脂肪率のプロット
+    ax = fig.add_subplot(2, 2, 2)
+    _draw_ideal_band(ax, payload['ideal_dates'], payload['ideal_bf'], sigma['body_fat'])
+    _draw_panel(ax, font_prop, series['body_fat'], 'orange', '実績', ('red', 'darkred'), '体脂肪率推移', '体脂肪率 (%)')
+    _draw_trend(ax, payload['trend']['body_fat'], 'saddlebrown')
+    ax.legend(prop=font_prop)
+
+    # 除脂肪体重と脂肪量のグラフは、変動幅の大きい方に合わせて同じ幅のY軸にする
+    lean_min, lean_max = payload['ranges']['lean_body_mass']
+    fat_min, fat_max = payload['ranges']['fat_mass']
+    max_range = max(lean_max - lean_min, fat_max - fat_min)
+    padding = max_range * 0.1
+    lean_center = (lean_max + lean_min) / 2
+    fat_center = (fat_max + fat_min) / 2
+
+    # 除脂肪体重のプロット
+    ax = fig.add_subplot(2, 2, 3)
+    _draw_panel(ax, font_prop, series['lean_body_mass'], 'green', '除脂肪体重', ('forestgreen', 'darkgreen'),
+                '除脂肪体重推移', '除脂肪体重 (kg)')
+    ax.legend(prop=font_prop)
+    ax.set_ylim(lean_center - (max_range/2 + padding), lean_center + (max_range/2 + padding))
+
+    # 脂肪量のプロット
+    ax = fig.add_subplot(2, 2, 4)
+    _draw_panel(ax, font_prop, series['fat_mass'], 'purple', '脂肪量', ('darkmagenta', 'indigo'),
+                '脂肪量推移', '脂肪量 (kg)')
+    ax.legend(prop=font_prop)
+    ax.set_ylim(fat_center - (max_range/2 + padding), fat_center + (max_range/2 + padding))
+
+    fig.tight_layout()
+
+
+def render_chart(payload, path, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png'):
+    """グラフを描いて path に保存（一時ファイルに書いてから置き換える）"""
+    fig = _get_figure(tuple(size))
+    draw_progress(fig, payload)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fig.savefig(tmp_path, dpi=dpi, bbox_inches='tight', format=fmt)
+    fig.clf()
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChartCache:
+    """描画済みグラフのディスクキャッシュ（更新日時による LRU で削除）"""
+
+    def __init__(self, cache_dir='chart_cache', max_entries=64):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, key, fmt):
+        return os.path.join(self.cache_dir, f'{key}.{fmt}')
+
+    def get(self, key, fmt):
+        path = self.path_for(key, fmt)
+        try:
+            # 使ったことを更新日時に記録する
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def evict(self):
+        """max_entries を超えた分を古い順に削除"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class ChartRenderer:
+    """キャッシュを確認し、無ければプロセスプールでグラフを描く
+
+    submit() は保存先パスを結果に持つ Future を返す。キーは記録のハッシュと
+    理想曲線のパラメータから作るので、キャッシュにあれば chart_payload() を作らずに
+    完了済みの Future を返し、同じキーの描画中ならその Future を共有する。
+    """
+
+    def __init__(self, cache_dir='chart_cache', max_entries=64, workers=None):
+        self.cache = ChartCache(cache_dir, max_entries)
+        self.workers = workers
+        self._pool = None
+        self._pending = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def cached(self, key, fmt='png'):
+        """キャッシュ済みか描画中なら、そのパスを結果に持つ Future（無ければ None）"""
+        path = self.cache.get(key, fmt)
+        if path is not None:
+            metrics.count('chart_cache_hits')
+            future = Future()
+            future.set_result(path)
+            return future
+        if key in self._pending:
+            metrics.count('chart_cache_pending_hits')
+            return self._pending[key]
+        return None
+
+    def submit_payload(self, key, payload, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png'):
+        """作成済みの payload をキー key で描く（同じキーの描画中ならその Future を返す）"""
+        if key in self._pending:
+            metrics.count('chart_cache_pending_hits')
+            return self._pending[key]
+        metrics.count('chart_cache_misses')
+
+        future = self._get_pool().submit(render_chart, payload, self.cache.path_for(key, fmt), size, dpi, fmt)
+        self._pending[key] = future
+
+        def finished(f):
+            self._pending.pop(key, None)
+            if f.exception() is None:
+                self.cache.evict()
+
+        future.add_done_callback(finished)
+        return future
+
+    def submit(self, records, ideal_curve, stats, rollups=None, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png',
+               max_points=MAX_POINTS):
+        """キーを先に作ってキャッシュを確認し、無いときだけ chart_payload() を作って描く"""
+        key = chart_key(records, ideal_curve, max_points, size, dpi, fmt)
+        future = self.cached(key, fmt)
+        if future is None:
+            payload = chart_payload(records, ideal_curve, stats, rollups, max_points)
+            future = self.submit_payload(key, payload, size, dpi, fmt)
+        return future
+
+    def render(self, records, ideal_curve, stats, rollups=None, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, fmt='png',
+               max_points=MAX_POINTS):
+        """同期的に描画してパスを返す（キャッシュは共有）"""
+        return self.submit(records, ideal_curve, stats, rollups, size, dpi, fmt, max_points).result()
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
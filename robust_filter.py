@@ -0,0 +1,162 @@
+"""外れ値の判定（Hampel フィルタ）と外れ値を除いた平滑トレンド
+
+体重と体脂肪率のそれぞれについて、記録1件ごとに O(1) で
+    1. 直前 window 件の中央値と MAD（中央絶対偏差）から外れ値かどうかを判定し、
+    2. 外れ値なら中央値に置き換えた値で指数平滑のトレンドとそのばらつきを更新する。
+平滑の重みは前回の記録からの経過時間で決め（時定数 tau_days 日）、
+1日に何回測っても数日空いても同じ時間スケールで均す。
+
+結果は記録ごとに <prefix>_trend / <prefix>_trend_sd / <prefix>_outlier の列として保存し、
+統計やグラフは保存済みの値を使う。読み込み時は末尾の記録から状態を復元するだけで済む。
+"""
+import math
+from collections import deque
+
+import numpy as np
+
+from records import shortest_float64
+
+# (記録の列, 結果の列の接頭辞, ばらつきの下限)
+FILTERED = (('weight', 'weight', 0.2), ('body_fat', 'bf', 0.5))
+FILTER_FIELDS = tuple(f'{prefix}_{suffix}' for _, prefix, _ in FILTERED for suffix in ('trend', 'trend_sd', 'outlier'))
+
+# MAD を正規分布の標準偏差に換算する係数
+MAD_SCALE = 1.4826
+
+
+class TrendFilter:
+    """1つの指標の Hampel 判定と指数平滑トレンド"""
+
+    def __init__(self, window=7, threshold=3.0, tau_days=7.0, min_scale=0.2, min_periods=3, max_alpha=0.5):
+        self.window = window
+        self.threshold = threshold
+        self.tau_seconds = tau_days * 86400
+        self.min_scale = min_scale
+        self.min_periods = min_periods
+        # 間隔が空いても1回の記録でトレンドが動くのはこの割合まで
+        self.max_alpha = max_alpha
+        self.recent = deque(maxlen=window)
+        self.trend = math.nan
+        self.var = math.nan
+        self.last_time = None
+        self.outliers = 0
+
+    def check(self, value):
+        """直前 window 件と比べて (中央値, ばらつき, 外れ値か) を返す（状態は変えない）"""
+        if len(self.recent) < self.min_periods:
+            return value, self.min_scale, False
+        ordered = sorted(self.recent)
+        median = _median(ordered)
+        mad = _median(sorted(abs(v - median) for v in ordered))
+        scale = max(MAD_SCALE * mad, self.min_scale)
+        return median, scale, abs(value - median) > self.threshold * scale
+
+    def push(self, time, value):
+        """time（秒）の値を加え、(トレンド, トレンドのばらつき, 外れ値か) を返す"""
+        median, _, outlier = self.check(value)
+        self.recent.append(value)
+        used = median if outlier else value
+        if math.isnan(self.trend):
+            self.trend = used
+            self.var = self.min_scale ** 2
+        else:
+            dt = max(time - self.last_time, 0)
+            alpha = min(1 - math.exp(-dt / self.tau_seconds), self.max_alpha)
+            delta = used - self.trend
+            self.trend += alpha * delta
+            self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+        self.last_time = time
+        if outlier:
+            self.outliers += 1
+        return self.trend, math.sqrt(self.var), outlier
+
+    @property
+    def sd(self):
+        return math.sqrt(self.var)
+
+    def restore(self, recent, trend, sd, last_time, outliers=0):
+        """保存済みの直前の記録から状態を戻す"""
+        self.recent.clear()
+        self.recent.extend(recent)
+        self.trend = trend
+        self.var = sd * sd
+        self.last_time = last_time
+        self.outliers = outliers
+
+
+def _median(ordered):
+    n = len(ordered)
+    mid = n // 2
+    return ordered[mid] if n % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+
+class RobustFilter:
+    """体重と体脂肪率の TrendFilter をまとめ、記録の列に結果を書き込む"""
+
+    def __init__(self, **kwargs):
+        self.filters = {prefix: TrendFilter(min_scale=min_scale, **kwargs) for _, prefix, min_scale in FILTERED}
+
+    def update(self, date, weight, body_fat):
+        """1件分を更新し、記録に加える列の dict を返す"""
+        time = _seconds(np.datetime64(date, 's'))
+        result = {}
+        for value, (_, prefix, _) in zip((weight, body_fat), FILTERED):
+            trend, sd, outlier = self.filters[prefix].push(time, value)
+            result[f'{prefix}_trend'] = trend
+            result[f'{prefix}_trend_sd'] = sd
+            result[f'{prefix}_outlier'] = 1.0 if outlier else 0.0
+        return result
+
+    def snapshot(self):
+        """{'weight': {...}, 'body_fat': {...}} で最新のトレンド・ばらつき・外れ値の件数を返す"""
+        return {field: {'trend': self.filters[prefix].trend, 'sd': self.filters[prefix].sd,
+                        'outliers': self.filters[prefix].outliers}
+                for field, prefix, _ in FILTERED}
+
+    def _restore(self, records, end):
+        """records[:end] の保存済みの値から状態を戻す"""
+        if end == 0:
+            return
+        time = _seconds(records.dates[end - 1])
+        for field, prefix, _ in FILTERED:
+            f = self.filters[prefix]
+            recent = shortest_float64(records.column(field)[max(0, end - f.window):end]).tolist()
+            outliers = int(np.count_nonzero(records.column(f'{prefix}_outlier')[:end]))
+            f.restore(recent, float(records.column(f'{prefix}_trend')[end - 1]),
+                      float(records.column(f'{prefix}_trend_sd')[end - 1]), time, outliers)
+
+    @classmethod
+    def from_columns(cls, records, start=None, **kwargs):
+        """RecordColumns から状態を作り、(フィルタ, 計算し直した先頭のインデックス) を返す
+
+        start 以降（省略時はトレンドが未計算（0）の最初の記録以降）の結果を計算し直して
+        records の列に書き込む。全記録が計算済みなら末尾から状態を戻すだけで済む。
+        """
+        robust = cls(**kwargs)
+        n = len(records)
+        if start is None:
+            missing = np.flatnonzero(records.column('weight_trend') == 0)
+            start = int(missing[0]) if len(missing) else n
+        robust._restore(records, start)
+        if start >= n:
+            return robust, n
+
+        times = _seconds(records.dates[start:]).tolist()
+        for field, prefix, _ in FILTERED:
+            f = robust.filters[prefix]
+            values = shortest_float64(records.column(field)[start:]).tolist()
+            trend = np.empty(len(values))
+            sd = np.empty(len(values))
+            outlier = np.empty(len(values))
+            for i, (time, value) in enumerate(zip(times, values)):
+                trend[i], sd[i], outlier[i] = f.push(time, value)
+            records.column(f'{prefix}_trend')[start:] = trend
+            records.column(f'{prefix}_trend_sd')[start:] = sd
+            records.column(f'{prefix}_outlier')[start:] = outlier
+        return robust, start
+
+
+def _seconds(dates):
+    """datetime64 を 1970-01-01 からの秒数に（スカラーなら int）"""
+    seconds = np.asarray(dates, dtype='datetime64[s]').astype(np.int64)
+    return int(seconds) if seconds.ndim == 0 else seconds
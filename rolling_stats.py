@@ -0,0 +1,231 @@
+"""記録の追加ごとに O(1) で更新される移動平均・統計エンジン"""
+import math
+from collections import deque
+
+import numpy as np
+
+# 統計を取る指標（除脂肪体重と脂肪量は体重と体脂肪率から計算する）
+METRICS = ('weight', 'body_fat', 'lean_body_mass', 'fat_mass')
+
+
+def derived_metrics(weight, body_fat):
+    """除脂肪体重と脂肪量を計算（pandas 版と同じ演算順序）"""
+    lean_body_mass = weight * (100 - body_fat) / 100
+    fat_mass = weight * body_fat / 100
+    return lean_body_mass, fat_mass
+
+
+class RollingWindow:
+    """固定長のリングバッファによる移動平均
+
+    和は追加・削除ごとに補正付き（Kahan）で更新し、平均は O(1) で返す。更新の手順は
+    pandas の rolling().mean()（add_mean / remove_mean）と同じなので、先頭の記録から
+    push していけば pandas と同じ値になる。
+    """
+    __slots__ = ('size', '_buffer', '_pos', '_count', '_sum', '_add_comp', '_remove_comp',
+                 '_neg', '_same', '_prev')
+
+    def __init__(self, size):
+        self.size = size
+        self._buffer = [0.0] * size
+        self._pos = 0
+        self._count = 0
+        self._sum = 0.0
+        self._add_comp = 0.0
+        self._remove_comp = 0.0
+        # 負の値の数と、同じ値が続いた回数（pandas と同じ丸めの扱いのため）
+        self._neg = 0
+        self._same = 0
+        self._prev = math.nan
+
+    def push(self, value):
+        if self._count == self.size:
+            self._remove(self._buffer[self._pos])
+        else:
+            self._count += 1
+        self._buffer[self._pos] = value
+        self._pos = (self._pos + 1) % self.size
+        y = value - self._add_comp
+        t = self._sum + y
+        self._add_comp = t - self._sum - y
+        self._sum = t
+        if math.copysign(1.0, value) < 0:
+            self._neg += 1
+        self._same = self._same + 1 if value == self._prev else 1
+        self._prev = value
+
+    def _remove(self, value):
+        y = -value - self._remove_comp
+        t = self._sum + y
+        self._remove_comp = t - self._sum - y
+        self._sum = t
+        if math.copysign(1.0, value) < 0:
+            self._neg -= 1
+
+    @property
+    def full(self):
+        return self._count == self.size
+
+    def mean(self):
+        """窓が埋まっていなければ NaN（pandas の rolling と同じ）"""
+        if not self.full:
+            return math.nan
+        if self._same >= self.size:
+            return self._prev
+        result = self._sum / self.size
+        if (self._neg == 0 and result < 0) or (self._neg == self.size and result > 0):
+            return 0.0
+        return result
+
+
+class Welford:
+    """Welford 法による平均・分散の逐次計算"""
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def push(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self, ddof=1):
+        if self.count <= ddof:
+            return math.nan
+        return self.m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return math.sqrt(self.variance(ddof))
+
+
+class MetricStats:
+    """1つの指標の移動平均・シフト・全体統計"""
+
+    def __init__(self, windows=(5, 14), shift=5):
+        self.windows = {w: RollingWindow(w) for w in windows}
+        self.shift = shift
+        # 短期移動平均（最小の窓）の直近 shift+1 件
+        self._short = min(windows)
+        self._short_history = deque(maxlen=shift + 1)
+        self.welford = Welford()
+        self.first = math.nan
+        self.last = math.nan
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _push_windows(self, value):
+        for window in self.windows.values():
+            window.push(value)
+        self._short_history.append(self.windows[self._short].mean())
+
+    def push(self, value):
+        if self.welford.count == 0:
+            self.first = value
+        self.last = value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.welford.push(value)
+        self._push_windows(value)
+
+    def init_from_array(self, values):
+        """既存の全記録から状態を作る（全体統計は一括計算し、窓には末尾だけ流す）"""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        self.welford = Welford(len(values), mean, float(((values - mean) ** 2).sum()))
+        self.first = float(values[0])
+        self.last = float(values[-1])
+        self.min = float(values.min())
+        self.max = float(values.max())
+        tail = max(self.windows) + self.shift
+        for value in values[-tail:].tolist():
+            self._push_windows(value)
+
+    def moving_average(self, window):
+        return self.windows[window].mean()
+
+    def shifted_average(self):
+        """shift 件前の短期移動平均（pandas の rolling().mean().shift()）"""
+        if len(self._short_history) <= self.shift:
+            return math.nan
+        return self._short_history[0]
+
+    @property
+    def std(self):
+        return self.welford.std()
+
+    def snapshot(self):
+        result = {
+            'first': self.first,
+            'current': self.last,
+            'shifted_ma': self.shifted_average(),
+            'std': self.std,
+            'min': self.min,
+            'max': self.max,
+        }
+        for w in self.windows:
+            result[f'ma{w}'] = self.moving_average(w)
+        return result
+
+
+class StatsEngine:
+    """トラッカーに付随する統計エンジン
+
+    update() は記録1件ごとに全指標の状態を O(1) で更新する。
+    """
+
+    def __init__(self, windows=(5, 14), shift=5):
+        self.windows = windows
+        self.shift = shift
+        self.metrics = {name: MetricStats(windows, shift) for name in METRICS}
+        self.count = 0
+        self.first_date = None
+        self.last_date = None
+
+    def update(self, date, weight, body_fat):
+        lean_body_mass, fat_mass = derived_metrics(weight, body_fat)
+        values = (weight, body_fat, lean_body_mass, fat_mass)
+        for name, value in zip(METRICS, values):
+            self.metrics[name].push(value)
+        if self.count == 0:
+            self.first_date = date
+        self.last_date = date
+        self.count += 1
+
+    @classmethod
+    def from_columns(cls, records, windows=(5, 14), shift=5):
+        """RecordColumns から一括で初期化"""
+        engine = cls(windows, shift)
+        if not records:
+            return engine
+        # 1件ずつ追加したとき（add_record）と同じく、記録として返す値（float32 の最短表記）で計算する
+        weight = records.values('weight')
+        body_fat = records.values('body_fat')
+        lean_body_mass, fat_mass = derived_metrics(weight, body_fat)
+        for name, values in zip(METRICS, (weight, body_fat, lean_body_mass, fat_mass)):
+            engine.metrics[name].init_from_array(values)
+        engine.count = len(records)
+        engine.first_date = records.dates[0].item()
+        engine.last_date = records.dates[-1].item()
+        return engine
+
+    def elapsed_days(self):
+        """最初の記録から最新の記録までの経過日数"""
+        if self.count == 0:
+            return 0
+        return (self.last_date - self.first_date).days
+
+    def summary(self):
+        """全指標の現在の統計を dict で返す"""
+        return {
+            'count': self.count,
+            'first_date': self.first_date,
+            'last_date': self.last_date,
+            'elapsed_days': self.elapsed_days(),
+            'metrics': {name: m.snapshot() for name, m in self.metrics.items()},
+        }
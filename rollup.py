@@ -0,0 +1,232 @@
+"""日・週・月ごとの集計（ロールアップ）と、描画用の間引き（LTTB）
+
+集計は区間ごとに件数・平均・偏差平方和（Welford）・最小・最大を持ち、
+記録の追加ごとに該当する区間だけを更新する。記録は通常時刻順に届くので、
+更新は末尾の区間か新しい区間への追加で済む。
+"""
+import numpy as np
+
+from rolling_stats import METRICS, derived_metrics
+
+RESOLUTIONS = ('daily', 'weekly', 'monthly')
+
+
+def bucket_keys(dates, resolution):
+    """日時の配列を区間番号に変換（日: 1970-01-01 からの日数、週: 月曜始まりの週番号、月: 月番号）"""
+    dates = np.asarray(dates, dtype='datetime64[s]')
+    if resolution == 'monthly':
+        return dates.astype('datetime64[M]').astype(np.int64)
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    if resolution == 'weekly':
+        # 1970-01-01 は木曜日なので、3日ずらして月曜始まりにする
+        return (days + 3) // 7
+    return days
+
+
+def bucket_starts(keys, resolution):
+    """区間番号から区間の開始日（datetime64[D]）"""
+    keys = np.asarray(keys, dtype=np.int64)
+    if resolution == 'monthly':
+        return keys.astype('datetime64[M]').astype('datetime64[D]')
+    if resolution == 'weekly':
+        return (keys * 7 - 3).astype('datetime64[D]')
+    return keys.astype('datetime64[D]')
+
+
+class Rollup:
+    """1つの解像度の集計（区間ごとに METRICS の件数・平均・偏差平方和・最小・最大）"""
+
+    def __init__(self, resolution, capacity=64):
+        self.resolution = resolution
+        self._size = 0
+        self._keys = np.zeros(capacity, dtype=np.int64)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._mean = np.zeros((capacity, len(METRICS)))
+        self._m2 = np.zeros((capacity, len(METRICS)))
+        self._min = np.zeros((capacity, len(METRICS)))
+        self._max = np.zeros((capacity, len(METRICS)))
+
+    def __len__(self):
+        return self._size
+
+    def _arrays(self):
+        return ('_keys', '_count', '_mean', '_m2', '_min', '_max')
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._keys)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = max(capacity * 2, 64)
+        for name in self._arrays():
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _insert_bucket(self, index, key, values):
+        """index の位置に新しい区間を入れる（時刻順でない記録のときだけ後ろをずらす）"""
+        self._reserve(1)
+        if index < self._size:
+            for name in self._arrays():
+                array = getattr(self, name)
+                array[index + 1:self._size + 1] = array[index:self._size]
+        self._keys[index] = key
+        self._count[index] = 1
+        self._mean[index] = values
+        self._m2[index] = 0.0
+        self._min[index] = values
+        self._max[index] = values
+        self._size += 1
+
+    def push(self, key, values):
+        """区間 key に1件（METRICS の順の値）を加える"""
+        values = np.asarray(values, dtype=np.float64)
+        if self._size and self._keys[self._size - 1] == key:
+            index = self._size - 1
+        else:
+            index = int(np.searchsorted(self._keys[:self._size], key))
+            if index == self._size or self._keys[index] != key:
+                self._insert_bucket(index, key, values)
+                return
+        # Welford 法で平均と偏差平方和を更新
+        self._count[index] += 1
+        delta = values - self._mean[index]
+        self._mean[index] += delta / self._count[index]
+        self._m2[index] += delta * (values - self._mean[index])
+        np.minimum(self._min[index], values, out=self._min[index])
+        np.maximum(self._max[index], values, out=self._max[index])
+
+    @classmethod
+    def from_arrays(cls, resolution, dates, values):
+        """時刻順の記録（values は (件数, len(METRICS))）から一括で作る"""
+        keys = bucket_keys(dates, resolution)
+        unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        rollup = cls(resolution, capacity=max(len(unique), 64))
+        n = len(unique)
+        if n == 0:
+            return rollup
+        codes = np.repeat(np.arange(n), counts)
+        rollup._keys[:n] = unique
+        rollup._count[:n] = counts
+        for j in range(values.shape[1]):
+            column = values[:, j]
+            mean = np.bincount(codes, weights=column, minlength=n) / counts
+            rollup._mean[:n, j] = mean
+            rollup._m2[:n, j] = np.bincount(codes, weights=(column - mean[codes]) ** 2, minlength=n)
+            rollup._min[:n, j] = np.minimum.reduceat(column, starts)
+            rollup._max[:n, j] = np.maximum.reduceat(column, starts)
+        rollup._size = n
+        return rollup
+
+    @property
+    def starts(self):
+        """各区間の開始日（datetime64[D]）"""
+        return bucket_starts(self._keys[:self._size], self.resolution)
+
+    @property
+    def counts(self):
+        return self._count[:self._size]
+
+    def _column(self, array, metric):
+        return array[:self._size, METRICS.index(metric)]
+
+    def mean(self, metric):
+        return self._column(self._mean, metric)
+
+    def min(self, metric):
+        return self._column(self._min, metric)
+
+    def max(self, metric):
+        return self._column(self._max, metric)
+
+    def std(self, metric):
+        """区間内の標準偏差（不偏、1件だけの区間は NaN）"""
+        counts = self.counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 1, np.sqrt(self._column(self._m2, metric) / (counts - 1)), np.nan)
+
+    def table(self):
+        """{'start': 開始日, 'count': 件数, '<指標>_mean' / _min / _max / _std: 配列} を返す"""
+        result = {'start': self.starts, 'count': self.counts.copy()}
+        for metric in METRICS:
+            result[f'{metric}_mean'] = self.mean(metric).copy()
+            result[f'{metric}_min'] = self.min(metric).copy()
+            result[f'{metric}_max'] = self.max(metric).copy()
+            result[f'{metric}_std'] = self.std(metric)
+        return result
+
+
+class Rollups:
+    """日・週・月の集計をまとめて更新する"""
+
+    def __init__(self):
+        self.levels = {resolution: Rollup(resolution) for resolution in RESOLUTIONS}
+
+    def __getitem__(self, resolution):
+        return self.levels[resolution]
+
+    def update(self, date, weight, body_fat):
+        values = (weight, body_fat) + derived_metrics(weight, body_fat)
+        dates = np.array([np.datetime64(date, 's')])
+        for resolution, rollup in self.levels.items():
+            rollup.push(int(bucket_keys(dates, resolution)[0]), values)
+
+    @classmethod
+    def from_columns(cls, records):
+        rollups = cls()
+        if not records:
+            return rollups
+        weight = records.values('weight')
+        body_fat = records.values('body_fat')
+        values = np.column_stack((weight, body_fat) + derived_metrics(weight, body_fat))
+        for resolution in RESOLUTIONS:
+            rollups.levels[resolution] = Rollup.from_arrays(resolution, records.dates, values)
+        return rollups
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets で threshold 点に間引くときに残すインデックス
+
+    先頭と末尾は必ず残し、間を threshold - 2 個のバケツに分けて、
+    前に選んだ点と次のバケツの平均とで作る三角形が最大になる点を選ぶ。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    # 次のバケツの平均は累積和からまとめて求める
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    # バケツ i の「次のバケツ」は [edges[i+1], edges[i+2])、最後のバケツの次は末尾の点
+    next_starts, next_ends = edges[1:-1], edges[2:]
+    avg_x = np.empty(threshold - 2)
+    avg_y = np.empty(threshold - 2)
+    avg_x[:-1] = (cx[next_ends] - cx[next_starts]) / (next_ends - next_starts)
+    avg_y[:-1] = (cy[next_ends] - cy[next_starts]) / (next_ends - next_starts)
+    avg_x[-1], avg_y[-1] = x[-1], y[-1]
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        ax, ay = x[previous], y[previous]
+        area = np.abs((ax - avg_x[i]) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y[i] - ay))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample(x, y, max_points):
+    """lttb と同じだが、先頭の NaN（移動平均の埋まっていない部分）は除いて間引く"""
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) == 0:
+        return valid
+    first = int(valid[0])
+    return first + lttb(np.asarray(x, dtype=np.float64)[first:], y[first:], max_points)
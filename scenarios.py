@@ -0,0 +1,212 @@
+"""理想曲線のパラメータを変えた計画（シナリオ）の一括比較
+
+計画は IdealCurve と同じ6つのパラメータ
+    target_weight_loss, target_bf_loss, duration_days, weight_tau, bf_tau, bf_delay
+の組で、各軸の候補を渡すと全組み合わせ（格子）を評価する。
+
+体重の当てはまりは (target_weight_loss, weight_tau) の組だけで、体脂肪率の当てはまりは
+(target_bf_loss, bf_tau, bf_delay) の組だけで決まるので、それぞれを日ごとの平均値に対して
+NumPy でまとめて計算し、格子全体へはブロードキャストで広げる。計算した組の結果は
+エンジンに保存しておき、格子を変えて比べ直すときは未計算の組だけを計算する。
+組が非常に多いときはプロセスプールで分けて計算する。
+
+各計画について返す値:
+    weight_rmse / bf_rmse   記録（外れ値を除いた日ごとの平均）と計画の曲線の差の二乗平均平方根
+    fit                     weight_rmse + bf_rmse × 開始体重 / 100（体脂肪率の差を脂肪量 kg に換算して足す）
+    gap                     最新のトレンド体重 - 計画の今日の体重（kg、正なら計画より重い）
+    plan_deficit            計画の曲線の今日の傾きに相当する1日のカロリー不足（kcal/日）
+    required_deficit        今のトレンド体重から計画の最終体重に期限までに届くのに必要な
+                            1日のカロリー不足（kcal/日、期限を過ぎた計画は NaN）
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PARAMS = ('target_weight_loss', 'target_bf_loss', 'duration_days', 'weight_tau', 'bf_tau', 'bf_delay')
+# 指定しなかった軸の既定値（SimpleFitnessTracker / IdealCurve と同じ）
+DEFAULTS = {'target_weight_loss': 10, 'target_bf_loss': 10, 'duration_days': 168,
+            'weight_tau': 120, 'bf_tau': 100, 'bf_delay': 7}
+# 1回にまとめて計算する (組の数 × 日数) の上限（メモリを抑えるため）
+CHUNK_ELEMENTS = 4_000_000
+
+
+def curve_rmse(x, observed, start, loss, tau, delay=0.0):
+    """start - loss * (1 - exp(-(x - delay) / tau)) と observed の差の RMSE を組ごとに返す
+
+    loss, tau, delay は同じ長さの配列（組の数）、x と observed は日ごとの配列。
+    """
+    loss = np.asarray(loss, dtype=np.float64)
+    tau = np.asarray(tau, dtype=np.float64)
+    delay = np.broadcast_to(np.asarray(delay, dtype=np.float64), loss.shape)
+    result = np.empty(len(loss))
+    if len(x) == 0:
+        result[:] = np.nan
+        return result
+    rows = max(1, CHUNK_ELEMENTS // len(x))
+    for i in range(0, len(loss), rows):
+        sl = slice(i, i + rows)
+        predicted = start - loss[sl, None] * (1 - np.exp(-(x[None, :] - delay[sl, None]) / tau[sl, None]))
+        result[sl] = np.sqrt(((predicted - observed[None, :]) ** 2).mean(axis=1))
+    return result
+
+
+def _curve_rmse_task(args):
+    return curve_rmse(*args)
+
+
+class ScenarioEngine:
+    """1人分の記録に対して計画の格子を評価する（組ごとの当てはまりはキャッシュする）"""
+
+    def __init__(self, days, weights, body_fat, start_weight, start_bf, current_weight=None,
+                 cal_per_kg=7700, workers=None, parallel_threshold=50_000_000, cache_size=1_000_000):
+        """days は開始日からの経過日数、weights / body_fat はその日の平均値"""
+        self.x = np.asarray(days, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.body_fat = np.asarray(body_fat, dtype=np.float64)
+        self.start_weight = start_weight
+        self.start_bf = start_bf
+        self.today = float(self.x[-1]) if len(self.x) else 0.0
+        if current_weight is None:
+            current_weight = float(self.weights[-1]) if len(self.weights) else start_weight
+        self.current_weight = current_weight
+        self.cal_per_kg = cal_per_kg
+        self.workers = workers
+        # (組の数 × 日数) がこれを超えたらプロセスプールで分けて計算する
+        self.parallel_threshold = parallel_threshold
+        self.cache_size = cache_size
+        self._weight_fit = {}
+        self._bf_fit = {}
+        self._pool = None
+
+    @classmethod
+    def from_tracker(cls, tracker, **kwargs):
+        """トラッカーの記録（外れ値を除き日ごとに平均）と開始値・トレンド体重から作る"""
+        from projection import daily_means
+        records = tracker.records
+        start = np.datetime64(tracker.ideal_curve.start_date, 'D').astype(np.int64)
+        keep_weight = records.column('weight_outlier') == 0
+        keep_bf = keep_weight & (records.column('bf_outlier') == 0)
+        days, weights = daily_means(records.dates[keep_weight], records.column('weight')[keep_weight])
+        bf_days, body_fat = daily_means(records.dates[keep_bf], records.column('body_fat')[keep_bf])
+        # 体脂肪率だけ外れ値だった日は体重の日に合わせて除く
+        shared = np.isin(days, bf_days)
+        days, weights = days[shared], weights[shared]
+        body_fat = body_fat[np.isin(bf_days, days)]
+        current = tracker.filter.snapshot()['weight']['trend']
+        return cls(days - start, weights, body_fat, tracker.start_weight, tracker.start_bf,
+                   None if math.isnan(current) else current, tracker.cal_per_kg_fat, **kwargs)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _fits(self, cache, observed, start, combos):
+        """combos（(組の数, 2 または 3) の配列）の RMSE をキャッシュから引き、無い組だけ計算する"""
+        keys = [tuple(row) for row in combos.tolist()]
+        result = np.empty(len(keys))
+        missing = []
+        for i, key in enumerate(keys):
+            value = cache.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                result[i] = value
+        if missing:
+            todo = combos[missing]
+            columns = [todo[:, j] for j in range(todo.shape[1])]
+            if len(todo) * len(self.x) > self.parallel_threshold and len(todo) > 1:
+                parts = np.array_split(np.arange(len(todo)), self.workers or os.cpu_count() or 1)
+                tasks = [(self.x, observed, start) + tuple(c[part] for c in columns) for part in parts if len(part)]
+                values = np.concatenate(list(self._get_pool().map(_curve_rmse_task, tasks)))
+            else:
+                values = curve_rmse(self.x, observed, start, *columns)
+            result[missing] = values
+            # 結果は上で組み立て済みなので、あふれるときはキャッシュを空にしてから今回の分を入れる
+            if len(cache) + len(missing) > self.cache_size:
+                cache.clear()
+            if len(missing) <= self.cache_size:
+                for i, value in zip(missing, values.tolist()):
+                    cache[keys[i]] = value
+        return result
+
+    def sweep(self, **grid):
+        """各軸の候補（PARAMS の名前で指定、省略した軸は DEFAULTS）の全組み合わせを評価する
+
+        PARAMS と評価値の名前をキーに、形が (各軸の候補の数, ...) の配列の dict を返す。
+        配列はブロードキャストした読み取り専用のビューなので、格子が大きくてもメモリは
+        軸ごとの計算結果の分しか使わない（1次元にするときは best_plans のように必要な列だけ）。
+        """
+        unknown = set(grid) - set(PARAMS)
+        if unknown:
+            raise ValueError(f"不明なパラメータです: {', '.join(sorted(unknown))}")
+        axes = [np.atleast_1d(np.asarray(grid.get(name, DEFAULTS[name]), dtype=np.float64)) for name in PARAMS]
+        loss_w, loss_bf, duration, tau_w, tau_bf, delay = axes
+        shape = tuple(len(a) for a in axes)
+
+        # 体重: (target_weight_loss, weight_tau) の組ごと → 軸 (0, 3)
+        pairs = np.stack(np.meshgrid(loss_w, tau_w, indexing='ij'), axis=-1).reshape(-1, 2)
+        weight_rmse = self._fits(self._weight_fit, self.weights, self.start_weight, pairs)
+        weight_rmse = weight_rmse.reshape(len(loss_w), 1, 1, len(tau_w), 1, 1)
+        # 体脂肪率: (target_bf_loss, bf_tau, bf_delay) の組ごと → 軸 (1, 4, 5)
+        triples = np.stack(np.meshgrid(loss_bf, tau_bf, delay, indexing='ij'), axis=-1).reshape(-1, 3)
+        bf_rmse = self._fits(self._bf_fit, self.body_fat, self.start_bf, triples)
+        bf_rmse = bf_rmse.reshape(1, len(loss_bf), 1, 1, len(tau_bf), len(delay))
+
+        # カロリー: (target_weight_loss, duration_days, weight_tau) で決まる → 軸 (0, 2, 3)
+        L = loss_w[:, None, None, None, None, None]
+        D = duration[None, None, :, None, None, None]
+        tau = tau_w[None, None, None, :, None, None]
+        plan_today = self.start_weight - L * (1 - np.exp(-self.today / tau))
+        plan_end = self.start_weight - L * (1 - np.exp(-D / tau))
+        remaining = D - self.today
+        with np.errstate(invalid='ignore', divide='ignore'):
+            required = np.where(remaining > 0, (self.current_weight - plan_end) * self.cal_per_kg / remaining, np.nan)
+        plan_deficit = L / tau * np.exp(-self.today / tau) * self.cal_per_kg
+
+        result = {}
+        for i, (name, axis) in enumerate(zip(PARAMS, axes)):
+            index = [None] * len(PARAMS)
+            index[i] = slice(None)
+            result[name] = np.broadcast_to(axis[tuple(index)], shape)
+        values = {
+            'weight_rmse': weight_rmse,
+            'bf_rmse': bf_rmse,
+            'fit': weight_rmse + bf_rmse * self.start_weight / 100,
+            'gap': self.current_weight - plan_today,
+            'plan_deficit': plan_deficit,
+            'required_deficit': required,
+        }
+        for name, value in values.items():
+            result[name] = np.broadcast_to(value, shape)
+        return result
+
+
+def best_plans(result, n=10, by='fit', max_deficit=None):
+    """sweep の結果から上位 n 件を dict のリストで返す
+
+    by='fit' は当てはまりの良い順、'deficit' は必要なカロリー不足の小さい順。
+    max_deficit を指定すると required_deficit がそれ以下の（期限内の）計画だけに絞る。
+    """
+    if by not in ('fit', 'deficit'):
+        raise ValueError(f"by は fit / deficit のいずれかです: {by}")
+    key = (result['fit'] if by == 'fit' else np.abs(result['required_deficit'])).ravel()
+    valid = ~np.isnan(key)
+    if max_deficit is not None:
+        required = result['required_deficit'].ravel()
+        valid &= ~np.isnan(required) & (required <= max_deficit)
+    candidates = np.flatnonzero(valid)
+    if len(candidates) > n:
+        # 上位 n 件だけを部分的に選んでから並べる
+        candidates = candidates[np.argpartition(key[candidates], n)[:n]]
+    order = candidates[np.argsort(key[candidates], kind='stable')]
+    shape = result['fit'].shape
+    return [{name: float(values[index]) for name, values in result.items()}
+            for index in zip(*np.unravel_index(order, shape))]
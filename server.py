@@ -0,0 +1,373 @@
+"""複数ユーザー向けの HTTP/JSON API サーバー（asyncio）
+
+エンドポイント:
+    POST /users/<user_id>/records      {"weight": 67.2, "body_fat": 22.5, "date": "2024-01-01 07:00:00"}
+    GET  /users/<user_id>/stats
+    GET  /users/<user_id>/ideal-curve
+    GET  /users/<user_id>/chart        PNG 画像（?format=svg で SVG）
+    GET  /metrics                      計測結果（Prometheus 形式、--metrics で有効）
+
+使い方:
+    python server.py serve --port 8080 --data-dir users
+    python server.py loadtest --port 8080 --users 50 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+from urllib.parse import parse_qs
+
+from instrumentation import metrics
+from render import ChartRenderer, chart_key, chart_payload
+from storage import DATE_FORMAT, to_jsonable
+
+USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+ROUTE_PATTERN = re.compile(r'^/users/([^/]+)/(records|stats|ideal-curve|chart)$')
+
+CHART_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class TrackerService:
+    """ユーザーごとのトラッカーを管理し、ユーザー単位でロックして操作する
+
+    記録の追加（ファイルへの追記）とグラフ用データの作成はスレッドプールで、
+    グラフ描画は ChartRenderer のプロセスプールで実行し、イベントループを止めないようにする。
+    グラフは全ユーザー共通のキャッシュ（data_dir/.chart_cache）に保存する。
+    読み込んだトラッカーは max_trackers 件まで保持し、超えたら使われていない古いものから閉じる。
+    """
+
+    def __init__(self, data_dir='users', io_workers=8, render_workers=None, chart_cache_entries=256,
+                 max_trackers=256):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.max_trackers = max_trackers
+        # 最近使った順（末尾が最新）
+        self.trackers = OrderedDict()
+        self.locks = {}
+        # 処理中・ロック待ちのリクエスト数（0 のユーザーだけ閉じてよい）
+        self.active = {}
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers)
+        self.renderer = ChartRenderer(os.path.join(data_dir, '.chart_cache'),
+                                      max_entries=chart_cache_entries, workers=render_workers)
+
+    def close(self):
+        for tracker in self.trackers.values():
+            tracker.close()
+        self.trackers.clear()
+        self.io_pool.shutdown(wait=True)
+        self.renderer.shutdown(wait=True)
+
+    def user_dir(self, user_id):
+        if not USER_ID_PATTERN.match(user_id):
+            raise HTTPError(400, 'invalid user id')
+        return os.path.join(self.data_dir, user_id)
+
+    @asynccontextmanager
+    async def _user(self, user_id):
+        """ユーザーのロックを取ってトラッカーを渡す"""
+        self.user_dir(user_id)
+        lock = self.locks.get(user_id)
+        if lock is None:
+            lock = self.locks[user_id] = asyncio.Lock()
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield await self._tracker(user_id)
+        finally:
+            self.active[user_id] -= 1
+            if not self.active[user_id]:
+                del self.active[user_id]
+
+    def _load_tracker(self, user_id):
+        from FatTracking import DATA_FILE, SimpleFitnessTracker
+        path = self.user_dir(user_id)
+        os.makedirs(path, exist_ok=True)
+        return SimpleFitnessTracker(data_file=os.path.join(path, DATA_FILE), legacy_data_file=None)
+
+    async def _tracker(self, user_id):
+        """トラッカーを取得（初回はスレッドプールで読み込む、呼び出し側でロック済み）"""
+        tracker = self.trackers.get(user_id)
+        if tracker is not None:
+            self.trackers.move_to_end(user_id)
+            return tracker
+        loop = asyncio.get_running_loop()
+        tracker = await loop.run_in_executor(self.io_pool, self._load_tracker, user_id)
+        self.trackers[user_id] = tracker
+        await self._evict()
+        return tracker
+
+    async def _evict(self):
+        """max_trackers を超えた分を、使われていない古いトラッカーから閉じる"""
+        excess = len(self.trackers) - self.max_trackers
+        idle = [user_id for user_id in self.trackers if user_id not in self.active][:max(0, excess)]
+        loop = asyncio.get_running_loop()
+        for user_id in idle:
+            tracker = self.trackers.pop(user_id)
+            del self.locks[user_id]
+            metrics.count('tracker_evictions')
+            await loop.run_in_executor(self.io_pool, tracker.close)
+
+    async def add_record(self, user_id, weight, body_fat, date=None):
+        async with self._user(user_id) as tracker:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.io_pool, tracker.add_measurement, weight, body_fat, date)
+            except ValueError as e:
+                raise HTTPError(409, str(e))
+
+    async def stats(self, user_id):
+        async with self._user(user_id) as tracker:
+            return tracker.summary()
+
+    async def ideal_curve(self, user_id):
+        async with self._user(user_id) as tracker:
+            curve = tracker.ideal_curve
+            return {
+                'dates': [str(d).replace('T', ' ') for d in curve.dates],
+                'ideal_weight': curve.weights.tolist(),
+                'ideal_bf': curve.body_fat.tolist(),
+            }
+
+    async def chart(self, user_id, fmt='png'):
+        async with self._user(user_id) as tracker:
+            if not tracker.records:
+                raise HTTPError(404, 'no records')
+            # キーの計算（記録のハッシュ）と描画用データの作成は記録数に比例するのでスレッドプールで行う
+            loop = asyncio.get_running_loop()
+            key = await loop.run_in_executor(self.io_pool, partial(chart_key, tracker.records,
+                                                                   tracker.ideal_curve, fmt=fmt))
+            future = self.renderer.cached(key, fmt)
+            if future is None:
+                payload = await loop.run_in_executor(self.io_pool, chart_payload, tracker.records,
+                                                     tracker.ideal_curve, tracker.stats, tracker.rollups)
+                future = self.renderer.submit_payload(key, payload, fmt=fmt)
+        path = await asyncio.wrap_future(future)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+async def _read_request(reader):
+    """HTTP リクエストを読む（接続が閉じられたら None）"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0) or 0)
+    body = await reader.readexactly(length) if length else b''
+    path, _, query = target.partition('?')
+    return method.upper(), path, parse_qs(query), headers, body
+
+
+def _response(status, body, content_type='application/json', keep_alive=True):
+    head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    return head.encode('latin-1') + body
+
+
+def _json_body(obj):
+    return json.dumps(to_jsonable(obj), ensure_ascii=False).encode('utf-8')
+
+
+async def dispatch(service, method, path, query, body):
+    """(ステータス, 本文, Content-Type) を返す"""
+    if path == '/metrics':
+        if method != 'GET':
+            raise HTTPError(405, 'use GET')
+        return 200, metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+    match = ROUTE_PATTERN.match(path)
+    if not match:
+        raise HTTPError(404, 'not found')
+    user_id, resource = match.groups()
+    service.user_dir(user_id)
+
+    if resource == 'records':
+        if method != 'POST':
+            raise HTTPError(405, 'use POST')
+        try:
+            data = json.loads(body or b'{}')
+            weight = float(data['weight'])
+            body_fat = float(data['body_fat'])
+            date = datetime.strptime(data['date'], DATE_FORMAT) if data.get('date') else None
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPError(400, f'invalid record: {e}')
+        record = await service.add_record(user_id, weight, body_fat, date)
+        return 201, _json_body(record), 'application/json'
+
+    if method != 'GET':
+        raise HTTPError(405, 'use GET')
+    if resource == 'stats':
+        return 200, _json_body(await service.stats(user_id)), 'application/json'
+    if resource == 'ideal-curve':
+        return 200, _json_body(await service.ideal_curve(user_id)), 'application/json'
+    fmt = query.get('format', ['png'])[0]
+    if fmt not in CHART_TYPES:
+        raise HTTPError(400, 'format must be png or svg')
+    return 200, await service.chart(user_id, fmt), CHART_TYPES[fmt]
+
+
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            keep_alive = True
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload, content_type = await dispatch(service, method, path, query, body)
+            except HTTPError as e:
+                status, payload, content_type = e.status, _json_body({'error': e.message}), 'application/json'
+            except asyncio.IncompleteReadError:
+                break
+            except Exception as e:
+                status, payload, content_type = 500, _json_body({'error': str(e)}), 'application/json'
+            writer.write(_response(status, payload, content_type, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8080, data_dir='users'):
+    service = TrackerService(data_dir)
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(service, r, w), host, port)
+    print(f"http://{host}:{port} で待ち受けています（データ: {data_dir}）")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+# ---- 負荷試験用クライアント ----
+
+async def _request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write((f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+                  f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def loadtest(host='127.0.0.1', port=8080, users=20, requests=1000, concurrency=32, stats_ratio=0.3):
+    """記録追加と統計取得を混ぜたリクエストを同時に送り、スループットと遅延を測る"""
+    import random
+    from datetime import timedelta
+
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+    # ユーザーごとに1時間ずつ進めた日時で記録する（同じ秒の記録は重複扱いになるため）
+    base = datetime.now().replace(microsecond=0)
+    sent = {}
+
+    async def worker(worker_id):
+        nonlocal errors
+        rng = random.Random(worker_id)
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in counter:
+                user_id = f'user{rng.randrange(users)}'
+                start = time.perf_counter()
+                if rng.random() < stats_ratio:
+                    status = await _request(reader, writer, 'GET', f'/users/{user_id}/stats')
+                else:
+                    sent[user_id] = sent.get(user_id, 0) + 1
+                    date = base + timedelta(hours=sent[user_id])
+                    status = await _request(reader, writer, 'POST', f'/users/{user_id}/records', {
+                        'date': date.strftime(DATE_FORMAT),
+                        'weight': round(rng.gauss(65, 3), 1),
+                        'body_fat': round(rng.gauss(20, 2), 1),
+                    })
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print("\n=== 負荷試験結果 ===")
+    print(f"リクエスト数: {len(latencies)} (エラー: {errors})")
+    print(f"処理時間: {elapsed:.2f}秒 ({len(latencies) / elapsed:.0f}件/秒)")
+    print(f"遅延 p50: {percentile(0.5):.1f}ms / p99: {percentile(0.99):.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='フィットネストラッカー API サーバー')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve', help='サーバーを起動')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--data-dir', default='users')
+    serve_parser.add_argument('--metrics', action='store_true', help='処理時間・件数を計測して /metrics で公開')
+    load_parser = sub.add_parser('loadtest', help='起動中のサーバーに負荷をかける')
+    load_parser.add_argument('--host', default='127.0.0.1')
+    load_parser.add_argument('--port', type=int, default=8080)
+    load_parser.add_argument('--users', type=int, default=20)
+    load_parser.add_argument('--requests', type=int, default=1000)
+    load_parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if args.metrics:
+            metrics.enabled = True
+        asyncio.run(serve(args.host, args.port, args.data_dir))
+    else:
+        asyncio.run(loadtest(args.host, args.port, args.users, args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""フィットネス記録の永続化バックエンド
+
+記録は追記専用で保存し、1件追加するコストが履歴の長さに依存しないようにする。
+"""
+import json
+import math
+import os
+
+import numpy as np
+from datetime import date, datetime
+
+from instrumentation import metrics
+from records import FLOAT_FIELDS, RecordColumns, parse_dates, sort_and_dedup
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def record_to_json(record):
+    """記録をJSONに書ける形（日付は文字列）に変換"""
+    data = {}
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            value = value.strftime(DATE_FORMAT)
+        elif hasattr(value, 'item'):
+            # numpy のスカラーは Python の数値に戻す
+            value = value.item()
+        data[key] = value
+    return data
+
+
+def to_jsonable(value):
+    """datetime / date は文字列に、NaN / 無限大は null に変換"""
+    if isinstance(value, dict):
+        return {k: to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if hasattr(value, 'item'):
+        return to_jsonable(value.item())
+    return value
+
+
+def record_from_json(data):
+    """JSONから読み込んだ記録の日付をdatetimeに戻す"""
+    data['date'] = datetime.strptime(data['date'], DATE_FORMAT)
+    return data
+
+
+class RecordStore:
+    """記録ストアの基底クラス
+
+    load() で全記録を読み込み、append() / append_many() で追記する。
+    compact() はストア内部の不要領域を整理する。
+    """
+
+    def load(self):
+        raise NotImplementedError
+
+    def load_columns(self):
+        """全記録を RecordColumns として読み込む"""
+        return RecordColumns.from_records(self.load())
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        raise NotImplementedError
+
+    def compact(self, records=None):
+        raise NotImplementedError
+
+    def rewrite_tail(self, records, start, superseded=0):
+        """全記録 records のうち start 以降を書き直す（superseded はそれで古い版が無効になる件数）"""
+        self.append_many(list(records.take(np.arange(start, len(records)))))
+
+    def close(self):
+        pass
+
+
+class JsonLinesStore(RecordStore):
+    """1行1記録の JSON Lines 形式で保存するストア
+
+    追記は1行書いて fsync するだけなので、記録数に関わらず一定コストで済む。
+    書き込み途中でクラッシュした場合、末尾の不完全な行は読み込み時に無視し、
+    次の追記の前に切り詰める。同じ日時の記録は後から書いた方を有効とし、
+    重複や壊れた行が一定数たまったら compact() で書き直す。
+    """
+
+    def __init__(self, path, compact_min_garbage=1000, compact_ratio=0.5, chunk_size=65536):
+        self.path = path
+        self.compact_min_garbage = compact_min_garbage
+        self.compact_ratio = compact_ratio
+        self.chunk_size = chunk_size
+        # 正常に読み込めたファイル先頭からのバイト数
+        self._valid_size = None
+        # 重複・破損により無効になっている行数
+        self._garbage = 0
+
+    def load(self):
+        records = {}
+        garbage = 0
+        valid_size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # 書き込み途中の行（クラッシュ時）
+                        break
+                    valid_size += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        record = record_from_json(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        garbage += 1
+                        continue
+                    if record['date'] in records:
+                        garbage += 1
+                    records[record['date']] = record
+        except FileNotFoundError:
+            pass
+
+        self._valid_size = valid_size
+        self._garbage = garbage
+        result = sorted(records.values(), key=lambda r: r['date'])
+        if self._needs_compaction(len(result)):
+            self.compact(result)
+        return result
+
+    def load_columns(self):
+        """ファイルを先頭から chunk_size 行ずつ読み、列配列に詰めていく
+
+        日付の変換はチャンクごとにまとめて行い、dict のリストは作らない。
+        """
+        columns = RecordColumns()
+        garbage = 0
+        valid_size = 0
+        dates = []
+        values = {name: [] for name in FLOAT_FIELDS}
+
+        def flush():
+            nonlocal garbage
+            parsed = parse_dates(dates)
+            valid = ~np.isnat(parsed)
+            if valid.all():
+                columns.extend_arrays(parsed, values)
+            else:
+                garbage += int((~valid).sum())
+                columns.extend_arrays(parsed[valid],
+                                      {name: np.asarray(v)[valid] for name, v in values.items()})
+            dates.clear()
+            for column in values.values():
+                column.clear()
+
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # 書き込み途中の行（クラッシュ時）
+                        break
+                    valid_size += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        data = json.loads(line)
+                        row = [float(data.get(name, 0)) for name in FLOAT_FIELDS]
+                        date = str(data['date'])
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        garbage += 1
+                        continue
+                    dates.append(date)
+                    for name, value in zip(FLOAT_FIELDS, row):
+                        values[name].append(value)
+                    if len(dates) >= self.chunk_size:
+                        flush()
+        except FileNotFoundError:
+            pass
+        if dates:
+            flush()
+
+        columns, duplicates = sort_and_dedup(columns)
+        self._valid_size = valid_size
+        self._garbage = garbage + duplicates
+        if self._needs_compaction(len(columns)):
+            self.compact(columns)
+        return columns
+
+    def _needs_compaction(self, live_count):
+        return (self._garbage >= self.compact_min_garbage
+                and self._garbage >= live_count * self.compact_ratio)
+
+    def _truncate_partial_tail(self):
+        """末尾の不完全な行を取り除く"""
+        if self._valid_size is None:
+            return
+        try:
+            if os.path.getsize(self.path) > self._valid_size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._valid_size)
+        except FileNotFoundError:
+            self._valid_size = 0
+
+    def append_many(self, records):
+        if not records:
+            return 0
+        payload = ''.join(
+            json.dumps(record_to_json(r), ensure_ascii=False) + '\n' for r in records
+        ).encode('utf-8')
+        self._truncate_partial_tail()
+        with open(self.path, 'ab') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._valid_size is not None:
+            self._valid_size += len(payload)
+        metrics.count('records_written', len(records))
+        metrics.count('bytes_written', len(payload))
+        return len(payload)
+
+    def rewrite_tail(self, records, start, superseded=0):
+        """start 以降を追記し直す（古い版は無効な行として数える）
+
+        全件の書き直しになる場合（start が 0）や、書き直す分がファイルの大部分を占める場合、
+        無効な行がたまった場合は、追記せずに compact() で全体を書き直す。
+        """
+        self._garbage += superseded
+        if (start == 0 or len(records) - start >= len(records) * self.compact_ratio
+                or self._needs_compaction(len(records))):
+            self.compact(records)
+        else:
+            super().rewrite_tail(records, start, superseded)
+
+    def compact(self, records=None):
+        """有効な記録だけで書き直し、アトミックに置き換える"""
+        if records is None:
+            records = self.load()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                line = json.dumps(record_to_json(record), ensure_ascii=False) + '\n'
+                f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._valid_size = os.path.getsize(self.path)
+        self._garbage = 0
+        metrics.count('records_written', len(records))
+        metrics.count('bytes_written', self._valid_size)
+
+
+class SQLiteStore(RecordStore):
+    """SQLite（WALモード）で保存するストア"""
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS records (date TEXT PRIMARY KEY, data TEXT NOT NULL)'
+        )
+        self.conn.commit()
+
+    def load(self):
+        rows = self.conn.execute('SELECT data FROM records ORDER BY date')
+        return [record_from_json(json.loads(data)) for (data,) in rows]
+
+    @staticmethod
+    def _rows(records):
+        rows = []
+        for record in records:
+            data = record_to_json(record)
+            rows.append((data['date'], json.dumps(data, ensure_ascii=False)))
+        return rows
+
+    def _insert(self, rows):
+        self.conn.executemany('INSERT OR REPLACE INTO records (date, data) VALUES (?, ?)', rows)
+        metrics.count('records_written', len(rows))
+        metrics.count('bytes_written', sum(len(data) for _, data in rows))
+
+    def append_many(self, records):
+        rows = self._rows(records)
+        with self.conn:
+            self._insert(rows)
+        return len(rows)
+
+    def compact(self, records=None):
+        if records is not None:
+            rows = self._rows(records)
+            # 削除と書き直しを1つのトランザクションにして、途中で落ちても元の記録が残るようにする
+            with self.conn:
+                self.conn.execute('DELETE FROM records')
+                self._insert(rows)
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('VACUUM')
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_legacy_json(json_path, store):
+    """旧形式の fitness_data.json（全件を1つの配列で保存）をストアへ移行する
+
+    元のファイルはそのまま残す。移行した件数を返す。
+    """
+    with open(json_path, 'r') as f:
+        json_records = json.load(f)
+    records = [record_from_json(dict(r)) for r in json_records]
+    store.append_many(records)
+    return len(records)
+
+
+def open_store(path, legacy_json_path=None):
+    """拡張子に応じたストアを開く（.db / .sqlite は SQLite、それ以外は JSON Lines）
+
+    ストアがまだ存在せず legacy_json_path が存在する場合は、一度だけ移行する。
+    """
+    is_new = not os.path.exists(path)
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        store = SQLiteStore(path)
+    else:
+        store = JsonLinesStore(path)
+
+    if is_new and legacy_json_path and os.path.exists(legacy_json_path):
+        try:
+            count = migrate_legacy_json(legacy_json_path, store)
+            print(f"{legacy_json_path} から {count} 件の記録を移行しました。")
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"{legacy_json_path} が破損しているため移行できませんでした: {str(e)}")
+    return store
@@ -0,0 +1,39 @@
+"""目標達成日の予測（減量・増量の両方向）"""
+import numpy as np
+import pytest
+
+from projection import project_goal
+
+
+def make_history(days, start, slope, seed=0):
+    dates = np.datetime64('2025-01-01') + np.arange(days)
+    rng = np.random.default_rng(seed)
+    weights = start + slope * np.arange(days) + rng.normal(0, 0.2, days)
+    return dates, weights
+
+
+def test_loss_goal_is_reached():
+    dates, weights = make_history(60, 70.0, -0.05)
+    result = project_goal(dates, weights, 65.0, paths=2000, model='linear', seed=0)
+    assert result['params']['slope'] < 0
+    assert result['reached_fraction'] > 0.9
+    assert 20 <= result['percentiles'][50]['days'] <= 50
+
+
+def test_gain_goal_mirrors_loss_goal():
+    # 増量の記録と目標を 140kg を軸に反転したものは、減量の場合と同じ日数になる
+    dates, weights = make_history(60, 70.0, -0.05)
+    loss = project_goal(dates, weights, 65.0, paths=2000, seed=0)
+    gain = project_goal(dates, 140.0 - weights, 75.0, paths=2000, seed=0, gain=True)
+    assert gain['model'] == loss['model']
+    assert gain['current_trend'] == pytest.approx(140.0 - loss['current_trend'])
+    assert gain['reached_fraction'] == loss['reached_fraction'] > 0.9
+    assert gain['percentiles'] == loss['percentiles']
+
+
+def test_gain_goal_already_reached():
+    dates, weights = make_history(30, 60.0, 0.1)
+    result = project_goal(dates, weights, 61.0, paths=100, seed=0, gain=True)
+    assert result['current_trend'] > 61.0
+    assert result['reached_fraction'] == 1.0
+    assert result['percentiles'][50]['days'] == 0
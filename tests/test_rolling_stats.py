@@ -0,0 +1,136 @@
+"""StatsEngine の移動平均・シフト・統計を pandas（以前の show_stats の計算）と比べる
+
+記録を1件ずつ update した場合（add_record と同じ）は、移動平均とそのシフトが pandas の
+rolling と完全に一致する（RollingWindow が pandas と同じ補正付きの和で更新するため）。
+標準偏差は Welford 法で逐次に求めるので、一括で2パス計算する pandas とは最後の桁が違うことがある。
+from_columns は全体統計を一括で計算するので標準偏差は一致するが、移動平均は末尾の窓の分
+しか流さないため、先頭から和を積み上げる pandas とは最後の桁が違うことがある。
+どちらの場合も差は丸め誤差（相対 1e-12 以内）で、float32 を広げたままの値
+（66.48000030517578 など）はこの範囲に入らない。
+"""
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import generate_history
+from FatTracking import SimpleFitnessTracker
+from records import RecordColumns
+from rolling_stats import METRICS, StatsEngine
+
+TOLERANCE = {'rel': 1e-12, 'abs': 1e-12, 'nan_ok': True}
+
+
+def make_history(count, seed):
+    """実際の入力と同じく 0.01kg / 0.1% 刻みの記録"""
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('2025-01-01T07:00:00') + np.arange(count) * np.timedelta64(1, 'D')
+    records = RecordColumns()
+    records.extend_arrays(dates, {'weight': np.round(66.5 + rng.normal(0, 0.6, count), 2),
+                                  'body_fat': np.round(23 + rng.normal(0, 0.8, count), 1)})
+    return records
+
+
+def pandas_stats(records):
+    """保存された値（記録の dict）から以前の show_stats と同じ pandas の計算をする"""
+    df = pd.DataFrame([{'weight': r['weight'], 'body_fat': r['body_fat']} for r in records])
+    df['lean_body_mass'] = df['weight'] * (100 - df['body_fat']) / 100
+    df['fat_mass'] = df['weight'] * df['body_fat'] / 100
+    result = {}
+    for name in METRICS:
+        ma5 = df[name].rolling(window=5).mean()
+        result[name] = {
+            'first': df[name].iloc[0],
+            'current': df[name].iloc[-1],
+            'min': df[name].min(),
+            'max': df[name].max(),
+            'ma5': ma5.iloc[-1],
+            'ma14': df[name].rolling(window=14).mean().iloc[-1],
+            'shifted_ma': ma5.shift(5).iloc[-1],
+            'std': df[name].std(),
+        }
+    return result
+
+
+def assert_matches(engine, expected, exact):
+    snapshot = engine.summary()['metrics']
+    for name in METRICS:
+        for key, value in expected[name].items():
+            actual = snapshot[name][key]
+            if key in exact:
+                assert actual == value or (np.isnan(actual) and np.isnan(value)), (name, key, actual, value)
+            else:
+                assert actual == pytest.approx(value, **TOLERANCE), (name, key)
+
+
+@pytest.mark.parametrize('count', [1, 3, 5, 10, 14, 40, 500])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_update_matches_pandas(count, seed):
+    records = make_history(count, seed)
+    engine = StatsEngine()
+    for record in records:
+        engine.update(record['date'], record['weight'], record['body_fat'])
+    assert_matches(engine, pandas_stats(records),
+                   exact={'first', 'current', 'min', 'max', 'ma5', 'ma14', 'shifted_ma'})
+
+
+@pytest.mark.parametrize('count', [1, 3, 5, 10, 14, 40, 500])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_from_columns_matches_pandas(count, seed):
+    records = make_history(count, seed)
+    assert_matches(StatsEngine.from_columns(records), pandas_stats(records),
+                   exact={'first', 'current', 'min', 'max', 'std'})
+
+
+def test_from_columns_returns_stored_values():
+    records = make_history(10, 0)
+    records.column('weight')[0] = 66.48
+    # float32 を広げた 66.48000030517578 ではなく、記録として返す 66.48 になる
+    assert StatsEngine.from_columns(records).summary()['metrics']['weight']['first'] == 66.48
+
+
+def stored_rows(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = SimpleFitnessTracker(data_file=str(tmp_path / 'fitness_data.jsonl'),
+                                   legacy_data_file=str(tmp_path / 'fitness_data.json'))
+    yield tracker
+    tracker.close()
+
+
+@pytest.mark.parametrize('count', [3, 5, 10, 14, 40])
+def test_add_measurement_matches_pandas(tracker, count):
+    rng = np.random.default_rng(count)
+    start = datetime(2025, 2, 1, 7)
+    for i in range(count):
+        tracker.add_measurement(round(float(66.5 + rng.normal(0, 0.6)), 2), round(float(23 + rng.normal(0, 0.8)), 1),
+                                start + timedelta(days=i))
+    assert_matches(tracker.stats, pandas_stats(stored_rows(tracker.data_file)),
+                   exact={'first', 'current', 'min', 'max', 'ma5', 'ma14', 'shifted_ma'})
+
+
+def test_reload_matches_pandas(tracker):
+    start = datetime(2025, 2, 1, 7)
+    for i, (weight, body_fat) in enumerate([(66.48, 23.1), (66.3, 22.9), (65.3, 23.4), (66.02, 22.7), (65.87, 22.8),
+                                            (65.5, 22.6), (65.61, 22.5), (65.2, 22.9), (65.05, 22.4), (64.93, 22.2)]):
+        tracker.add_measurement(weight, body_fat, start + timedelta(days=i))
+    expected = pandas_stats(stored_rows(tracker.data_file))
+    reloaded = SimpleFitnessTracker(data_file=tracker.data_file, legacy_data_file=tracker.legacy_data_file)
+    try:
+        assert_matches(reloaded.stats, expected, exact={'first', 'current', 'min', 'max', 'std'})
+        assert reloaded.stats.summary()['metrics']['weight']['first'] == 66.48
+    finally:
+        reloaded.close()
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_generated_history_matches_pandas(seed):
+    records = generate_history(500, seed=seed)
+    assert_matches(StatsEngine.from_columns(records), pandas_stats(records),
+                   exact={'first', 'current', 'min', 'max', 'std'})
@@ -0,0 +1,33 @@
+"""ScenarioEngine のキャッシュと当てはまりの計算"""
+import numpy as np
+
+from ideal_curve import get_ideal_curve
+from scenarios import ScenarioEngine
+
+
+def make_engine(**kwargs):
+    days = np.arange(60, dtype=np.float64)
+    curve = get_ideal_curve(np.datetime64('2025-01-01').item(), 70, 25, 8, 6, 168)
+    rng = np.random.default_rng(0)
+    weights = np.asarray(curve.weights)[:60] + rng.normal(0, 0.3, 60)
+    body_fat = np.asarray(curve.body_fat)[:60] + rng.normal(0, 0.5, 60)
+    return ScenarioEngine(days, weights, body_fat, 70, 25, **kwargs)
+
+
+def test_cache_overflow_keeps_overlapping_keys():
+    # 2×2 の格子の後、それと重なる 6×2 の格子でキャッシュ（10件）があふれても引ける
+    engine = make_engine(cache_size=10)
+    engine.sweep(target_weight_loss=[6.0, 8.0], weight_tau=[100.0, 120.0])
+    grid = {'target_weight_loss': [4.0, 6.0, 8.0, 10.0, 12.0, 14.0], 'weight_tau': [100.0, 120.0]}
+    result = engine.sweep(**grid)
+    expected = make_engine(cache_size=0).sweep(**grid)
+    np.testing.assert_array_equal(result['weight_rmse'], expected['weight_rmse'])
+    assert len(engine._weight_fit) <= 10
+
+
+def test_cached_sweep_matches_fresh_engine():
+    engine = make_engine(cache_size=50)
+    first = engine.sweep(target_weight_loss=np.arange(4, 12, 1.0), bf_tau=[80.0, 100.0])
+    again = engine.sweep(target_weight_loss=np.arange(4, 12, 1.0), bf_tau=[80.0, 100.0])
+    for name in ('weight_rmse', 'bf_rmse', 'fit', 'required_deficit'):
+        np.testing.assert_array_equal(first[name], again[name])